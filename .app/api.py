@@ -0,0 +1,139 @@
+# Python file with the versioned JSON API for the product catalogue
+
+# Import the required modules
+import csv
+import io
+import json
+import math
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+from models import db, Product
+from catalogue import PRODUCT_FIELDS, filter_products, get_cached_product_page
+from versions import conditional_view
+
+# Create the blueprint for version 1 of the API
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Number of rows fetched from the database at a time while streaming an export
+EXPORT_BATCH_SIZE = 1000
+
+
+# Function to return a JSON error message with the given status code
+def api_error(message, status):
+   return jsonify({'error': message}), status
+
+
+# Function to read an optional float argument from the query string. Raises ValueError (answered with a 400) for
+# values that aren't finite numbers
+def float_arg(name):
+   value = request.args.get(name)
+   if value in (None, ''):
+      return None
+   try:
+      number = float(value)
+   except ValueError:
+      number = math.nan
+   if not math.isfinite(number):
+      raise ValueError(f"{name} must be a number")
+   return number
+
+
+# Function to read the comma separated list of fields requested by the client
+def requested_fields():
+   fields = request.args.get('fields')
+   if not fields:
+      return list(PRODUCT_FIELDS)
+   fields = [field.strip() for field in fields.split(',') if field.strip()]
+   unknown = [field for field in fields if field not in PRODUCT_FIELDS]
+   if unknown:
+      raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+   return fields
+
+
+# Function to build the filtered product query from the query string
+def filtered_query():
+   return filter_products(q=request.args.get('q'), min_price=float_arg('min_price'),
+                          max_price=float_arg('max_price'))
+
+
+# Route to get a page of products as JSON
+@api.route('/products', methods=['GET'])
+@conditional_view('catalogue')
+def list_products():
+   try:
+      fields = requested_fields()
+      min_price, max_price = float_arg('min_price'), float_arg('max_price')
+   except ValueError as e:
+      return api_error(str(e), 400)
+
+   page = get_cached_product_page(
+      sort=request.args.get('sort', 'name'),
+      direction=request.args.get('dir', 'asc'),
+      after=request.args.get('after'),
+      before=request.args.get('before'),
+      per_page=request.args.get('per_page', 25),
+      q=request.args.get('q'),
+      min_price=min_price,
+      max_price=max_price,
+   )
+   return jsonify({
+      'data': [{field: product[field] for field in fields} for product in page.items],
+      'sort': page.sort,
+      'dir': page.direction,
+      'per_page': page.per_page,
+      'next_cursor': page.next_cursor,
+      'prev_cursor': page.prev_cursor,
+   })
+
+
+# Generator that reads the selected product columns in batches without loading ORM objects
+def iter_product_rows(query, fields):
+   statement = (query.with_entities(*[getattr(Product, field) for field in fields])
+                .order_by(Product.id).statement)
+   result = db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+   for row in result:
+      yield row
+
+
+# Generator that writes the products as newline delimited JSON (one object per line)
+def generate_ndjson(rows, fields):
+   for row in rows:
+      yield json.dumps(dict(zip(fields, row)), separators=(',', ':')) + '\n'
+
+
+# Generator that writes the products as CSV, flushing the buffer after each batch of rows
+def generate_csv(rows, fields):
+   buffer = io.StringIO()
+   writer = csv.writer(buffer)
+   writer.writerow(fields)
+   for count, row in enumerate(rows, start=1):
+      writer.writerow(row)
+      if count % EXPORT_BATCH_SIZE == 0:
+         yield buffer.getvalue()
+         buffer.seek(0)
+         buffer.truncate()
+   yield buffer.getvalue()
+
+
+# Route to stream the whole (filtered) product table as NDJSON or CSV
+@api.route('/products/export', methods=['GET'])
+def export_products():
+   export_format = request.args.get('format', 'ndjson').lower()
+   if export_format not in ('ndjson', 'csv'):
+      return api_error("format must be either 'ndjson' or 'csv'", 400)
+   try:
+      fields = requested_fields()
+      query = filtered_query()
+   except ValueError as e:
+      return api_error(str(e), 400)
+
+   rows = iter_product_rows(query, fields)
+   if export_format == 'csv':
+      body, mimetype = generate_csv(rows, fields), 'text/csv'
+   else:
+      body, mimetype = generate_ndjson(rows, fields), 'application/x-ndjson'
+
+   response = Response(stream_with_context(body), mimetype=mimetype)
+   response.headers['Content-Disposition'] = f'attachment; filename=products.{export_format}'
+   return response
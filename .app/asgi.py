@@ -0,0 +1,260 @@
+# Python file with the ASGI entry point of the application, e.g. 'uvicorn asgi:app --workers 4' or
+# 'hypercorn asgi:app' (install the server with pip). The Flask application is served through a2wsgi, in a pool
+# of ASGI_THREADS threads, and the I/O bound read pages (/products and /get_tasks) are native Flask async views
+# on SQLAlchemy's async engine (aiosqlite for SQLite). Flask dispatches them like any other view (request hooks,
+# error handlers, compression, ETags), and their coroutines run on the server's event loop, where the async
+# engine's connections live. Only the queries are awaited there: the cache and the templates are used in a
+# thread. The stream of catalogue changes (/products/events) is a small ASGI route of its own, so its clients
+# wait on the event loop instead of holding a thread each
+
+# Import the required modules
+import asyncio
+from functools import wraps
+
+from a2wsgi import WSGIMiddleware
+from flask import Flask, current_app, jsonify, render_template, request
+from flask_login import current_user
+from sqlalchemy import event, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.wrappers import Request
+
+from catalogue import DEFAULT_PAGE_SIZE, ProductPage, get_cache, plan_product_page, product_page_key, product_to_dict
+from events import DEFAULT_KEEPALIVE, EVENT_STREAM_HEADERS, async_event_stream, resume_from
+from index import app as flask_app
+from metrics import instrument_engine
+from models import db, engine_options, sqlite_pragma_listener, Product, Task
+from tasks import parse_task_args, plan_tasks_page, plan_task_changes, tasks_payload, sync_time, DEFAULT_SYNC_MARGIN
+from versions import check_conditional, add_validators
+
+# The async drivers used for the databases the application supports
+ASYNC_DRIVERS = {
+   'sqlite': 'sqlite+aiosqlite',
+   'postgresql': 'postgresql+asyncpg',
+   'mysql': 'mysql+aiomysql',
+}
+
+
+# Function to get the URL of the async engine: ASYNC_DATABASE_URI, or the application's database with the async
+# driver. Returns None when there is none (e.g. an in-memory SQLite database, which only the application's own
+# connection can see), in which case the normal views are kept
+def async_database_url(app):
+   if app.config.get('ASYNC_DATABASE_URI'):
+      return make_url(app.config['ASYNC_DATABASE_URI'])
+   with app.app_context():
+      url = db.engine.url  # with relative SQLite paths already resolved to the instance folder
+   if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+      return None
+   driver = ASYNC_DRIVERS.get(url.get_backend_name())
+   return url.set(drivername=driver) if driver is not None else None
+
+
+# Function to create the async engine, with the same pool settings and SQLite pragmas as the application's engine
+def create_async_db_engine(app, url):
+   engine = create_async_engine(url, **engine_options({**app.config, 'SQLALCHEMY_DATABASE_URI': url}))
+   if url.get_backend_name() == 'sqlite' and app.config.get('SQLITE_PRAGMAS'):
+      event.listen(engine.sync_engine, 'connect', sqlite_pragma_listener(app.config['SQLITE_PRAGMAS']))
+   return engine
+
+
+# Function to open a session on the async engine of the current application
+def async_session():
+   return current_app.extensions['async_sessions']()
+
+
+# Decorator to answer conditional requests for an async view (the async version of versions.conditional_view())
+def async_conditional_view(*names):
+   def decorator(view):
+      @wraps(view)
+      async def wrapper(*args, **kwargs):
+         conditional = await asyncio.to_thread(check_conditional, names)
+         if conditional is None:
+            return await view(*args, **kwargs)
+
+         etag, last_modified, not_modified = conditional
+         if not_modified:
+            response = current_app.response_class(status=304)
+         else:
+            response = current_app.make_response(await view(*args, **kwargs))
+            if response.status_code != 200:
+               return response
+         return add_validators(response, etag, last_modified)
+      return wrapper
+   return decorator
+
+
+# Function to get a page of the catalogue through the cache (the async version of
+# catalogue.get_cached_product_page())
+async def get_cached_product_page(sort='name', direction='asc', after=None, before=None,
+                                  per_page=DEFAULT_PAGE_SIZE):
+   cache = get_cache()
+   key = None
+   if cache is not None:
+      key = await asyncio.to_thread(product_page_key, sort, direction, after, before, per_page)
+      cached = await asyncio.to_thread(cache.get, key)
+      if cached is not None:
+         return ProductPage(**cached)
+
+   query, finish = plan_product_page(sort, direction, after, before, per_page, select(Product))
+   async with async_session() as db_session:
+      page = finish((await db_session.scalars(query)).all())
+   page = page._replace(items=[product_to_dict(product) for product in page.items])
+   if cache is not None:
+      await asyncio.to_thread(cache.set, key, page._asdict())
+   return page
+
+
+# Async view of the product's page (replaces products() in index.py)
+@async_conditional_view('catalogue')
+async def products():
+   page = await get_cached_product_page(
+      sort=request.args.get('sort', 'name'),
+      direction=request.args.get('dir', 'asc'),
+      after=request.args.get('after'),
+      before=request.args.get('before'),
+      per_page=request.args.get('per_page', 25),
+   )
+   return await asyncio.to_thread(render_template, 'products.html', products=page.items, page=page)
+
+
+# Async view of the to-do tasks (replaces get_tasks() in index.py)
+@async_conditional_view('tasks')
+async def get_tasks():
+   # Flask-Login loads the user with the normal database, so that is done in a thread
+   user = await asyncio.to_thread(current_user._get_current_object)
+   user_id = user.id if user.is_authenticated else None
+   try:
+      options = parse_task_args(request.args)
+      since = options.pop('since')
+      server_time = sync_time(current_app.config.get('TASK_SYNC_MARGIN', DEFAULT_SYNC_MARGIN))
+      if since is None:
+         query, finish = plan_tasks_page(user_id, select(Task), **options)
+      else:
+         query, finish = plan_task_changes(user_id, since, select(Task), **options)
+      async with async_session() as db_session:
+         rows, next_cursor = finish((await db_session.scalars(query)).all())
+   except ValueError as e:
+      return jsonify({'error': str(e)}), 400
+   return jsonify(tasks_payload(rows, next_cursor, since, server_time))
+
+
+# The views replaced by async views when there is an async engine
+ASYNC_VIEWS = {
+   'main.products': products,
+   'main.get_tasks': get_tasks,
+}
+
+
+# Function to read the headers and the query string of an ASGI request (all the event stream needs)
+def scope_request(scope):
+   environ = {'REQUEST_METHOD': scope['method'], 'QUERY_STRING': scope.get('query_string', b'').decode('latin-1')}
+   for name, value in scope.get('headers', ()):
+      environ['HTTP_' + name.decode('latin-1').upper().replace('-', '_')] = value.decode('latin-1')
+   return Request(environ)
+
+
+# Function to wait until the client of an ASGI request disconnects
+async def wait_for_disconnect(receive):
+   while (await receive())['type'] != 'http.disconnect':
+      pass
+
+
+# Function to stream the catalogue changes to a client (the same stream as product_events() in index.py, but
+# waiting on the event loop instead of in a thread). The next chunk is raced against the disconnect, so a client
+# that goes away stops its stream straight away rather than at the next event or keep-alive
+async def stream_product_events(app, scope, receive, send):
+   bus = app.extensions['catalogue_events']
+   last_id = await asyncio.to_thread(resume_from, scope_request(scope), bus)
+   await send({'type': 'http.response.start', 'status': 200,
+               'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                           for name, value in EVENT_STREAM_HEADERS]})
+   if scope['method'] == 'HEAD':
+      await send({'type': 'http.response.body', 'body': b''})
+      return
+   loop = asyncio.get_running_loop()
+   chunks = async_event_stream(bus, last_id, app.config.get('CATALOGUE_EVENTS_KEEPALIVE', DEFAULT_KEEPALIVE))
+   disconnected = loop.create_task(wait_for_disconnect(receive))
+   try:
+      while True:
+         chunk = loop.create_task(anext(chunks))
+         await asyncio.wait((chunk, disconnected), return_when=asyncio.FIRST_COMPLETED)
+         if not chunk.done():
+            chunk.cancel()
+            await asyncio.wait((chunk,))  # the generator can only be closed once it has stopped running
+            break
+         try:
+            text = chunk.result()
+         except StopAsyncIteration:
+            break
+         await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+   finally:
+      disconnected.cancel()
+      await chunks.aclose()
+
+
+# Class of the ASGI application: the Flask application (with its async views) through a2wsgi, and the event
+# stream on the event loop
+class AsgiApplication:
+   def __init__(self, app, views=ASYNC_VIEWS):
+      self.app = app
+      self.wsgi = WSGIMiddleware(app, workers=app.config.get('ASGI_THREADS', 32))
+      self.loop = None
+      self.event_paths = {rule.rule for rule in app.url_map.iter_rules('main.product_events')}
+      url = async_database_url(app)
+      self.engine = create_async_db_engine(app, url) if url is not None else None
+      if self.engine is not None:
+         app.extensions['async_sessions'] = async_sessionmaker(self.engine, expire_on_commit=False)
+         app.view_functions.update(views)
+         app.async_to_sync = self.async_to_sync
+         if 'metrics' in app.extensions:
+            instrument_engine(app.extensions['metrics'], self.engine.sync_engine)
+
+   async def __call__(self, scope, receive, send):
+      self.loop = asyncio.get_running_loop()
+      if scope['type'] == 'lifespan':
+         await self.lifespan(receive, send)
+      elif scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD') and self.is_event_stream(scope):
+         await stream_product_events(self.app, scope, receive, send)
+      else:
+         await self.wsgi(scope, receive, send)
+
+   # Method to check whether a request is for the event stream
+   def is_event_stream(self, scope):
+      root_path = scope.get('root_path', '')
+      path = scope['path'][len(root_path):] if root_path and scope['path'].startswith(root_path) else scope['path']
+      return path in self.event_paths
+
+   # Method used by Flask to run an async view from its thread (see Flask.async_to_sync()). The coroutine runs
+   # on the server's event loop, as the async engine's connections belong to it, and the thread waits for it
+   def async_to_sync(self, func):
+      def run(*args, **kwargs):
+         if self.loop is None or not self.loop.is_running():
+            return Flask.async_to_sync(self.app, func)(*args, **kwargs)
+         return asyncio.run_coroutine_threadsafe(func(*args, **kwargs), self.loop).result()
+      return run
+
+   # Method to answer the server's start-up and shut-down messages. On shut-down the thread pool is stopped, the
+   # write-behind buffer is drained and the async engine's connections are closed (every aiosqlite connection
+   # has a thread that would keep the process from exiting)
+   async def lifespan(self, receive, send):
+      while True:
+         message = await receive()
+         if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+         elif message['type'] == 'lifespan.shutdown':
+            await asyncio.to_thread(self.wsgi.executor.shutdown)
+            if 'write_behind' in self.app.extensions:
+               await asyncio.to_thread(self.app.extensions['write_behind'].close)
+            if self.engine is not None:
+               await self.engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+# Function to create the ASGI application serving a Flask application
+def create_asgi_app(app):
+   return AsgiApplication(app)
+
+
+# Create the application used by ASGI servers, e.g. 'uvicorn asgi:app' (the Flask application of index.py)
+app = create_asgi_app(flask_app)
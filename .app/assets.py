@@ -0,0 +1,228 @@
+# Python file for the static asset pipeline. 'flask --app index build-assets' copies the files of the static
+# folder into static/build with a hash of their content in the name (css/main.css -> css/main.1a2b3c4d5e.css),
+# and writes gzip (and, when the brotli package is installed, brotli) versions of the text files next to them.
+# As a hashed file never changes, it is served from /assets with a one year 'immutable' Cache-Control, so
+# browsers stop revalidating the stylesheets and scripts on every page. The asset_url() template function gives
+# the hashed URL of a file, or the normal /static URL when the assets haven't been built.
+# The files of the previous builds are kept (up to KEEP_BUILDS builds), as pages cached by browsers or by the
+# fragment cache, and workers still running with the previous manifest, keep asking for them
+
+# Import the required modules
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+import click
+from flask import Blueprint, abort, current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+
+try:
+   import brotli
+except ImportError:  # brotli is optional, only the gzip versions are written without it
+   brotli = None
+
+# Create the blueprint serving the built assets. It is registered on the application by create_app()
+assets = Blueprint('assets', __name__, url_prefix='/assets')
+
+# Folder (inside the static folder) the built assets are written to, and the name of the manifest mapping the
+# original names to the hashed ones. The history lists the files of the latest builds, newest first
+BUILD_FOLDER = 'build'
+MANIFEST_NAME = 'manifest.json'
+HISTORY_NAME = 'builds.json'
+# Number of builds whose files are kept (the current one and the ones before it)
+KEEP_BUILDS = 3
+
+# Files worth compressing (fonts such as woff2 and images are compressed already)
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.xml', '.ttf', '.otf', '.eot', '.map'}
+# Files smaller than this aren't compressed (the saving is smaller than the cost of the extra request header)
+MIN_COMPRESS_SIZE = 512
+# How long browsers may keep a built asset (one year, the longest value respected by browsers)
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+# url(...) and @import "..." references in stylesheets
+CSS_REFERENCE = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)|@import\s+(['"])([^'"]+)\3''')
+
+
+# Function to add a hash of the content to a file name
+def hashed_name(name, content):
+   root, extension = posixpath.splitext(name)
+   return f"{root}.{hashlib.sha256(content).hexdigest()[:10]}{extension}"
+
+
+# Class to build the assets of a static folder
+class AssetBuilder:
+   def __init__(self, static_folder):
+      self.static_folder = static_folder
+      self.build_folder = os.path.join(static_folder, BUILD_FOLDER)
+      self.manifest = {}
+
+   # Method to list the files of the static folder (as paths relative to it, with '/' separators)
+   def sources(self):
+      for folder, subfolders, files in os.walk(self.static_folder):
+         relative = os.path.relpath(folder, self.static_folder)
+         if relative == BUILD_FOLDER or relative.startswith(BUILD_FOLDER + os.sep):
+            subfolders[:] = []
+            continue
+         for file in files:
+            yield posixpath.normpath(posixpath.join(relative.replace(os.sep, '/'), file))
+
+   # Method to point the references of a stylesheet to the hashed names of the files they refer to
+   def rewrite_css(self, name, text):
+      folder = posixpath.dirname(name)
+
+      def replace(match):
+         reference = match.group(2) or match.group(4)
+         if re.match(r'^(?:[a-z]+:|//|/|#|data:)', reference, re.IGNORECASE):
+            return match.group(0)  # absolute URLs (e.g. CDNs) and data URIs stay as they are
+         path, _, suffix = reference.partition('?')
+         target = posixpath.normpath(posixpath.join(folder, path))
+         built = self.build(target)
+         if built is None:
+            return match.group(0)
+         new_reference = posixpath.relpath(built, folder or '.') + (f"?{suffix}" if suffix else '')
+         return match.group(0).replace(reference, new_reference)
+
+      return CSS_REFERENCE.sub(replace, text)
+
+   # Method to build a file (and, for stylesheets, the files they refer to first). Returns its hashed name,
+   # or None for files that don't exist
+   def build(self, name):
+      if name in self.manifest:
+         return self.manifest[name]
+      source = os.path.join(self.static_folder, *name.split('/'))
+      if not os.path.isfile(source):
+         return None
+      with open(source, 'rb') as file:
+         content = file.read()
+      if name.endswith('.css'):
+         self.manifest[name] = name  # guards against stylesheets importing each other
+         content = self.rewrite_css(name, content.decode('utf-8')).encode('utf-8')
+      built = hashed_name(name, content)
+      self.manifest[name] = built
+      self.write(built, content)
+      return built
+
+   # Method to write a built file and its compressed versions
+   def write(self, built, content):
+      target = os.path.join(self.build_folder, *built.split('/'))
+      os.makedirs(os.path.dirname(target), exist_ok=True)
+      with open(target, 'wb') as file:
+         file.write(content)
+      if posixpath.splitext(built)[1].lower() not in COMPRESSIBLE or len(content) < MIN_COMPRESS_SIZE:
+         return
+      # mtime=0 makes the gzip output depend on the content only, so rebuilding gives identical files
+      with open(target + '.gz', 'wb') as file:
+         file.write(gzip.compress(content, compresslevel=9, mtime=0))
+      if brotli is not None:
+         with open(target + '.br', 'wb') as file:
+            file.write(brotli.compress(content, quality=11))
+
+   # Method to write a JSON file of the build folder. It is written under another name first and then renamed,
+   # so a worker starting meanwhile never reads half a file
+   def write_json(self, name, data):
+      target = os.path.join(self.build_folder, name)
+      with open(target + '.tmp', 'w') as file:
+         json.dump(data, file, indent=2, sort_keys=True)
+      os.replace(target + '.tmp', target)
+
+   # Method to read the history of the builds (the hashed names of each build's files, newest first). A folder
+   # built before the history was kept has the files of its manifest as the only earlier build
+   def read_history(self):
+      try:
+         with open(os.path.join(self.build_folder, HISTORY_NAME)) as file:
+            return json.load(file)
+      except (OSError, ValueError):
+         previous = load_manifest(self.static_folder)
+         return [sorted(set(previous.values()))] if previous else []
+
+   # Method to delete the built files (and their compressed versions) that no kept build uses
+   def prune(self, history):
+      kept = {name for build in history for name in build}
+      kept |= {name + extension for name in kept for extension in ('.gz', '.br')}
+      for folder, _, files in os.walk(self.build_folder):
+         for file in files:
+            path = os.path.join(folder, file)
+            name = os.path.relpath(path, self.build_folder).replace(os.sep, '/')
+            if name not in kept and name not in (MANIFEST_NAME, HISTORY_NAME):
+               os.remove(path)
+
+   # Method to build every file of the static folder and write the manifest, keeping the files of the last
+   # keep builds. Returns the manifest
+   def build_all(self, keep=KEEP_BUILDS):
+      history = self.read_history()
+      for name in sorted(self.sources()):
+         self.build(name)
+      os.makedirs(self.build_folder, exist_ok=True)
+      history = ([sorted(set(self.manifest.values()))] + history)[:max(keep, 1)]
+      self.write_json(MANIFEST_NAME, self.manifest)
+      self.write_json(HISTORY_NAME, history)
+      self.prune(history)
+      return self.manifest
+
+
+# Function to read the manifest of the built assets (empty when the assets haven't been built)
+def load_manifest(static_folder):
+   try:
+      with open(os.path.join(static_folder, BUILD_FOLDER, MANIFEST_NAME)) as file:
+         return json.load(file)
+   except (OSError, ValueError):
+      return {}
+
+
+# Function to get the URL of a static file: the hashed (long cached) file when the assets are built, else the
+# file in the static folder
+def asset_url(filename):
+   built = current_app.extensions['asset_manifest'].get(filename)
+   if built is not None:
+      return url_for('assets.serve', filename=built)
+   return url_for('static', filename=filename)
+
+
+# Function to get the URLs of the fonts to preload (the configured fonts that exist)
+def preload_fonts():
+   manifest = current_app.extensions['asset_manifest']
+   fonts = current_app.config.get('PRELOAD_FONTS', ())
+   return [asset_url(font) for font in fonts
+           if font in manifest or os.path.isfile(os.path.join(current_app.static_folder, *font.split('/')))]
+
+
+# Route to a built asset, sent as brotli or gzip when the browser accepts it and the compressed file exists
+@assets.route('/<path:filename>')
+def serve(filename):
+   folder = os.path.join(current_app.static_folder, BUILD_FOLDER)
+   if filename in (MANIFEST_NAME, HISTORY_NAME) or filename.endswith(('.gz', '.br', '.tmp')):
+      abort(404)
+   mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+   served, encoding = filename, None
+   for extension, name in (('.br', 'br'), ('.gz', 'gzip')):
+      if request.accept_encodings[name] and os.path.isfile(os.path.join(folder, *(filename + extension).split('/'))):
+         served, encoding = filename + extension, name
+         break
+   response = send_from_directory(folder, served, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+   if encoding is not None:
+      response.headers['Content-Encoding'] = encoding
+   response.headers['Vary'] = 'Accept-Encoding'
+   response.cache_control.public = True
+   response.cache_control.immutable = True
+   return response
+
+
+# Function to attach the asset helpers to the application (the manifest is read once, at start-up)
+def init_assets(app):
+   app.extensions['asset_manifest'] = load_manifest(app.static_folder)
+   app.jinja_env.globals.update(asset_url=asset_url, preload_fonts=preload_fonts)
+
+
+# Flask CLI command to build the assets, e.g. 'flask --app index build-assets' (run when deploying)
+@click.command('build-assets')
+@click.option('--keep', default=KEEP_BUILDS, show_default=True, help='Builds whose files are kept.')
+@with_appcontext
+def build_assets_command(keep):
+   manifest = AssetBuilder(current_app.static_folder).build_all(keep)
+   current_app.extensions['asset_manifest'] = manifest
+   click.echo(f"Built {len(manifest)} assets into {os.path.join(current_app.static_folder, BUILD_FOLDER)}"
+              + ("" if brotli is not None else " (install brotli to also write .br files)"))
@@ -0,0 +1,291 @@
+# Python script to load-test the main routes (/products, /login and /get_tasks) at several catalogue sizes.
+# Every route is requested through the Flask test client (no network, measures the application itself) and,
+# with --server, through a threaded WSGI server with several concurrent clients. For each route it reports
+# the p50/p95/p99 latency, the requests per second and the SQL queries per request, and writes the results
+# as JSON (tagged with the git commit) so that runs on different commits can be compared with --compare.
+# Usage: python benchmarks/bench_routes.py [--sizes 1000,10000,100000] [--requests 500] [--server]
+#                                          [--output results.json] [--compare previous.json]
+
+# Import the required modules
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+# Folder holding the application (the parent of this benchmarks folder)
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+# Keep the application created when index is imported away from the development database
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from sqlalchemy import event  # noqa: E402
+
+# Login used by the /login benchmark (one of the seeded admins)
+LOGIN_EMAIL = 'admin1@ds2505.ac.ke'
+LOGIN_PASSWORD = 'ChangeM3@123'
+
+
+# Class to count the SQL statements sent to the database (safe to use from several threads)
+class QueryCounter:
+   def __init__(self):
+      self._lock = threading.Lock()
+      self.count = 0
+
+   # Method called by SQLAlchemy before every statement
+   def __call__(self, *args, **kwargs):
+      with self._lock:
+         self.count += 1
+
+   # Method to read the count and start again from zero
+   def take(self):
+      with self._lock:
+         count, self.count = self.count, 0
+         return count
+
+
+# Function to create an application with a new database holding a catalogue of the given size
+def build_app(folder, size, bcrypt_rounds):
+   from config import TestingConfig
+   from index import create_app, create_tables, create_search_index, seed_all
+   from seed_synthetic import seed_synthetic_products
+   from models import db, Product
+
+   config = {key: getattr(TestingConfig, key) for key in dir(TestingConfig) if key.isupper()}
+   config.update({
+      'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(folder, f'bench_{size}.db')}",
+      'BCRYPT_LOG_ROUNDS': bcrypt_rounds,
+      # The benchmark logs in far more often than a person would
+      'LOGIN_THROTTLE_EMAIL_LIMIT': 10 ** 9,
+      'LOGIN_THROTTLE_IP_LIMIT': 10 ** 9,
+   })
+   app = create_app(config)
+   with app.app_context():
+      create_tables()
+      create_search_index()
+   seed_all(app)
+   with app.app_context():
+      # The synthetic catalogue comes from a fixed seed, so every run benchmarks the same products
+      seed_synthetic_products(max(0, size - Product.query.count()))
+   return app
+
+
+# Function to list the requests made for each route: (method, path, form data) tuples used in turn
+def route_requests(app):
+   from catalogue import get_product_page
+   with app.app_context():
+      page = get_product_page(per_page=25)
+   products = ['/products', '/products?sort=price', '/products?sort=price&direction=desc',
+               '/products?q=coffee']
+   if page.next_cursor:
+      products.append('/products?' + urlencode({'after': page.next_cursor}))
+   return {
+      '/products': [('GET', path, None) for path in products],
+      '/login': [('POST', '/login', {'email': LOGIN_EMAIL, 'password': LOGIN_PASSWORD})],
+      '/get_tasks': [('GET', '/get_tasks', None), ('GET', '/get_tasks?done=false', None)],
+   }
+
+
+# Function to work out the statistics of a set of latencies (in seconds)
+def summarise(latencies, elapsed, queries, errors=0):
+   cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+   return {
+      'requests': len(latencies),
+      'p50_ms': round(cuts[49] * 1000, 3),
+      'p95_ms': round(cuts[94] * 1000, 3),
+      'p99_ms': round(cuts[98] * 1000, 3),
+      'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+      'requests_per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+      'queries_per_request': round(queries / len(latencies), 2),
+      # Responses with an error status (e.g. 503 when the password hashing queue is full)
+      'errors': errors,
+   }
+
+
+# Function to benchmark a route through the Flask test client (one request at a time)
+def bench_test_client(app, calls, count, warmup, counter):
+   client = app.test_client()
+   calls = itertools.cycle(calls)
+   for _ in range(warmup):
+      method, path, data = next(calls)
+      client.open(path, method=method, data=data)
+   counter.take()
+   latencies = []
+   errors = 0
+   started = time.perf_counter()
+   for _ in range(count):
+      method, path, data = next(calls)
+      request_started = time.perf_counter()
+      response = client.open(path, method=method, data=data)
+      latencies.append(time.perf_counter() - request_started)
+      errors += response.status_code >= 400
+   elapsed = time.perf_counter() - started
+   return summarise(latencies, elapsed, counter.take(), errors)
+
+
+# Function to benchmark a route through a threaded WSGI server with several concurrent clients
+def bench_server(port, calls, count, warmup, concurrency, counter):
+   calls = list(calls)
+   latencies = []
+   errors = 0
+   lock = threading.Lock()
+   remaining = itertools.count()
+
+   # Function run by every client thread (each with its own keep-alive connection)
+   def client(measure, total):
+      nonlocal errors
+      connection = http.client.HTTPConnection('127.0.0.1', port)
+      timings = []
+      failed = 0
+      try:
+         while next(remaining) < total:
+            method, path, data = calls[len(timings) % len(calls)]
+            body = urlencode(data) if data else None
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'} if data else {}
+            request_started = time.perf_counter()
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            timings.append(time.perf_counter() - request_started)
+            failed += response.status >= 400
+      finally:
+         connection.close()
+      if measure:
+         with lock:
+            latencies.extend(timings)
+            errors += failed
+
+   # Function to run the clients until the given number of requests has been made
+   def run(measure, total):
+      nonlocal remaining
+      remaining = itertools.count()
+      threads = [threading.Thread(target=client, args=(measure, total)) for _ in range(concurrency)]
+      for thread in threads:
+         thread.start()
+      for thread in threads:
+         thread.join()
+
+   run(False, warmup)
+   counter.take()
+   started = time.perf_counter()
+   run(True, count)
+   elapsed = time.perf_counter() - started
+   return summarise(latencies, elapsed, counter.take(), errors)
+
+
+# Function to get the current git commit (None outside a git checkout)
+def git_commit():
+   try:
+      return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=APP_DIR, capture_output=True, text=True,
+                            check=True).stdout.strip()
+   except (OSError, subprocess.CalledProcessError):
+      return None
+
+
+# Function to print a table of results, with the change from a previous run when given
+def print_results(results, previous=None):
+   previous = {(r['mode'], r['catalogue_size'], r['route']): r for r in (previous or [])}
+   print(f"{'mode':<8}{'products':>10}  {'route':<12}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>10}"
+         f"{'queries':>9}{'errors':>8}{'p50 change':>12}")
+   for result in results:
+      before = previous.get((result['mode'], result['catalogue_size'], result['route']))
+      change = ''
+      if before and before['p50_ms']:
+         change = f"{(result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100:+.1f}%"
+      print(f"{result['mode']:<8}{result['catalogue_size']:>10,}  {result['route']:<12}{result['p50_ms']:>9.2f}"
+            f"{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}{result['requests_per_second']:>10,.1f}"
+            f"{result['queries_per_request']:>9.2f}{result['errors']:>8}{change:>12}")
+
+
+def main():
+   parser = argparse.ArgumentParser(description='Load-test the main routes of the application')
+   parser.add_argument('--sizes', default='1000,10000,100000', help='comma separated catalogue sizes')
+   parser.add_argument('--routes', default='/products,/login,/get_tasks', help='comma separated routes')
+   parser.add_argument('--requests', type=int, default=500, help='measured requests per route')
+   parser.add_argument('--warmup', type=int, default=50, help='unmeasured requests made first')
+   parser.add_argument('--server', action='store_true', help='also run through a threaded WSGI server')
+   parser.add_argument('--concurrency', type=int, default=8, help='client threads used with --server')
+   parser.add_argument('--bcrypt-rounds', type=int, default=4,
+                       help='bcrypt cost of the seeded passwords (12 in production)')
+   parser.add_argument('--output', help='file to write the JSON results to')
+   parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+   args = parser.parse_args()
+
+   from models import db
+   from werkzeug.serving import make_server, WSGIRequestHandler
+
+   # Request handler that doesn't log every request to the console
+   class QuietHandler(WSGIRequestHandler):
+      def log_request(self, *args, **kwargs):
+         pass
+
+   sizes = [int(size) for size in args.sizes.split(',')]
+   routes = args.routes.split(',')
+   results = []
+   with tempfile.TemporaryDirectory() as folder:
+      for size in sizes:
+         started = time.perf_counter()
+         app = build_app(folder, size, args.bcrypt_rounds)
+         print(f"Built a catalogue of {size:,} products in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+         counter = QueryCounter()
+         with app.app_context():
+            engine = db.engine
+         event.listen(engine, 'before_cursor_execute', counter)
+         calls = route_requests(app)
+
+         modes = [('client', None)]
+         server = None
+         if args.server:
+            server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            modes.append(('server', server.server_port))
+         try:
+            for mode, port in modes:
+               for route in routes:
+                  if mode == 'client':
+                     stats = bench_test_client(app, calls[route], args.requests, args.warmup, counter)
+                  else:
+                     stats = bench_server(port, calls[route], args.requests, args.warmup, args.concurrency,
+                                          counter)
+                  results.append(dict(mode=mode, catalogue_size=size, route=route, **stats))
+         finally:
+            if server is not None:
+               server.shutdown()
+            # The last login times are written before the temporary database goes away
+            if 'write_behind' in app.extensions:
+               app.extensions['write_behind'].close()
+            event.remove(engine, 'before_cursor_execute', counter)
+            engine.dispose()
+
+   previous = None
+   if args.compare:
+      with open(args.compare) as file:
+         previous = json.load(file)['results']
+   print_results(results, previous)
+
+   if args.output:
+      document = {
+         'commit': git_commit(),
+         'created_at': datetime.now(timezone.utc).isoformat(),
+         'python': platform.python_version(),
+         'platform': platform.platform(),
+         'settings': {'requests': args.requests, 'warmup': args.warmup, 'concurrency': args.concurrency,
+                      'bcrypt_rounds': args.bcrypt_rounds},
+         'results': results,
+      }
+      with open(args.output, 'w') as file:
+         json.dump(document, file, indent=2)
+      print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,60 @@
+# Python script to measure the start-up time of the application.
+# It compares importing the app (what every worker does when it starts) with importing it and seeding the
+# database (what every import used to do before seeding moved to the 'flask seed' command).
+# Usage: python benchmarks/bench_startup.py [--repeat 5]
+
+# Import the required modules
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Folder holding the application (the parent of this benchmarks folder)
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Function to run a Python snippet in a fresh interpreter against the given database and time it
+def time_python(code, database_url):
+   env = dict(os.environ, DATABASE_URL=database_url)
+   started = time.perf_counter()
+   subprocess.run([sys.executable, '-c', code], cwd=APP_DIR, env=env, check=True,
+                  stdout=subprocess.DEVNULL)
+   return time.perf_counter() - started
+
+
+# Function to time a snippet several times, each run against a new (or the same, warm) database
+def measure(code, repeat, fresh_database):
+   timings = []
+   with tempfile.TemporaryDirectory() as folder:
+      for run in range(repeat):
+         name = f"bench_{run}.db" if fresh_database else "bench.db"
+         timings.append(time_python(code, f"sqlite:///{os.path.join(folder, name)}"))
+   return timings
+
+
+# Function to print the summary of a set of timings
+def report(label, timings):
+   print(f"{label:<34} median {statistics.median(timings) * 1000:8.1f} ms   "
+         f"min {min(timings) * 1000:8.1f} ms   max {max(timings) * 1000:8.1f} ms")
+
+
+def main():
+   parser = argparse.ArgumentParser(description='Measure the start-up time of the application')
+   parser.add_argument('--repeat', type=int, default=5, help='number of runs per measurement')
+   args = parser.parse_args()
+
+   import_app = 'import index'
+   seed_app = 'import index; from index import app, create_tables, seed_all\n' \
+              'with app.app_context(): create_tables()\n' \
+              'seed_all(app)'
+
+   report('import app (no database work)', measure(import_app, args.repeat, fresh_database=True))
+   report('import app + seed (fresh db)', measure(seed_app, args.repeat, fresh_database=True))
+   report('import app + seed (seeded db)', measure(seed_app, args.repeat, fresh_database=False))
+
+
+if __name__ == '__main__':
+   main()
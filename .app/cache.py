@@ -0,0 +1,157 @@
+# Python file with the cache backends used to keep the product catalogue out of the database hot path
+
+# Import the required modules
+from collections import OrderedDict
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Default cache settings (can be overridden in the application's configuration)
+DEFAULT_TTL = 60           # seconds an entry stays fresh
+DEFAULT_MAX_ENTRIES = 1024  # entries kept before the least recently used ones are evicted
+# Seconds between two updates of the last access time of a shared cache entry. Each update takes SQLite's write
+# lock, so a hot entry only records that it was read again when its stored time is older than this
+ACCESS_RESOLUTION = 10
+
+
+# In-process cache backend: a thread-safe LRU dictionary with a per-entry time to live (TTL)
+class MemoryCache:
+   def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+      self.ttl = ttl
+      self.max_entries = max_entries
+      self._entries = OrderedDict()
+      self._lock = threading.Lock()
+
+   # Method to get a value from the cache, returns None when missing or expired
+   def get(self, key):
+      with self._lock:
+         entry = self._entries.get(key)
+         if entry is None:
+            return None
+         value, expires = entry
+         if expires is not None and expires < time.monotonic():
+            del self._entries[key]
+            return None
+         self._entries.move_to_end(key)
+         return value
+
+   # Method to add/replace a value in the cache, evicting the least recently used entries when full
+   def set(self, key, value, ttl=None):
+      ttl = self.ttl if ttl is None else ttl
+      expires = time.monotonic() + ttl if ttl else None
+      with self._lock:
+         self._entries[key] = (value, expires)
+         self._entries.move_to_end(key)
+         while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+   # Method to remove a value from the cache
+   def delete(self, key):
+      with self._lock:
+         self._entries.pop(key, None)
+
+   # Method to empty the cache
+   def clear(self):
+      with self._lock:
+         self._entries.clear()
+
+
+# Local shared cache backend: a SQLite file that every worker process on the host can read and write.
+# Values are stored as JSON, so only plain data (dicts, lists, strings and numbers) can be cached. Several
+# caches can share a file, each in its own table
+class SQLiteCache:
+   def __init__(self, path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, table='cache'):
+      if not table.isidentifier():
+         raise ValueError(f"Invalid cache table name: {table!r}")
+      self.path = path
+      self.ttl = ttl
+      self.max_entries = max_entries
+      self.table = table
+      self._local = threading.local()
+      with self._connect() as connection:
+         connection.execute(f'CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                            'expires REAL, accessed REAL NOT NULL)')
+         connection.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_accessed ON {table} (accessed)')
+
+   # Method to get the connection of the current thread (SQLite connections can't be shared by threads)
+   def _connect(self):
+      connection = getattr(self._local, 'connection', None)
+      if connection is None:
+         directory = os.path.dirname(self.path)
+         if directory:
+            os.makedirs(directory, exist_ok=True)
+         connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+         connection.execute('PRAGMA journal_mode=WAL')
+         connection.execute('PRAGMA synchronous=NORMAL')
+         self._local.connection = connection
+      return connection
+
+   # Method to get a value from the cache, returns None when missing or expired
+   def get(self, key):
+      connection = self._connect()
+      row = connection.execute(f'SELECT value, expires, accessed FROM {self.table} WHERE key = ?',
+                               (key,)).fetchone()
+      if row is None:
+         return None
+      now = time.time()
+      if row[1] is not None and row[1] < now:
+         connection.execute(f'DELETE FROM {self.table} WHERE key = ? AND expires < ?', (key, now))
+         return None
+      if now - row[2] >= ACCESS_RESOLUTION:
+         connection.execute(f'UPDATE {self.table} SET accessed = ? WHERE key = ?', (now, key))
+      return json.loads(row[0])
+
+   # Method to add/replace a value in the cache, evicting the least recently used entries when full
+   def set(self, key, value, ttl=None):
+      ttl = self.ttl if ttl is None else ttl
+      now = time.time()
+      connection = self._connect()
+      connection.execute(f'INSERT OR REPLACE INTO {self.table} (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                         (key, json.dumps(value, separators=(',', ':')), now + ttl if ttl else None, now))
+      connection.execute(f'DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} '
+                         'ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+   # Method to remove a value from the cache
+   def delete(self, key):
+      self._connect().execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+
+   # Method to empty the cache
+   def clear(self):
+      self._connect().execute(f'DELETE FROM {self.table}')
+
+
+# Function to create the cache backend selected in the application's configuration
+def create_cache(app):
+   ttl = app.config.get('CATALOGUE_CACHE_TTL', DEFAULT_TTL)
+   max_entries = app.config.get('CATALOGUE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+   backend = app.config.get('CATALOGUE_CACHE_BACKEND', 'memory')
+   if backend == 'memory':
+      return MemoryCache(ttl=ttl, max_entries=max_entries)
+   if backend == 'sqlite':
+      return SQLiteCache(cache_path(app), ttl=ttl, max_entries=max_entries)
+   raise ValueError(f"Unknown catalogue cache backend: {backend}")
+
+
+# Function to create the store of the data versions (see versions.py), on the same backend as the cache but
+# apart from it: the entries filling the cache would otherwise evict the versions, and a lost version brings
+# back the entries it had invalidated. There are only a few versions and they never expire
+def create_version_store(app):
+   backend = app.config.get('CATALOGUE_CACHE_BACKEND', 'memory')
+   if backend == 'memory':
+      return MemoryCache(ttl=0)
+   if backend == 'sqlite':
+      return SQLiteCache(cache_path(app), ttl=0, table='version')
+   raise ValueError(f"Unknown catalogue cache backend: {backend}")
+
+
+# Function to get the path of the shared cache file
+def cache_path(app):
+   return app.config.get('CATALOGUE_CACHE_PATH') or os.path.join(app.instance_path, 'catalogue_cache.db')
+
+
+# Function to attach the catalogue cache and the version store to the application
+def init_cache(app):
+   app.extensions['catalogue_cache'] = create_cache(app)
+   app.extensions['versions'] = create_version_store(app)
@@ -0,0 +1,225 @@
+# Python file with the helper functions used to read the product catalogue one page at a time
+
+# Import the required modules
+from collections import namedtuple
+import base64
+import json
+
+from flask import current_app
+from sqlalchemy import tuple_
+
+from events import publish_catalogue_reset
+from models import db, Product
+from versions import get_version, bump_version
+
+# Default and maximum number of products displayed per page
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+# The columns the catalogue can be sorted by. The product id is always used as the tie-breaker so that
+# every row has a unique position in the sort order (this is what makes keyset pagination stable)
+SORT_COLUMNS = {
+   'name': Product.name,
+   'price': Product.price,
+   'id': Product.id,
+}
+
+# The product fields that can be requested by the API and the export
+PRODUCT_FIELDS = ('id', 'name', 'price')
+
+# A single page of the catalogue together with the cursors used to fetch its neighbouring pages
+ProductPage = namedtuple('ProductPage', ['items', 'sort', 'direction', 'per_page',
+                                         'next_cursor', 'prev_cursor'])
+
+
+# Function to turn a key (a list of values) into an opaque url-safe cursor
+def encode_key(key):
+   raw = json.dumps(key, separators=(',', ':')).encode('utf-8')
+   return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+# Function to turn a cursor back into the key it was created from. Returns None for a missing or tampered
+# cursor (or one with the wrong number of values) so that the caller simply falls back to the first page
+def decode_key(cursor, length):
+   if not cursor:
+      return None
+   try:
+      padded = cursor + '=' * (-len(cursor) % 4)
+      key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+   except (ValueError, TypeError):
+      return None
+   if not isinstance(key, list) or len(key) != length:
+      return None
+   return key
+
+
+# Function to turn the sort key of a product into a cursor
+def encode_cursor(product, sort):
+   return encode_key([product.id] if sort == 'id' else [getattr(product, sort), product.id])
+
+
+# Function to turn a product cursor back into the sort key it was created from
+def decode_cursor(cursor, sort):
+   return decode_key(cursor, 1 if sort == 'id' else 2)
+
+
+# Function to clamp the requested page size to a sensible range
+def clamp_page_size(per_page, default=DEFAULT_PAGE_SIZE):
+   try:
+      per_page = int(per_page)
+   except (TypeError, ValueError):
+      return default
+   return max(1, min(per_page, MAX_PAGE_SIZE))
+
+
+# Function to turn a search text into a LIKE pattern matching it anywhere, with the wildcards it contains
+# (% and _) matched literally
+def like_pattern(q):
+   return '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+# Function to narrow down a product query by name and price range. Blank filters are ignored
+def filter_products(query=None, q=None, min_price=None, max_price=None):
+   query = query if query is not None else Product.query
+   if q:
+      query = query.filter(Product.name.ilike(like_pattern(q), escape='\\'))
+   if min_price is not None:
+      query = query.filter(Product.price >= min_price)
+   if max_price is not None:
+      query = query.filter(Product.price <= max_price)
+   return query
+
+
+# Function to get one page of products using keyset (cursor) pagination.
+# Instead of OFFSET, the query seeks directly to the row after (or before) the cursor using the
+# (sort column, id) indexes, so the cost of a page does not grow with the size of the catalogue
+def get_product_page(sort='name', direction='asc', after=None, before=None, per_page=DEFAULT_PAGE_SIZE,
+                     query=None):
+   query, finish = plan_product_page(sort, direction, after, before, per_page,
+                                     query if query is not None else Product.query)
+   return finish(query.all())
+
+
+# Function to prepare the query of a catalogue page. Returns the query (a Query or a select(), so the async
+# views can run it with the async engine) and a function turning the rows it returns into the ProductPage
+def plan_product_page(sort, direction, after, before, per_page, query):
+   if sort not in SORT_COLUMNS:
+      sort = 'name'
+   if direction not in ('asc', 'desc'):
+      direction = 'asc'
+   per_page = clamp_page_size(per_page)
+
+   columns = [Product.id] if sort == 'id' else [SORT_COLUMNS[sort], Product.id]
+   after_key = decode_cursor(after, sort)
+   before_key = decode_cursor(before, sort) if after_key is None else None
+
+   # When paging backwards the query is run in the opposite order and the rows reversed afterwards
+   backwards = before_key is not None
+   ascending = (direction == 'asc') != backwards
+   key = before_key if backwards else after_key
+
+   if key is not None:
+      row = tuple_(*columns) if len(columns) > 1 else columns[0]
+      value = tuple_(*key) if len(columns) > 1 else key[0]
+      query = query.filter(row > value if ascending else row < value)
+   query = query.order_by(*[column.asc() if ascending else column.desc() for column in columns])
+
+   # Fetch one extra row to find out whether there is another page without running a COUNT query
+   def finish(rows):
+      rows = list(rows)
+      has_more = len(rows) > per_page
+      rows = rows[:per_page]
+      if backwards:
+         rows.reverse()
+
+      next_cursor = prev_cursor = None
+      if rows:
+         if has_more or backwards:
+            next_cursor = encode_cursor(rows[-1], sort)
+         if key is not None and (has_more or not backwards):
+            prev_cursor = encode_cursor(rows[0], sort)
+
+      return ProductPage(rows, sort, direction, per_page, next_cursor, prev_cursor)
+
+   return query.limit(per_page + 1), finish
+
+
+# Function to convert a product into a plain dictionary (safe to cache and to render in the templates)
+def product_to_dict(product):
+   return {'id': product.id, 'name': product.name, 'price': product.price}
+
+
+# Function to get the catalogue cache of the current application (None when caching is disabled)
+def get_cache():
+   return current_app.extensions.get('catalogue_cache')
+
+
+# Function to get the key a page of the catalogue is cached under
+def product_page_key(sort, direction, after, before, per_page, q=None, min_price=None, max_price=None):
+   return 'products:' + json.dumps([get_version('catalogue')['id'], sort, direction, after, before,
+                                    clamp_page_size(per_page), q, min_price, max_price])
+
+
+# Function to get a page of the catalogue through the cache. The items of the page are dictionaries
+def get_cached_product_page(sort='name', direction='asc', after=None, before=None,
+                            per_page=DEFAULT_PAGE_SIZE, q=None, min_price=None, max_price=None):
+   # Every cached page includes the catalogue version in its key, so bumping the version invalidates all
+   # the cached pages at once
+   cache = get_cache()
+   key = None
+   if cache is not None:
+      key = product_page_key(sort, direction, after, before, per_page, q, min_price, max_price)
+      cached = cache.get(key)
+      if cached is not None:
+         return ProductPage(**cached)
+
+   query = filter_products(q=q, min_price=min_price, max_price=max_price)
+   page = get_product_page(sort=sort, direction=direction, after=after, before=before,
+                           per_page=per_page, query=query)
+   page = page._replace(items=[product_to_dict(product) for product in page.items])
+   if cache is not None:
+      cache.set(key, page._asdict())
+   return page
+
+
+# Function to get the key a product is cached under. The key includes the version of the products, which only
+# bulk changes (imports, price adjustments) bump, so they can't leave an old copy of a product behind
+def product_key(product_id):
+   return f"product:{get_version('products')['id']}:{product_id}"
+
+
+# Function to get a single product (as a dictionary) through the cache
+def get_cached_product(product_id):
+   cache = get_cache()
+   key = product_key(product_id)
+   if cache is not None:
+      cached = cache.get(key)
+      if cached is not None:
+         return cached
+
+   product = db.session.get(Product, product_id)
+   if product is None:
+      return None
+   product = product_to_dict(product)
+   if cache is not None:
+      cache.set(key, product)
+   return product
+
+
+# Function to invalidate the cache after the catalogue has changed. A change to one product only deletes that
+# product's cached copy, and bumps the catalogue version (the pages and their ETags) when it can show in a list:
+# listed is False for an edit that left the name and the price as they were. The pages are cached by their
+# position in the catalogue, not by product, so they all move on together. Without a product the change was a
+# bulk one (e.g. an import): every product and page is invalidated, and the clients of the event stream are
+# told to reload the catalogue
+def invalidate_catalogue(product_id=None, listed=True):
+   if product_id is None:
+      bump_version('products')
+      bump_version('catalogue')
+      publish_catalogue_reset()
+      return
+   cache = get_cache()
+   if cache is not None:
+      cache.delete(product_key(product_id))
+   if listed:
+      bump_version('catalogue')
@@ -0,0 +1,204 @@
+# Python file with the WSGI middleware compressing the responses (HTML pages, JSON, CSV/NDJSON exports) with
+# brotli or gzip, whichever the browser accepts (brotli needs the optional brotli package). Small responses
+# aren't compressed (the saving is smaller than the cost), responses that are compressed already (e.g. the
+# precompressed /assets files) are passed through, and streamed responses are compressed chunk by chunk so
+# they keep streaming. Every response of a compressible type says 'Vary: Accept-Encoding', compressed or not,
+# so that a shared cache never gives the uncompressed copy to a browser that asked for gzip or the other way round
+
+# Import the required modules
+import itertools
+import zlib
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+
+try:
+   import brotli
+except ImportError:  # brotli is optional, responses are compressed with gzip without it
+   brotli = None
+
+# Default settings
+DEFAULT_MIN_SIZE = 500
+DEFAULT_GZIP_LEVEL = 6
+DEFAULT_BROTLI_QUALITY = 4
+# A streamed body is flushed to the browser after this much input (flushing every small chunk, e.g. every
+# NDJSON line, would make the output larger and the compression slower)
+STREAM_FLUSH_SIZE = 64 * 1024
+
+# Content types worth compressing (besides text/*)
+COMPRESSIBLE_TYPES = {'application/json', 'application/javascript', 'application/xml', 'application/x-ndjson',
+                      'application/manifest+json', 'image/svg+xml'}
+
+
+# Class to compress one response, either in one go or chunk by chunk
+class Compressor:
+   def __init__(self, encoding, gzip_level, brotli_quality):
+      self.encoding = encoding
+      if encoding == 'br':
+         self._compressor = brotli.Compressor(quality=brotli_quality)
+      else:
+         # wbits=31 writes the gzip header and trailer around the deflate data
+         self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+   # Method to compress a chunk (the compressor may keep it until it has more data)
+   def chunk(self, data):
+      if self.encoding == 'br':
+         return self._compressor.process(data)
+      return self._compressor.compress(data)
+
+   # Method to get everything compressed so far, so that the browser gets it straight away
+   def flush(self):
+      if self.encoding == 'br':
+         return self._compressor.flush()
+      return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+   # Method to compress the last chunk and finish the stream
+   def finish(self, data=b''):
+      if self.encoding == 'br':
+         return self._compressor.process(data) + self._compressor.finish()
+      return self._compressor.compress(data) + self._compressor.flush()
+
+
+# Class of the WSGI middleware compressing the responses of an application
+class CompressionMiddleware:
+   def __init__(self, app, min_size=DEFAULT_MIN_SIZE, gzip_level=DEFAULT_GZIP_LEVEL,
+                brotli_quality=DEFAULT_BROTLI_QUALITY):
+      self.app = app
+      self.min_size = min_size
+      self.gzip_level = gzip_level
+      self.brotli_quality = brotli_quality
+
+   # Method to choose the encoding accepted by the browser (None when it accepts neither)
+   @staticmethod
+   def choose_encoding(environ):
+      accepted = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING', ''))
+      if brotli is not None and accepted['br']:
+         return 'br'
+      if accepted['gzip']:
+         return 'gzip'
+      return None
+
+   # Method to check whether a response's content type is worth compressing
+   @staticmethod
+   def compressible_type(headers):
+      content_type = headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+      if content_type == 'text/event-stream':
+         return False  # every event must reach the browser as soon as it is sent
+      return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+   # Method to check whether a response (by its status and headers) should be compressed
+   @classmethod
+   def compressible(cls, status, headers):
+      code = int(status.split(' ', 1)[0])
+      if code < 200 or code in (204, 206, 304):
+         return False
+      if 'Content-Encoding' in headers or 'no-transform' in headers.get('Cache-Control', ''):
+         return False
+      return cls.compressible_type(headers)
+
+   # Method to add Accept-Encoding to the Vary header of a response (in place)
+   @staticmethod
+   def add_vary(headers):
+      vary = headers.get('Vary')
+      if not vary:
+         headers['Vary'] = 'Accept-Encoding'
+      elif 'accept-encoding' not in vary.lower():
+         headers['Vary'] = f"{vary}, Accept-Encoding"
+
+   # Method to change the headers of a compressed response
+   @classmethod
+   def compressed_headers(cls, headers, encoding, length=None):
+      headers = Headers(headers)
+      headers['Content-Encoding'] = encoding
+      cls.add_vary(headers)
+      # The compressed body is a different representation, so its ETag can only be a weak one
+      etag = headers.get('ETag')
+      if etag and not etag.startswith('W/'):
+         headers['ETag'] = 'W/' + etag
+      if length is None:
+         headers.remove('Content-Length')
+      else:
+         headers['Content-Length'] = str(length)
+      return headers.to_wsgi_list()
+
+   def __call__(self, environ, start_response):
+      encoding = self.choose_encoding(environ)
+      if environ.get('REQUEST_METHOD') == 'HEAD':
+         encoding = None  # the headers say Vary all the same, but there is no body to compress
+
+      # Hold back the status and headers until it is known whether (and how) the body is compressed
+      response = {}
+      written = []
+
+      def capture_start_response(status, headers, exc_info=None):
+         response.update(status=status, headers=Headers(headers), exc_info=exc_info)
+         return written.append
+
+      app_iter = self.app(environ, capture_start_response)
+      status, headers, exc_info = response['status'], response['headers'], response['exc_info']
+      if self.compressible_type(headers) and 'Content-Encoding' not in headers:
+         self.add_vary(headers)
+      if encoding is None or not self.compressible(status, headers):
+         start_response(status, headers.to_wsgi_list(), exc_info)
+         return self.passthrough(app_iter, written) if written else app_iter
+
+      length = headers.get('Content-Length', type=int)
+      if length is not None:
+         # The whole body is known (e.g. a rendered page): compress it in one go, unless it is too small
+         try:
+            body = b''.join(written) + b''.join(app_iter)
+         finally:
+            if hasattr(app_iter, 'close'):
+               app_iter.close()
+         if len(body) < self.min_size:
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return [body]
+         body = Compressor(encoding, self.gzip_level, self.brotli_quality).finish(body)
+         start_response(status, self.compressed_headers(headers, encoding, len(body)), exc_info)
+         return [body]
+
+      # A streamed body (e.g. the product export): compress every chunk as it comes
+      start_response(status, self.compressed_headers(headers, encoding), exc_info)
+      return self.stream(app_iter, written, Compressor(encoding, self.gzip_level, self.brotli_quality))
+
+   # Generator sending the body of a response that isn't compressed, after anything sent with write()
+   @staticmethod
+   def passthrough(app_iter, written):
+      try:
+         yield from written
+         yield from app_iter
+      finally:
+         if hasattr(app_iter, 'close'):
+            app_iter.close()
+
+   # Generator compressing a streamed body
+   @staticmethod
+   def stream(app_iter, written, compressor):
+      pending = 0
+      try:
+         for data in itertools.chain(written, app_iter):
+            if not data:
+               continue
+            output = compressor.chunk(data)
+            pending += len(data)
+            if pending >= STREAM_FLUSH_SIZE:
+               output += compressor.flush()
+               pending = 0
+            if output:
+               yield output
+         yield compressor.finish()
+      finally:
+         if hasattr(app_iter, 'close'):
+            app_iter.close()
+
+
+# Function to compress the responses of the application (unless COMPRESSION_ENABLED is off)
+def init_compression(app):
+   if not app.config.get('COMPRESSION_ENABLED', True):
+      return
+   app.wsgi_app = app.extensions['compression'] = CompressionMiddleware(
+      app.wsgi_app,
+      min_size=app.config.get('COMPRESSION_MIN_SIZE', DEFAULT_MIN_SIZE),
+      gzip_level=app.config.get('COMPRESSION_LEVEL', DEFAULT_GZIP_LEVEL),
+      brotli_quality=app.config.get('COMPRESSION_BROTLI_QUALITY', DEFAULT_BROTLI_QUALITY),
+   )
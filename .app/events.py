@@ -0,0 +1,338 @@
+# Python file with the catalogue change events behind the Server-Sent Events stream at /products/events.
+# Product changes (added, edited or deleted products) are found with the ORM events and published on an
+# in-process bus once they are committed. The events are kept in a store ('memory' for a single process,
+# 'sqlite' to share them between the worker processes of a host), so a client reconnecting with the
+# Last-Event-ID header gets the events it missed. Each event is a small diff of the catalogue:
+#    event: created  data: {"id": ..., "name": ..., "price": ...}
+#    event: updated  data: {"id": ..., "price": ...}      (the changed fields only)
+#    event: deleted  data: {"id": ...}
+#    event: reset    data: {}                             (bulk changes or missed events: reload the page)
+
+# Import the required modules
+import asyncio
+from collections import deque
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from models import Product
+
+# Default settings
+DEFAULT_HISTORY = 1000        # events kept for clients that reconnect
+DEFAULT_POLL_INTERVAL = 0.5   # seconds between two checks for the events of the other worker processes
+DEFAULT_KEEPALIVE = 15        # seconds between two keep-alive comments on an idle stream
+# How long (in milliseconds) a browser waits before reconnecting after the stream was cut
+RETRY_MS = 3000
+# Events read from the store at a time
+BATCH_SIZE = 100
+
+# Headers of the event stream (X-Accel-Buffering stops nginx from holding the events back)
+EVENT_STREAM_HEADERS = [
+   ('Content-Type', 'text/event-stream; charset=utf-8'),
+   ('Cache-Control', 'no-cache'),
+   ('X-Accel-Buffering', 'no'),
+]
+
+# The product fields sent in the events
+EVENT_FIELDS = ('name', 'price')
+
+
+# In-process event store: the latest events in a bounded list
+class MemoryEventStore:
+   def __init__(self, history=DEFAULT_HISTORY):
+      self._events = deque(maxlen=history)
+      self._latest = 0
+      self._lock = threading.Lock()
+
+   # Method to add events (a list of (type, data) pairs). Returns the id of the last one
+   def append(self, events):
+      with self._lock:
+         for kind, data in events:
+            self._latest += 1
+            self._events.append({'id': self._latest, 'type': kind, 'data': data})
+         return self._latest
+
+   # Method to get the id of the latest event (0 when there is none)
+   def latest_id(self):
+      return self._latest
+
+   # Method to get the events after the given id, oldest first. Returns None when events the client hasn't
+   # seen are gone (or the id isn't one of this store's)
+   def after(self, last_id, limit=BATCH_SIZE):
+      with self._lock:
+         if last_id > self._latest or (self._events and last_id < self._events[0]['id'] - 1):
+            return None
+         return [event for event in self._events if event['id'] > last_id][:limit]
+
+
+# Local shared event store: the latest events in a SQLite file that every worker process on the host writes
+# to and reads from
+class SQLiteEventStore:
+   def __init__(self, path, history=DEFAULT_HISTORY):
+      self.path = path
+      self.history = history
+      self._local = threading.local()
+      self._connect().execute('CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                              'type TEXT NOT NULL, data TEXT NOT NULL, created REAL NOT NULL)')
+
+   # Method to get the connection of the current thread (SQLite connections can't be shared by threads)
+   def _connect(self):
+      connection = getattr(self._local, 'connection', None)
+      if connection is None:
+         directory = os.path.dirname(self.path)
+         if directory:
+            os.makedirs(directory, exist_ok=True)
+         connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+         connection.execute('PRAGMA journal_mode=WAL')
+         connection.execute('PRAGMA synchronous=NORMAL')
+         self._local.connection = connection
+      return connection
+
+   # Method to add events (a list of (type, data) pairs) and drop the oldest ones. Returns the id of the last one
+   def append(self, events):
+      connection = self._connect()
+      now = time.time()
+      connection.execute('BEGIN IMMEDIATE')
+      try:
+         for kind, data in events:
+            cursor = connection.execute('INSERT INTO events (type, data, created) VALUES (?, ?, ?)',
+                                        (kind, json.dumps(data, separators=(',', ':')), now))
+         connection.execute('DELETE FROM events WHERE id <= ?', (cursor.lastrowid - self.history,))
+         connection.execute('COMMIT')
+      except BaseException:
+         connection.execute('ROLLBACK')
+         raise
+      return cursor.lastrowid
+
+   # Method to get the id of the latest event (0 when there is none)
+   def latest_id(self):
+      return self._connect().execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+
+   # Method to get the events after the given id, oldest first. Returns None when events the client hasn't
+   # seen are gone (or the id isn't one of this store's)
+   def after(self, last_id, limit=BATCH_SIZE):
+      connection = self._connect()
+      oldest, latest = connection.execute('SELECT MIN(id), COALESCE(MAX(id), 0) FROM events').fetchone()
+      if last_id > latest or (oldest is not None and last_id < oldest - 1):
+         return None
+      rows = connection.execute('SELECT id, type, data FROM events WHERE id > ? ORDER BY id LIMIT ?',
+                                (last_id, limit)).fetchall()
+      return [{'id': id, 'type': kind, 'data': json.loads(data)} for id, kind, data in rows]
+
+
+# Class of the publish/subscribe bus. Subscribers wait for an event id newer than the last one they sent:
+# events published by this process wake them at once, the events of the other processes are found by reading
+# the store (at most once per poll interval, whatever the number of subscribers)
+class EventBus:
+   def __init__(self, store, poll_interval=DEFAULT_POLL_INTERVAL):
+      self.store = store
+      self.poll_interval = poll_interval
+      self._condition = threading.Condition()
+      self._latest = store.latest_id()
+      self._polled = time.monotonic()
+      self._async_waiters = set()
+
+   # Method to publish events (a list of (type, data) pairs)
+   def publish(self, events):
+      if events:
+         self._advance(self.store.append(events))
+
+   # Method to record a newer latest event id and wake the subscribers
+   def _advance(self, latest):
+      with self._condition:
+         if latest <= self._latest:
+            return
+         self._latest = latest
+         self._condition.notify_all()
+         waiters, self._async_waiters = self._async_waiters, set()
+      for loop, future in waiters:
+         loop.call_soon_threadsafe(_resolve, future)
+
+   # Method to check whether the store should be read again (once per poll interval, whatever the number of
+   # subscribers asking)
+   def _poll_due(self):
+      now = time.monotonic()
+      with self._condition:
+         due = now - self._polled >= self.poll_interval
+         if due:
+            self._polled = now
+      return due
+
+   # Method to get the id of the latest event, reading the store when the poll interval has passed
+   def latest_id(self):
+      if self._poll_due():
+         self._advance(self.store.latest_id())
+      return self._latest
+
+   # Method to get the id of the latest event on an event loop (the store is read in a thread)
+   async def latest_id_async(self):
+      if self._poll_due():
+         self._advance(await asyncio.to_thread(self.store.latest_id))
+      return self._latest
+
+   # Method to wait (in a thread) for an event newer than last_id. Returns False when the timeout ran out first
+   def wait(self, last_id, timeout):
+      deadline = time.monotonic() + timeout
+      while self.latest_id() <= last_id:
+         remaining = deadline - time.monotonic()
+         if remaining <= 0:
+            return False
+         with self._condition:
+            if self._latest <= last_id:
+               self._condition.wait(min(remaining, self.poll_interval))
+      return True
+
+   # Method to wait (on an event loop) for an event newer than last_id. Returns False when the timeout ran out
+   async def wait_async(self, last_id, timeout):
+      loop = asyncio.get_running_loop()
+      deadline = loop.time() + timeout
+      while await self.latest_id_async() <= last_id:
+         remaining = deadline - loop.time()
+         if remaining <= 0:
+            return False
+         waiter = (loop, loop.create_future())
+         with self._condition:
+            if self._latest > last_id:
+               continue
+            self._async_waiters.add(waiter)
+         try:
+            await asyncio.wait_for(waiter[1], min(remaining, self.poll_interval))
+         except asyncio.TimeoutError:
+            pass
+         finally:
+            with self._condition:
+               self._async_waiters.discard(waiter)
+      return True
+
+
+# Function to wake an async subscriber (called on its event loop)
+def _resolve(future):
+   if not future.done():
+      future.set_result(None)
+
+
+# Function to write an event in the Server-Sent Events format
+def format_event(event):
+   data = json.dumps(event['data'], separators=(',', ':'))
+   return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+# Function to get the id a client resumes from (the Last-Event-ID header sent by browsers when they reconnect,
+# or ?last_event_id=). New clients start with the next event
+def resume_from(request, bus):
+   value = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+   try:
+      return max(int(value), 0)
+   except (TypeError, ValueError):
+      return bus.latest_id()
+
+
+# Function to get the next chunk of a stream: the events after last_id, or a reset event when some are gone.
+# Returns (text, last_id, more), more being True when there may be more events to read straight away
+def next_events(bus, last_id):
+   events = bus.store.after(last_id)
+   if events is None:
+      # The store's latest id: the bus may not have seen the events of the other processes yet, and a reset with
+      # an older id would have the client resume from before the events it already got
+      latest = bus.store.latest_id()
+      return format_event({'id': latest, 'type': 'reset', 'data': {}}), latest, False
+   if not events:
+      return '', last_id, False
+   return ''.join(format_event(event) for event in events), events[-1]['id'], len(events) == BATCH_SIZE
+
+
+# Generator writing the event stream of a client (for the WSGI server: the stream holds a thread while it waits)
+def event_stream(bus, last_id, keepalive=DEFAULT_KEEPALIVE):
+   yield f"retry: {RETRY_MS}\n\n"
+   while True:
+      text, last_id, more = next_events(bus, last_id)
+      if text:
+         yield text
+      if not more and not bus.wait(last_id, keepalive):
+         yield ": keep-alive\n\n"  # a comment, ignored by the browser but it keeps proxies from closing the stream
+
+
+# Async generator writing the event stream of a client (for the ASGI server, see asgi.py). The store is read in
+# a thread, so the event loop isn't held up by the SQLite store
+async def async_event_stream(bus, last_id, keepalive=DEFAULT_KEEPALIVE):
+   yield f"retry: {RETRY_MS}\n\n"
+   while True:
+      text, last_id, more = await asyncio.to_thread(next_events, bus, last_id)
+      if text:
+         yield text
+      if not more and not await bus.wait_async(last_id, keepalive):
+         yield ": keep-alive\n\n"
+
+
+# Function to get the event bus of the current application
+def get_event_bus():
+   return current_app.extensions['catalogue_events']
+
+
+# Function to publish that the catalogue was changed in bulk (e.g. an import), so the clients reload it
+def publish_catalogue_reset():
+   if 'catalogue_events' in current_app.extensions:
+      get_event_bus().publish([('reset', {})])
+
+
+# Record the product changes made in a flush. They are only published once the change is committed
+@event.listens_for(Product, 'after_insert')
+def record_product_created(mapper, connection, target):
+   record_product_event(target, 'created', {'id': target.id, **{name: getattr(target, name)
+                                                                for name in EVENT_FIELDS}})
+
+
+@event.listens_for(Product, 'after_update')
+def record_product_updated(mapper, connection, target):
+   state = inspect(target)
+   changes = {name: getattr(target, name) for name in EVENT_FIELDS if state.attrs[name].history.has_changes()}
+   if changes:
+      record_product_event(target, 'updated', {'id': target.id, **changes})
+
+
+@event.listens_for(Product, 'after_delete')
+def record_product_deleted(mapper, connection, target):
+   record_product_event(target, 'deleted', {'id': target.id})
+
+
+# Function to add a product change to the changes waiting for the commit
+def record_product_event(target, kind, data):
+   session = object_session(target)
+   if session is not None:
+      session.info.setdefault('product_events', []).append((kind, data))
+
+
+# Publish the product changes after a commit
+@event.listens_for(Session, 'after_commit')
+def publish_product_events(session):
+   events = session.info.pop('product_events', None)
+   if events and has_app_context() and 'catalogue_events' in current_app.extensions:
+      get_event_bus().publish(events)
+
+
+# Forget the changes when the transaction is rolled back
+@event.listens_for(Session, 'after_rollback')
+def discard_product_events(session):
+   session.info.pop('product_events', None)
+
+
+# Function to create the event bus selected in the application's configuration and attach it to the application
+def init_events(app):
+   history = app.config.get('CATALOGUE_EVENTS_HISTORY', DEFAULT_HISTORY)
+   backend = app.config.get('CATALOGUE_EVENTS_BACKEND', 'memory')
+   if backend == 'memory':
+      store = MemoryEventStore(history)
+   elif backend == 'sqlite':
+      store = SQLiteEventStore(app.config.get('CATALOGUE_EVENTS_PATH')
+                               or os.path.join(app.instance_path, 'catalogue_events.db'), history)
+   else:
+      raise ValueError(f"Unknown catalogue events backend: {backend}")
+   poll_ms = app.config.get('CATALOGUE_EVENTS_POLL_MS')
+   app.extensions['catalogue_events'] = EventBus(
+      store, poll_interval=poll_ms / 1000 if poll_ms else DEFAULT_POLL_INTERVAL)
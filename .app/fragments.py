@@ -0,0 +1,96 @@
+# Python file to speed up the templates: a {% cache %} tag that keeps rendered parts of a page (e.g. the
+# navigation bar or the catalogue rows) in the catalogue cache, and a bytecode cache that saves the compiled
+# templates on disk so that new worker processes don't compile them again.
+# A fragment is cached per template, per role (so an admin never sees a customer's navigation bar, but every
+# customer shares one copy) and per version of the data it depends on, e.g.
+#    {% cache 'nav' %} ... {% endcache %}
+#    {% cache 'product-rows', request.full_path depends 'catalogue' %} ... {% endcache %}
+# Fragments must not contain anything specific to one user (names, CSRF tokens, flashed messages)
+
+# Import the required modules
+import hashlib
+import json
+import os
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from versions import get_version
+
+
+# Function to describe the authentication state of the user viewing a page (their roles)
+def auth_state(user):
+   if user is None or not getattr(user, 'is_authenticated', False):
+      return 'guest'
+   return ','.join(sorted(getattr(user, 'role_names', ()))) or 'user'
+
+
+# Function to build the cache key of a fragment
+def fragment_key(template_name, key_parts, depends, user):
+   versions = [get_version(name)['id'] for name in depends]
+   data = json.dumps([template_name, key_parts, auth_state(user), versions], default=str, separators=(',', ':'))
+   return 'fragment:' + hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+# Jinja extension adding the {% cache name[, key...] [depends version[, version...]] %} ... {% endcache %} tag
+class FragmentCacheExtension(Extension):
+   tags = {'cache'}
+
+   def parse(self, parser):
+      lineno = next(parser.stream).lineno
+      key_parts = [parser.parse_expression()]
+      while parser.stream.skip_if('comma'):
+         key_parts.append(parser.parse_expression())
+      depends = []
+      if parser.stream.skip_if('name:depends'):
+         depends.append(parser.parse_expression())
+         while parser.stream.skip_if('comma'):
+            depends.append(parser.parse_expression())
+      body = parser.parse_statements(('name:endcache',), drop_needle=True)
+      call = self.call_method('_render_fragment', [nodes.ContextReference(), nodes.List(key_parts),
+                                                   nodes.List(depends)])
+      return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+   # Method to get a fragment from the cache, rendering (and caching) it when it isn't there
+   def _render_fragment(self, context, key_parts, depends, caller):
+      cache = current_app.extensions.get('catalogue_cache')
+      if cache is None or not current_app.config.get('TEMPLATE_FRAGMENT_CACHE', True):
+         return caller()
+      key = fragment_key(context.name, key_parts, depends, context.get('current_user'))
+      html = cache.get(key)
+      if html is None:
+         html = str(caller())
+         cache.set(key, html)
+      return Markup(html)
+
+
+# Function to get the folder of the template bytecode cache
+def bytecode_cache_folder(app):
+   return app.config.get('TEMPLATE_BYTECODE_CACHE_DIR') or os.path.join(app.instance_path, 'template_cache')
+
+
+# Function to add the fragment cache tag and the bytecode cache to the application's templates
+def init_fragments(app):
+   app.jinja_env.add_extension(FragmentCacheExtension)
+   if app.config.get('TEMPLATE_BYTECODE_CACHE', True):
+      folder = bytecode_cache_folder(app)
+      try:
+         os.makedirs(folder, exist_ok=True)
+      except OSError:
+         return  # e.g. a read-only file system: the templates are compiled in memory as before
+      app.jinja_env.bytecode_cache = FileSystemBytecodeCache(folder)
+
+
+# Flask CLI command to compile every template into the bytecode cache, e.g. 'flask --app index compile-templates'
+# (run when deploying, so that even the first requests of every worker skip compiling the templates)
+@click.command('compile-templates')
+@with_appcontext
+def compile_templates_command():
+   names = current_app.jinja_env.list_templates()
+   for name in names:
+      current_app.jinja_env.get_template(name)
+   click.echo(f"Compiled {len(names)} templates into {bytecode_cache_folder(current_app)}")
@@ -0,0 +1,65 @@
+# Python file to generate ULIDs (Universally Unique Lexicographically Sortable Identifiers) for new products.
+# A ULID is a 48 bit millisecond timestamp followed by 80 random bits, written as 26 Crockford base32
+# characters. New ids sort after older ones, so inserts are appended to the end of the primary key index,
+# and with 80 random bits per millisecond they don't need to be checked against the database
+
+# Import the required modules
+import os
+import threading
+import time
+
+# Crockford's base32 alphabet (no I, L, O or U)
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+RANDOM_BITS = 80
+MAX_RANDOM = (1 << RANDOM_BITS) - 1
+
+
+# Class to generate monotonic ULIDs. Within the same millisecond the random part of the previous id is
+# incremented, so the ids generated by one process are strictly increasing even when the clock stalls
+class ULIDGenerator:
+   def __init__(self):
+      self._reset()
+
+   # Method to start afresh (also called in a child process after a fork, so that parent and child don't
+   # continue from the same random value, and the lock isn't inherited in a locked state)
+   def _reset(self):
+      self._lock = threading.Lock()
+      self._last_ms = -1
+      self._last_random = 0
+
+   # Method to get a new ULID
+   def new(self):
+      with self._lock:
+         now = time.time_ns() // 1_000_000
+         if now > self._last_ms:
+            self._last_ms = now
+            self._last_random = int.from_bytes(os.urandom(10), 'big')
+         elif self._last_random < MAX_RANDOM:
+            # Same millisecond (or the clock went backwards): keep the time and increment the random part
+            self._last_random += 1
+         else:
+            # The random part overflowed: move on to the next millisecond
+            self._last_ms += 1
+            self._last_random = int.from_bytes(os.urandom(10), 'big')
+         return encode(self._last_ms, self._last_random)
+
+
+# Function to write the time and random parts of a ULID as 26 base32 characters
+def encode(timestamp_ms, random):
+   value = (timestamp_ms << RANDOM_BITS) | random
+   chars = []
+   for _ in range(26):
+      chars.append(ALPHABET[value & 31])
+      value >>= 5
+   return ''.join(reversed(chars))
+
+
+# The generator shared by the whole process
+_generator = ULIDGenerator()
+if hasattr(os, 'register_at_fork'):
+   os.register_at_fork(after_in_child=_generator._reset)
+
+
+# Function to generate the id of a new product
+def generate_product_id():
+   return _generator.new()
@@ -3,49 +3,61 @@
 # from crypt import methods
 
 # Import the required modules
-from flask import Flask, render_template, request, url_for, flash, redirect, jsonify,session
+from flask import Flask, Blueprint, render_template, request, url_for, flash, redirect, jsonify,session
+from flask import Response, current_app
 from flask_login import current_user, LoginManager
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_login import login_user, logout_user, login_required # For application authentication & authorisation
 from datetime import timezone,datetime
-import secrets
-import string
+import os
+
+# Import the application's configuration
+from config import Config, CONFIGS
 
 # Import the registration, login and product form modules
 from register import RegistrationForm
 from login import LoginForm
-from user_form import UserForm
-from product_form import ProductForm
+from user_form import UserForm, UserImportForm
+from product_form import ProductForm, ProductImportForm, PriceAdjustmentForm
 
 # Import the database models
-from models import Product, init_db, db, User, Role, UserRole
-from seed_products_users_roles import seed_all
-
-# Get the list of tasks from the tasks API (tasks.py file)
-from tasks import tasks
-
-# Declare and create/instantiate a flask object
-app = Flask(__name__)
-
-# Application configurations
-# 1. Create the application's secret key to protect our site from CSRF attacks
-app.config['SECRET_KEY'] = secrets.token_urlsafe(32)  # app_key = secrets.token_hex(18)
-
-# 2. Specify the path/URI to the sqlite database file
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///ds2505.db'
-# Improve the app's performance by not tracking all database modifications
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-# Initialise the database
-init_db(app)
-seed_all(app)
+from models import Product, init_db, create_tables, db, User, Role, UserRole
+from seed_products_users_roles import seed_all, seed_command
+from catalogue import get_cached_product_page, get_cached_product, invalidate_catalogue
+from cache import init_cache
+from versions import conditional_view
+from permissions import load_user_with_roles
+from passwords import init_passwords, PasswordHasherBusy
+from throttle import init_throttle, get_login_throttle
+from api import api
+from metrics import metrics, init_metrics
+from profiler import profiler, init_profiler
+from assets import assets, init_assets, build_assets_command
+from compression import init_compression
+from fragments import init_fragments, compile_templates_command
+from events import init_events, get_event_bus, event_stream, resume_from, EVENT_STREAM_HEADERS
+from write_behind import init_write_behind, defer_update
+from ids import generate_product_id
+from search import search_products, create_search_index, rebuild_search_command
+from product_import import import_products, format_from_filename, import_products_command
+from pricing import adjust_prices, preview_price_adjustment, parse_product_ids, adjust_prices_command
+from user_import import import_users, user_format_from_filename, import_users_command
+from seed_synthetic import seed_synthetic_command
+
+# Get the task queries from the tasks API (tasks.py file)
+from tasks import get_tasks_page, get_task_changes, parse_task_args, tasks_payload, sync_time, DEFAULT_SYNC_MARGIN
+
+# Create the blueprint holding the site's pages. It is registered on the application by create_app()
+main = Blueprint('main', __name__)
 
 # Setup Flask_login for the application's login functionality
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'main.login'
 
 @login_manager.user_loader
 def load_user(user_id):
-   return User.query.get(int(user_id))
+   # Load the user and their role names in one go so the permission checks don't query the database
+   return load_user_with_roles(int(user_id))
 
 # Create a guest user to access our unprotected site areas anonymously (unauthenticated access)
 class GuestUser:
@@ -58,33 +70,25 @@ class GuestUser:
    def is_admin_or_manager(self):
       return False
 
+   def is_admin(self):
+      return False
+
    def get_id(self):
       return None
 
 # Function to get the user object for the current user, if the current user is authenticated, else
 # it returns a Guest object
-@app.context_processor
+@main.app_context_processor
 def inject_user():
    if current_user.is_authenticated:
       return {"current_user": current_user}
    else:
       return {"current_user": GuestUser()}
 
-# Function to generate the prefix for the product ids when adding new products in the product's table
-def generate_product_id():
-   prefix = '01H73QEWM'
-   alphabet = string.ascii_uppercase + string.digits
-   while True:
-      suffix = "".join(secrets.choice(alphabet) for _ in range(8))
-      candidate = prefix + suffix
-      if Product.query.get(candidate) is None: # when the product Id doesn't exist in the 'product' table
-         return candidate
-
-
 # Set the route to the index/home page
-@app.route('/')
-@app.route('/index')
-@app.route('/home')
+@main.route('/')
+@main.route('/index')
+@main.route('/home')
 def index():
    # Get the user's browser and store it in the browser variable
    browser = request.headers.get('User-Agent')
@@ -108,22 +112,22 @@ def index():
 
 
 # Set the route to the user's page
-@app.route('/user')
-@app.route('/user/<username>')
+@main.route('/user')
+@main.route('/user/<username>')
 def user(username=None):
    return render_template('user.html', username=username)
 
 
 # Route to the register/sign-up page
-@app.route('/register', methods=['GET', 'POST'])
-@app.route('/sign-up', methods=['GET', 'POST'])
+@main.route('/register', methods=['GET', 'POST'])
+@main.route('/sign-up', methods=['GET', 'POST'])
 def register():
    form = RegistrationForm()
    if form.validate_on_submit():
       # Process the form data(e.g., save to a database & so on)
       try:
          # check whether the user's email already exists in the database
-         if User.query.filter_by(email=form.email.data).first():
+         if User.find_by_email(form.email.data):
             flash('Email already exists. Please use a different email or login.','danger')
             return render_template('register.html', form=form)
          # check if the phone number already exists in the database
@@ -160,8 +164,11 @@ def register():
             db.session.add(user_role)
          db.session.commit()
          flash("Registration or Sign-up successful, you can now login", "success")
-         # return redirect(url_for('success'))  # Redirect to a success page
-         return redirect(url_for('login'))  # Redirect to login page
+         # return redirect(url_for('main.success'))  # Redirect to a success page
+         return redirect(url_for('main.login'))  # Redirect to login page
+      except PasswordHasherBusy:
+         db.session.rollback()
+         raise
       except Exception as e:
          db.session.rollback()
          flash(f"Sorry, there was an error during registration:\n{str(e)}", "danger")
@@ -175,8 +182,8 @@ def register():
 
 
 # Route to the login/sign-in page
-@app.route('/login', methods=['GET', 'POST'])
-@app.route('/sign-in', methods=['GET', 'POST'])
+@main.route('/login', methods=['GET', 'POST'])
+@main.route('/sign-in', methods=['GET', 'POST'])
 def login():
    form = LoginForm()
    if form.validate_on_submit():
@@ -186,26 +193,37 @@ def login():
       next_page = request.args.get('next') or session.pop('next', None)
 
       if form.validate_on_submit():
+         # Reject throttled attempts before looking up the user or checking the password
+         throttle = get_login_throttle()
+         wait = throttle.check(form.email.data, request.remote_addr)
+         if wait:
+            flash(f"Too many login attempts, please try again in {int(wait) + 1} seconds", 'danger')
+            return render_template('login.html', form=form), 429, {'Retry-After': str(int(wait) + 1)}
+
          # Find the user by their email address
-         user = User.query.filter_by(email=form.email.data).first()
+         user = User.find_by_email(form.email.data)
 
          if user and user.check_password(form.password.data):
             # Log in/Sign in the user
+            throttle.reset(form.email.data, request.remote_addr)
             login_user(user,remember=True)
-            user.last_login = datetime.now(timezone.utc)
-            db.session.commit()
+            # Record the login time in the background, so a login doesn't wait for the database's write lock
+            defer_update(User, user.id, last_login=datetime.now(timezone.utc))
+            # Upgrade the stored hash if the configured bcrypt cost has changed
+            if user.rehash_password_if_needed(form.password.data):
+               db.session.commit()
 
             flash(f"Welcome back, {user.full_name}!","success")
 
             # Redirect the usr to the intended page or index
-            if next_page and next_page != url_for('login'):
+            if next_page and next_page != url_for('main.login'):
                return redirect(next_page)
             else:
-               return redirect(url_for('index'))
+               return redirect(url_for('main.index'))
          else:
             flash("Invalid email or password",'danger')
       # flash("Login or Sign-in Successful", "success")
-      # return redirect(url_for('success'))  # Redirect to the success page
+      # return redirect(url_for('main.success'))  # Redirect to the success page
    else:
       # Flash validation errors
       for field, errors in form.errors.items():
@@ -218,27 +236,26 @@ def login():
    return render_template('login.html', form=form)
 
 # Route to logout/sign out the user
-@app.route('/logout')
+@main.route('/logout')
 @login_required # requires the user to be logged in
 def logout():
    logout_user()
    flash("You have been logged out.", "success")
-   return redirect(url_for('index'))
+   return redirect(url_for('main.index'))
 
 # Route to add the new user (will be accessed by admins only)
-@app.route("/add-user",methods=['GET','POST'])
+@main.route("/add-user",methods=['GET','POST'])
 @login_required
 def add_user():
    # Check if the current user in an admin
-   if not current_user.is_admin_or_manager() or not any(ur.role.name == 'Admin'
-                                                        for ur in current_user.roles if ur.is_active):
+   if not current_user.is_admin():
       flash("Access Denied, insufficient permissions!", "danger")
-      return redirect(url_for('index'))
+      return redirect(url_for('main.index'))
    form = UserForm()
    if form.validate_on_submit():
       try:
          # Check if the user's email already exists
-         if User.query.filter_by(email=form.email.data).first():
+         if User.find_by_email(form.email.data):
             flash('Email already exists. Please use a different email address.','error')
             return render_template('add-user.html',form=form)
 
@@ -279,7 +296,10 @@ def add_user():
          db.session.commit()
          flash(f"User {new_user.full_name} created successfully "
                f"with role {form.role.data}!", "success")
-         return redirect(url_for('index'))
+         return redirect(url_for('main.index'))
+      except PasswordHasherBusy:
+         db.session.rollback()
+         raise
       except Exception as e:
          db.session.rollback()
          flash(f"Error creating user:\n{str(e)}", "danger")
@@ -288,111 +308,304 @@ def add_user():
    return render_template('add-user.html',form=form)
 
 
+# Route to create many users at once from a CSV or JSON file (admins only). Returns the result of every row,
+# as a page or as JSON with ?format=json or an 'Accept: application/json' header
+@main.route("/add-users", methods=['GET', 'POST'])
+@login_required
+def add_users():
+   if not current_user.is_admin():
+      flash("Access Denied, insufficient permissions!", "danger")
+      return redirect(url_for('main.index'))
+   form = UserImportForm()
+   report = None
+   if form.validate_on_submit():
+      upload = form.file.data
+      report = import_users(upload.stream, user_format_from_filename(upload.filename),
+                            assigned_by=current_user.id, default_role=form.default_role.data)
+      wants_json = (request.args.get('format') == 'json'
+                    or request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json')
+      if wants_json:
+         return jsonify(report.as_dict())
+      flash(f"Created {report.imported} of {report.processed} users", "success" if not report.failed else "danger")
+   return render_template('add-users.html', form=form, report=report)
+
+
 # Route to the success page
-@app.route('/success')
+@main.route('/success')
 def success():
    return render_template('success.html')
 
 
-# Route to the product's page (used to display all products in the table)
-@app.route('/products')
+# Route to the product's page (used to display the products in the table one page at a time)
+@main.route('/products')
+@conditional_view('catalogue')
 def products():
-   # Get all the products from the products table in the ds2505 database
-   products = Product.query.all()
-   return render_template('products.html', products=products)
+   # Get a single page of products from the products table using the cursor in the query string
+   page = get_cached_product_page(
+      sort=request.args.get('sort', 'name'),
+      direction=request.args.get('dir', 'asc'),
+      after=request.args.get('after'),
+      before=request.args.get('before'),
+      per_page=request.args.get('per_page', 25),
+   )
+   return render_template('products.html', products=page.items, page=page)
+
+
+# Route to the stream of catalogue changes (Server-Sent Events), e.g. new EventSource('/products/events') in
+# the browser. Each added, edited or deleted product is sent as a small diff (see events.py)
+@main.route('/products/events')
+def product_events():
+   bus = get_event_bus()
+   stream = event_stream(bus, resume_from(request, bus), current_app.config.get('CATALOGUE_EVENTS_KEEPALIVE', 15))
+   return Response(stream, headers=EVENT_STREAM_HEADERS)
+
+
+# Route to search the product catalogue by name (HTML page, or JSON with ?format=json or an
+# 'Accept: application/json' header)
+@main.route('/products/search')
+def search():
+   terms = request.args.get('q', '').strip()
+   min_price = request.args.get('min_price', type=float)
+   max_price = request.args.get('max_price', type=float)
+   page = max(1, request.args.get('page', 1, type=int))
+   per_page = request.args.get('per_page', 25)
+   results, has_more = search_products(terms, min_price=min_price, max_price=max_price, page=page,
+                                       per_page=per_page)
+
+   wants_json = (request.args.get('format') == 'json'
+                 or request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json')
+   if wants_json:
+      return jsonify({'q': terms, 'page': page, 'has_more': has_more, 'data': results})
+   return render_template('search.html', terms=terms, results=results, page=page, has_more=has_more,
+                          min_price=min_price, max_price=max_price)
 
 
 # Route to the add product page (used to add an item/product to the product table)
-@app.route('/add_product', methods=['GET', 'POST'])
+@main.route('/add_product', methods=['GET', 'POST'])
 def add_product():
    form = ProductForm()
    if form.validate_on_submit():
       new_product = Product(
-         id=form.name.data.replace(' ', '').upper(),
+         id=generate_product_id(),
          name=form.name.data,
          price=form.price.data,
       )
       # Add and persist the new product to the database
       db.session.add(new_product)
       db.session.commit()
-      return redirect(url_for('products'))
+      invalidate_catalogue(new_product.id)
+      return redirect(url_for('main.products'))
    return render_template('add-product.html', form=form)
 
 
+# Route to the bulk import page (used to upsert a whole supplier price list into the product table)
+@main.route('/import_products', methods=['GET', 'POST'])
+@login_required
+def import_products_page():
+   if not current_user.is_admin_or_manager():
+      flash("Access Denied, insufficient permissions!", "danger")
+      return redirect(url_for('main.index'))
+   form = ProductImportForm()
+   report = None
+   if form.validate_on_submit():
+      upload = form.file.data
+      report = import_products(upload.stream, format_from_filename(upload.filename))
+      flash(f"Imported {report.imported} of {report.processed} products "
+            f"({report.rows_per_second:,.0f} rows/s)", "success" if not report.failed else "danger")
+   return render_template('import-products.html', form=form, report=report)
+
+
+# Route to the bulk price adjustment page (a percentage or amount added to the prices of the matching products).
+# 'Preview' lists the products that would change, 'Apply' changes them all in one transaction
+@main.route('/adjust_prices', methods=['GET', 'POST'])
+@login_required
+def adjust_prices_page():
+   if not current_user.is_admin_or_manager():
+      flash("Access Denied, insufficient permissions!", "danger")
+      return redirect(url_for('main.index'))
+   form = PriceAdjustmentForm()
+   preview = None
+   if form.validate_on_submit():
+      options = dict(product_ids=parse_product_ids(form.ids.data), q=form.name.data or None,
+                     min_price=form.min_price.data, max_price=form.max_price.data,
+                     all_products=form.all_products.data)
+      try:
+         if request.form.get('action') == 'apply':
+            result = adjust_prices(form.mode.data, form.value.data, changed_by=current_user.id, **options)
+            flash(f"Changed the price of {result.changed} products", "success")
+            return redirect(url_for('main.adjust_prices_page'))
+         preview = preview_price_adjustment(form.mode.data, form.value.data, **options)
+      except ValueError as error:
+         flash(str(error), "danger")
+   return render_template('adjust-prices.html', form=form, preview=preview)
+
+
 # Route to the edit product page (used to modify/change an item in the product list/catalogue)
-@app.route("/edit_product/<string:id>", methods=['GET', 'POST'])
+@main.route("/edit_product/<string:id>", methods=['GET', 'POST'])
 def edit_product(id):
-   product = Product.query.get(id)
+   # Read the product through the catalogue cache, only the update itself needs the database row
+   product = get_cached_product(id)
    if product is None:
-      return redirect(url_for('products'))
-   form = ProductForm(obj=product)
+      return redirect(url_for('main.products'))
+   form = ProductForm(data=product)
    if form.validate_on_submit():
+      product = db.session.get(Product, id)
+      if product is None:
+         return redirect(url_for('main.products'))
+      listed = (product.name, product.price) != (form.name.data, form.price.data)
       product.name = form.name.data
       product.price = form.price.data
       db.session.commit()
-      return redirect(url_for('products'))
+      invalidate_catalogue(id, listed=listed)
+      return redirect(url_for('main.products'))
    return render_template('edit-product.html', form=form)
 
 
 # Route to delete product detail from the product catalogue and subsequently from the products table
-@app.route("/delete_product/<string:id>", methods=['GET', 'POST'])
+@main.route("/delete_product/<string:id>", methods=['GET', 'POST'])
 def delete_product(id):
-   product = Product.query.get(id)
+   product = db.session.get(Product, id)
    if product is None:
-      return redirect(url_for('products'))
+      return redirect(url_for('main.products'))
    else:
       db.session.delete(product)
       db.session.commit()
-   return redirect(url_for('products'))
+      invalidate_catalogue(id)
+   return redirect(url_for('main.products'))
 
 
 # Route to get or fetch the list of to-do items/tasks
-@app.route('/get_tasks',methods=['GET'])
+@main.route('/get_tasks',methods=['GET'])
+@conditional_view('tasks')
 def get_tasks():
-   return jsonify(tasks)
+   # Guests get the public tasks, logged-in users get the public tasks and their own ones
+   user_id = current_user.id if current_user.is_authenticated else None
+   try:
+      options = parse_task_args(request.args)
+      since = options.pop('since')
+      server_time = sync_time(current_app.config.get('TASK_SYNC_MARGIN', DEFAULT_SYNC_MARGIN))
+      if since is None:
+         rows, next_cursor = get_tasks_page(user_id, **options)
+      else:
+         # Delta mode: only the tasks changed (or deleted) after the given time
+         rows, next_cursor = get_task_changes(user_id, since, **options)
+   except ValueError as e:
+      return jsonify({'error': str(e)}), 400
+   return jsonify(tasks_payload(rows, next_cursor, since, server_time))
 
 # Route to display  the tasks and their status (done or not done)
-@app.route('/tasks',methods=['GET'])
+@main.route('/tasks',methods=['GET'])
 def view_tasks():
    return render_template('tasks.html')
 
 # Pages to handle site errors
 # 1. Handle when authentication is required and has not been provided or failed (401 error)
-@app.errorhandler(401)
+@main.app_errorhandler(401)
 def unauthorised(e):
    return render_template('401.html'), 401
 
 
 # 2. Handle when user is authenticated but doesn't have permission to access a resource/page (403 error)
-@app.errorhandler(403)
+@main.app_errorhandler(403)
 def forbidden(e):
    return render_template('403.html'), 403
 
 
 # 3. Handle page not found (404 error)
-@app.errorhandler(404)
+@main.app_errorhandler(404)
 def page_not_found(e):
    return render_template('404.html'), 404
 
 
 # 4. Handle internal server error (500 error)
-@app.errorhandler(500)
+@main.app_errorhandler(500)
 def internal_server_error(e):
    return render_template('500.html'), 500
 
 
 # Code to simulate an internal server error by raising an exception
-# @app.route('/trigger-500')
+# @main.route('/trigger-500')
 # def trigger_500():
 #    # Deliberately raise an error in our server
 #    raise Exception("Deliberate internal exception")
 
 # 5. Handle when the website is overloaded or temporarily down for upgrades/maintenance (503 error)
-@app.errorhandler(503)
+@main.app_errorhandler(503)
 def service_unavailable(e):
    return render_template('503.html'), 503
 
 
+# 6. Handle when the password hashing pool is saturated (e.g. a burst of logins), shed the load with a 503
+@main.app_errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+   return render_template('503.html'), 503, {'Retry-After': '1'}
+
+
+# Function to create and configure an instance of the application (the application factory).
+# 'config' can be a configuration class/object, a dictionary of settings or None, in which case the
+# configuration is picked with the APP_CONFIG environment variable (development, production or testing)
+def create_app(config=None):
+   app = Flask(__name__)
+   if config is None:
+      config = CONFIGS[os.environ.get('APP_CONFIG', 'development')]
+   if isinstance(config, dict):
+      app.config.from_object(Config)
+      app.config.update(config)
+   else:
+      app.config.from_object(config)
+
+   # Initialise the database (the tables are created and seeded with 'flask --app index seed')
+   init_db(app)
+   init_cache(app)
+   init_passwords(app)
+   init_throttle(app)
+   login_manager.init_app(app)
+   init_metrics(app)
+   init_profiler(app)
+   init_assets(app)
+   init_fragments(app)
+   init_events(app)
+   init_write_behind(app)
+
+   # Register the site's pages, the versioned JSON API, the built assets, the metrics and (in development) the
+   # SQL profiler
+   app.register_blueprint(main)
+   app.register_blueprint(api)
+   app.register_blueprint(assets)
+   if app.config.get('METRICS_ENABLED', False):
+      app.register_blueprint(metrics)
+   if app.config.get('SQL_PROFILER_ENABLED'):
+      app.register_blueprint(profiler)
+
+   # Register the command line interface (CLI) commands
+   app.cli.add_command(import_products_command)
+   app.cli.add_command(adjust_prices_command)
+   app.cli.add_command(import_users_command)
+   app.cli.add_command(seed_command)
+   app.cli.add_command(seed_synthetic_command)
+   app.cli.add_command(rebuild_search_command)
+   app.cli.add_command(build_assets_command)
+   app.cli.add_command(compile_templates_command)
+
+   # Compress the responses (the middleware wraps the whole application, so it is added after the rest)
+   init_compression(app)
+
+   # Read the client's address and scheme from the headers of the trusted reverse proxies
+   proxies = app.config.get('TRUSTED_PROXIES', 0)
+   if proxies:
+      app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+   return app
+
+
+# Create the application used by 'flask --app index run', WSGI servers (e.g. 'gunicorn index:app') and the
+# development server below
+app = create_app()
+
 # Set the entry point to our web application
 if __name__ == "__main__":
+   # Create and seed the database for local development (the same as running 'flask --app index seed')
+   with app.app_context():
+      create_tables()
+      create_search_index()
+   seed_all(app)
    app.run(debug=True)
@@ -0,0 +1,270 @@
+# Python file to measure how the application behaves in production and expose the measurements at /metrics in
+# the Prometheus text format: the latency of every endpoint, the SQL queries (count and time) of every endpoint,
+# the time spent rendering templates, the time spent in bcrypt and the outcome of the login attempts.
+# Recording must be cheap as it happens on every request and every query: each thread writes to its own set of
+# counters (no locks), and the sets are only added together when /metrics is read (the sets of ended threads are
+# folded into one whenever a new thread starts recording, so they don't pile up). The numbers are per process,
+# so with several worker processes each one is scraped (or the totals are added up) separately
+
+# Import the required modules
+from bisect import bisect_left
+import hmac
+import threading
+import time
+
+from flask import Blueprint, Response, abort, current_app, g, has_request_context, request
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+
+from models import db
+
+# Create the blueprint holding the /metrics endpoint. It is registered on the application by create_app()
+metrics = Blueprint('metrics', __name__)
+
+# Histogram buckets (upper bounds, in seconds unless stated otherwise)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+QUERIES_PER_REQUEST_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+TEMPLATE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+PASSWORD_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+# Class holding the counters and histograms of the application
+class MetricsRegistry:
+   def __init__(self):
+      self._definitions = {}
+      self._local = threading.local()
+      # (thread, values) of every thread that recorded something, and the values of the threads that ended
+      self._shards = []
+      self._retired = {}
+      self._lock = threading.Lock()
+
+   # Method to define a histogram
+   def histogram(self, name, description, buckets):
+      self._definitions[name] = ('histogram', description, tuple(buckets))
+
+   # Method to define a counter
+   def counter(self, name, description):
+      self._definitions[name] = ('counter', description, ())
+
+   # Method to get the values written by the current thread (the lock is only taken by a thread's first write,
+   # which also folds in the values of the threads that ended, so a server starting a thread per request keeps
+   # one set per live thread rather than one per request)
+   def _shard(self):
+      try:
+         return self._local.shard
+      except AttributeError:
+         shard = self._local.shard = {}
+         with self._lock:
+            self._retire_ended_threads()
+            self._shards.append((threading.current_thread(), shard))
+         return shard
+
+   # Method to fold the values of the threads that ended into one set (called with the lock held)
+   def _retire_ended_threads(self):
+      live = []
+      for thread, shard in self._shards:
+         if thread.is_alive():
+            live.append((thread, shard))
+         else:
+            self._merge(self._retired, shard)
+      self._shards = live
+
+   # Method to record a value in a histogram. labels is a tuple of (name, value) pairs
+   def observe(self, name, labels, value):
+      shard = self._shard()
+      values = shard.get((name, labels))
+      if values is None:
+         # One count per bucket (plus +Inf), then the sum and the count of the values
+         values = shard[(name, labels)] = [0] * (len(self._definitions[name][2]) + 3)
+      values[bisect_left(self._definitions[name][2], value)] += 1
+      values[-2] += value
+      values[-1] += 1
+
+   # Method to add to a counter
+   def inc(self, name, labels, amount=1):
+      shard = self._shard()
+      values = shard.get((name, labels))
+      if values is None:
+         values = shard[(name, labels)] = [0]
+      values[0] += amount
+
+   # Method to add the values of a thread to a total
+   @staticmethod
+   def _merge(total, shard):
+      for key, values in shard.copy().items():
+         current = total.get(key)
+         if current is None:
+            total[key] = list(values)
+         else:
+            for index, value in enumerate(list(values)):
+               current[index] += value
+
+   # Method to add up the values of all the threads
+   def collect(self):
+      with self._lock:
+         self._retire_ended_threads()
+         total = {}
+         self._merge(total, self._retired)
+         for _, shard in self._shards:
+            self._merge(total, shard)
+      return total
+
+   # Method to write all the metrics in the Prometheus text format
+   def render(self):
+      collected = self.collect()
+      lines = []
+      for name, (kind, description, buckets) in self._definitions.items():
+         lines.append(f"# HELP {name} {description}")
+         lines.append(f"# TYPE {name} {kind}")
+         for (metric, labels), values in sorted(collected.items()):
+            if metric != name:
+               continue
+            if kind == 'counter':
+               lines.append(f"{name}{format_labels(labels)} {format_value(values[0])}")
+               continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), values):
+               cumulative += count
+               lines.append(f"{name}_bucket{format_labels(labels + (('le', format_value(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {format_value(values[-2])}")
+            lines.append(f"{name}_count{format_labels(labels)} {values[-1]}")
+      return '\n'.join(lines) + '\n'
+
+
+# Function to write the labels of a metric, e.g. {endpoint="main.products",method="GET"}
+def format_labels(labels):
+   if not labels:
+      return ''
+   escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+   return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+
+# Function to write a number the way Prometheus expects
+def format_value(value):
+   if isinstance(value, str):
+      return value
+   return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Function to create the registry with the application's metrics
+def create_registry():
+   registry = MetricsRegistry()
+   registry.counter('http_requests_total', 'Requests handled, by endpoint, method and status.')
+   registry.histogram('http_request_duration_seconds', 'Time taken to handle a request, by endpoint.',
+                      REQUEST_BUCKETS)
+   registry.histogram('http_request_queries', 'SQL queries made by a request, by endpoint.',
+                      QUERIES_PER_REQUEST_BUCKETS)
+   registry.histogram('db_query_duration_seconds', 'Time taken by each SQL query, by endpoint.', QUERY_BUCKETS)
+   registry.histogram('template_render_duration_seconds', 'Time taken to render a template, by template.',
+                      TEMPLATE_BUCKETS)
+   registry.counter('login_attempts_total', 'Login attempts, by outcome (allowed, blocked_ip or blocked_email).')
+   registry.histogram('password_hash_duration_seconds', 'Time spent in bcrypt, by operation (hash or verify).',
+                      PASSWORD_BUCKETS)
+   return registry
+
+
+# Function to get the label of the current endpoint (requests that matched no route share one label)
+def endpoint_label():
+   if has_request_context():
+      return request.endpoint or 'unmatched'
+   return 'none'
+
+
+# Function to get the metrics registry of the current application
+def get_metrics():
+   return current_app.extensions['metrics']
+
+
+# Route to the metrics (Prometheus text format). When METRICS_TOKEN is set, the scraper must send it as a
+# bearer token
+@metrics.route('/metrics')
+def metrics_page():
+   token = current_app.config.get('METRICS_TOKEN')
+   if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+      abort(401)
+   return Response(get_metrics().render(), mimetype='text/plain; version=0.0.4',
+                   headers={'Cache-Control': 'no-store'})
+
+
+# Function to time the SQL queries of an engine (the application's engine, and the async engine of the ASGI
+# server, whose queries run in the request's context as well)
+def instrument_engine(registry, engine):
+   @event.listens_for(engine, 'before_cursor_execute')
+   def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+      conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+   @event.listens_for(engine, 'after_cursor_execute')
+   def record_query(conn, cursor, statement, parameters, context, executemany):
+      started = conn.info['metrics_query_started'].pop()
+      registry.observe('db_query_duration_seconds', (('endpoint', endpoint_label()),), time.perf_counter() - started)
+      if has_request_context() and '_metrics_queries' in g:
+         g._metrics_queries += 1
+
+   @event.listens_for(engine, 'handle_error')
+   def discard_query_timer(context):
+      timers = context.connection.info.get('metrics_query_started') if context.connection is not None else None
+      if timers:
+         timers.pop()
+
+
+# Function to attach the metrics to the application: the request hooks, the database and template listeners
+# and the password hasher's timing
+def init_metrics(app):
+   if not app.config.get('METRICS_ENABLED', False):
+      return
+   registry = app.extensions['metrics'] = create_registry()
+
+   # Start timing the request (the queries made by the request are counted in g)
+   @app.before_request
+   def start_request_timer():
+      g._metrics_started = time.perf_counter()
+      g._metrics_queries = 0
+
+   # Remember the status of the response (teardown_request doesn't get it)
+   @app.after_request
+   def record_response_status(response):
+      g._metrics_status = response.status_code
+      return response
+
+   # Record the request once it is finished, including requests that raised an error
+   @app.teardown_request
+   def record_request(error=None):
+      started = g.pop('_metrics_started', None)
+      if started is None:
+         return
+      endpoint = endpoint_label()
+      status = 500 if error is not None else g.pop('_metrics_status', 500)
+      registry.inc('http_requests_total', (('endpoint', endpoint), ('method', request.method),
+                                           ('status', status)))
+      registry.observe('http_request_duration_seconds', (('endpoint', endpoint),), time.perf_counter() - started)
+      registry.observe('http_request_queries', (('endpoint', endpoint),), g.pop('_metrics_queries', 0))
+
+   # Time the SQL queries
+   with app.app_context():
+      instrument_engine(registry, db.engine)
+
+   # Time the templates (render_template() sends a signal before and after rendering)
+   def start_template_timer(sender, template, context, **extra):
+      g.setdefault('_metrics_templates', []).append(time.perf_counter())
+
+   def record_template(sender, template, context, **extra):
+      timers = g.get('_metrics_templates')
+      if timers:
+         registry.observe('template_render_duration_seconds', (('template', template.name),),
+                          time.perf_counter() - timers.pop())
+
+   before_render_template.connect(start_template_timer, app, weak=False)
+   template_rendered.connect(record_template, app, weak=False)
+
+   # Time bcrypt (recorded by the hashing threads)
+   hasher = app.extensions.get('password_hasher')
+   if hasher is not None:
+      hasher.observers.append(
+         lambda operation, seconds: registry.observe('password_hash_duration_seconds',
+                                                     (('operation', operation),), seconds))
+
+   # Count the login attempts allowed and blocked by the login throttle
+   throttle = app.extensions.get('login_throttle')
+   if throttle is not None:
+      throttle.observers.append(lambda outcome: registry.inc('login_attempts_total', (('outcome', outcome),)))
@@ -3,12 +3,19 @@
 # Import the required module(s)
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import event, func
+from sqlalchemy.engine import make_url
 from datetime import datetime, timezone
-import bcrypt
+from passwords import hash_password, verify_password, password_needs_rehash
 
 # Create the database object/instance
 db = SQLAlchemy()
 
+# Function to normalise an email address for comparisons (trimmed and in lowercase). Stored addresses keep the
+# case they were typed in, so lookups compare them in lowercase too (see User.find_by_email())
+def normalize_email(email):
+   return (email or '').strip().lower()
+
 # Define the User Model/class
 class User(db.Model, UserMixin):
    __tablename__ = 'user'
@@ -27,23 +34,41 @@ class User(db.Model, UserMixin):
    multi_factor_enabled = db.Column(db.Boolean, default=False)
    password_updated_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
 
+   # Index used by the lookups by email, which compare the addresses in lowercase
+   __table_args__ = (
+      db.Index('ix_user_email_lower', func.lower(email)),
+   )
+
    # Method to return a string representation of the object
    def __repr__(self):
       return f"Name: {self.full_name}, Email: {self.email}"
 
    # Method to hash and set the user's encrypted password
    def set_password(self, password):
-      self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+      self.password_hash = hash_password(password)
       self.password_updated_at = datetime.now(timezone.utc)
 
    # Method to authenticate the user
    def check_password(self, password):
-      return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+      return verify_password(password, self.password_hash)
+
+   # Method to re-hash the (just verified) password when it was hashed with a different bcrypt cost than the
+   # configured one. Returns True when the hash was replaced
+   def rehash_password_if_needed(self, password):
+      if not password_needs_rehash(self.password_hash):
+         return False
+      self.password_hash = hash_password(password)
+      return True
+
+   # Method to find a user by their email address, whatever its capitalisation
+   @staticmethod
+   def find_by_email(email):
+      return User.query.filter(func.lower(User.email) == normalize_email(email)).first()
 
    # Method to check if the user's email alread exists in the database
    @staticmethod
    def check_email_exists(email):
-      return User.query.filter_by(email=email).first() is not None
+      return User.find_by_email(email) is not None
 
    # Method to create the user account in the database
    def create_user(self, email,full_name,birth_date,gender,password):
@@ -60,19 +85,37 @@ class User(db.Model, UserMixin):
          db.session.commit()
          return user
 
+   # Method to set the names of the user's active roles (done once when the user is loaded for a request)
+   def set_role_names(self, role_names):
+      self._role_names = frozenset(role_names)
+
+   # Property to get the names of the user's active roles. Falls back to the user_role relationship when
+   # the user wasn't loaded through load_user_with_roles()
+   @property
+   def role_names(self):
+      role_names = getattr(self, '_role_names', None)
+      if role_names is None:
+         role_names = frozenset(ur.role.name for ur in self.user_role if ur.is_active)
+         self._role_names = role_names
+      return role_names
+
+   # Method to check whether the user has any of the given roles
+   def has_role(self, *names):
+      return not self.role_names.isdisjoint(names)
+
    # Method to check whether the user is an admin or manager
    def is_admin_or_manager(self):
       """Checks if the user has an admin or manager role"""
       if not self.is_authenticated:
          return False
-      return any(ur.role.name in ['Admin','Manager'] for ur in self.user_role if ur.is_active)
+      return self.has_role('Admin', 'Manager')
 
    # Method to check whether the user is an admin or manager
    def is_admin(self):
       """Checks if the user has an admin role"""
       if not self.is_authenticated:
          return False
-      return any(ur.role.name == 'Admin' for ur in self.user_roles if ur.is_active)
+      return self.has_role('Admin')
 
 # Define the Role model/class
 class Role(db.Model):
@@ -116,17 +159,97 @@ class Product(db.Model):
    name = db.Column(db.String,nullable=False)
    price = db.Column(db.Float,nullable=False)
 
+   # Composite indexes used by the keyset pagination of the catalogue (sort column + id tie-breaker)
+   __table_args__ = (
+      db.Index('ix_product_name_id', 'name', 'id'),
+      db.Index('ix_product_price_id', 'price', 'id'),
+   )
+
    # Method to return a string representation of the product
    def __repr__(self):
       return f"Product ID: {self.id}, Name: {self.name}, Price: {self.price}"
 
-# Function to create the Product table in the database and populate it with data
+# Define the ProductPriceHistory model/class (one row per price change made by a bulk price adjustment). The
+# rows written by the same adjustment share a batch id
+class ProductPriceHistory(db.Model):
+   __tablename__ = 'product_price_history'
+   id = db.Column(db.Integer, primary_key=True)
+   product_id = db.Column(db.String(120), db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False,
+                          index=True)
+   old_price = db.Column(db.Float, nullable=False)
+   new_price = db.Column(db.Float, nullable=False)
+   changed_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+   changed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+   batch_id = db.Column(db.String(32), nullable=False, index=True)
+
+   # Method to return a string representation of the price change
+   def __repr__(self):
+      return f"Product ID: {self.product_id}, Price: {self.old_price} -> {self.new_price}"
+
+# Define the Task model/class (the to-do items shown on the tasks page). Tasks without an owner are public
+# and shown to guests. Deleted tasks are kept (with deleted_at set) so that clients syncing with
+# /get_tasks?since=... learn about the deletion
+class Task(db.Model):
+   __tablename__ = 'task'
+   id = db.Column(db.Integer, primary_key=True)
+   user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+   title = db.Column(db.String(255), nullable=False)
+   done = db.Column(db.Boolean, nullable=False, default=False)
+   created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+   updated_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc),
+                          onupdate=lambda: datetime.now(timezone.utc))
+   deleted_at = db.Column(db.DateTime)
+
+   # Indexes for listing a user's tasks by status and for the delta sync (changes since a time)
+   __table_args__ = (
+      db.Index('ix_task_user_done_updated', 'user_id', 'done', 'updated_at'),
+      db.Index('ix_task_user_updated_id', 'user_id', 'updated_at', 'id'),
+   )
+
+   # Method to return a string representation of the task
+   def __repr__(self):
+      return f"Task ID: {self.id}, Title: {self.title}, Done: {self.done}"
+
+# Function to build the engine (connection pool) options from the application's configuration
+def engine_options(config):
+   url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+   if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+      return {}  # an in-memory database lives in a single shared connection
+   options = {
+      'pool_size': config.get('DB_POOL_SIZE', 10),
+      'max_overflow': config.get('DB_MAX_OVERFLOW', 20),
+      'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+      'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+   }
+   if url.get_backend_name() != 'sqlite':
+      options['pool_pre_ping'] = True  # replace connections dropped by the database server
+   return options
+
+
+# Function to create the listener that applies the configured pragmas to every new SQLite connection
+def sqlite_pragma_listener(pragmas):
+   def set_pragmas(dbapi_connection, connection_record):
+      cursor = dbapi_connection.cursor()
+      for name, value in pragmas.items():
+         cursor.execute(f"PRAGMA {name}={value}")
+      cursor.close()
+   return set_pragmas
+
+
+# Function to attach the database to the application. No database work is done here, the tables are
+# created (and seeded) by the 'flask seed' command
 def init_db(app):
+   app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
    db.init_app(app)
    with app.app_context():
-      db.create_all()
+      if db.engine.dialect.name == 'sqlite' and app.config.get('SQLITE_PRAGMAS'):
+         event.listen(db.engine, 'connect', sqlite_pragma_listener(app.config['SQLITE_PRAGMAS']))
 
-      # Populate the product table with data if it's empty
-      # if Product.query.count() == 0: # You can also use 'if not Product.query.first()'
 
+# Function to create the tables in the database, including any missing indexes
+def create_tables():
+   db.create_all()
 
+   # create_all() skips indexes on tables that already exist, so add any missing product indexes
+   for index in Product.__table__.indexes:
+      index.create(bind=db.engine, checkfirst=True)
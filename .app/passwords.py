@@ -0,0 +1,145 @@
+# Python file to hash and verify passwords with bcrypt on a bounded pool of worker threads.
+# bcrypt releases the GIL while it works, so the pool bounds the CPU a burst of logins can take to
+# PASSWORD_HASH_WORKERS cores. The request thread still waits for its hash, so the pool doesn't free request
+# threads: what keeps a burst from occupying all of them is the queue limit, as a request finding
+# PASSWORD_HASH_MAX_QUEUE jobs running or waiting is rejected straight away (503) instead of piling up
+
+# Import the required modules
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+
+import bcrypt
+from flask import current_app, has_app_context
+
+# Default bcrypt cost (log2 of the number of rounds), the same as bcrypt.gensalt()'s default
+DEFAULT_ROUNDS = 12
+
+
+# Exception raised when too many hashing jobs are already waiting for the worker pool
+class PasswordHasherBusy(Exception):
+   pass
+
+
+# Function to read the cost a bcrypt hash was created with, e.g. 12 for '$2b$12$...'
+def hash_rounds(password_hash):
+   try:
+      return int(password_hash.split('$')[2])
+   except (AttributeError, IndexError, ValueError):
+      return None
+
+
+# Class to run the bcrypt work on a bounded pool of threads
+class PasswordHasher:
+   def __init__(self, rounds=DEFAULT_ROUNDS, max_workers=None, max_queue=None):
+      self.rounds = rounds
+      self.max_workers = max_workers or os.cpu_count() or 1
+      self.max_queue = max_queue or self.max_workers * 4
+      self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='bcrypt')
+      # Counts the jobs that are running or waiting, so the queue can't grow past max_queue
+      self._slots = threading.BoundedSemaphore(self.max_queue)
+      # Functions called with the operation ('hash' or 'verify') and the seconds bcrypt took (e.g. metrics)
+      self.observers = []
+
+   # Method to run a function on the pool and wait for its result. The calling (request) thread blocks until
+   # the job is done, so at most max_queue request threads are ever waiting on bcrypt: when that many jobs are
+   # running or waiting the job is refused before it is queued
+   def _run(self, function, *args):
+      if not self._slots.acquire(blocking=False):
+         raise PasswordHasherBusy("Too many password hashing requests, please try again shortly")
+      try:
+         future = self._executor.submit(self._call, function, args)
+      except BaseException:
+         self._slots.release()
+         raise
+      future.add_done_callback(lambda _: self._slots.release())
+      return future.result()
+
+   # Method to run a function on a worker thread and tell the observers how long it took
+   def _call(self, function, args):
+      started = time.perf_counter()
+      try:
+         return function(*args)
+      finally:
+         for observer in self.observers:
+            observer(function.__name__.strip('_'), time.perf_counter() - started)
+
+   # Method to hash a password with the configured cost
+   def hash(self, password):
+      return self._run(_hash, password, self.rounds)
+
+   # Method to hash many passwords (e.g. bulk provisioning) and wait for all of them. Only max_workers of them
+   # are queued at a time, so the logins running meanwhile still find room in the queue
+   def hash_many(self, passwords):
+      in_flight = threading.BoundedSemaphore(self.max_workers)
+      futures = []
+      for password in passwords:
+         in_flight.acquire()
+         self._slots.acquire()
+         future = self._executor.submit(self._call, _hash, (password, self.rounds))
+         future.add_done_callback(lambda _: (self._slots.release(), in_flight.release()))
+         futures.append(future)
+      return [future.result() for future in futures]
+
+   # Method to check a password against a stored hash
+   def verify(self, password, password_hash):
+      return self._run(_verify, password, password_hash)
+
+   # Method to check whether a hash was created with a different cost than the configured one
+   def needs_rehash(self, password_hash):
+      return hash_rounds(password_hash) != self.rounds
+
+   # Method to stop the worker threads
+   def shutdown(self):
+      self._executor.shutdown(wait=True)
+
+
+# Function to hash a password (runs on the worker threads)
+def _hash(password, rounds):
+   return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+
+# Function to check a password (runs on the worker threads)
+def _verify(password, password_hash):
+   return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+# Function to get the password hasher of the current application (None outside the application)
+def get_hasher():
+   if not has_app_context():
+      return None
+   return current_app.extensions.get('password_hasher')
+
+
+# Function to hash a password, on the application's worker pool when there is one
+def hash_password(password):
+   hasher = get_hasher()
+   if hasher is None:
+      return _hash(password, DEFAULT_ROUNDS)
+   return hasher.hash(password)
+
+
+# Function to check a password, on the application's worker pool when there is one
+def verify_password(password, password_hash):
+   hasher = get_hasher()
+   if hasher is None:
+      return _verify(password, password_hash)
+   return hasher.verify(password, password_hash)
+
+
+# Function to check whether a stored hash should be replaced because the configured cost has changed
+def password_needs_rehash(password_hash):
+   hasher = get_hasher()
+   if hasher is None:
+      return hash_rounds(password_hash) != DEFAULT_ROUNDS
+   return hasher.needs_rehash(password_hash)
+
+
+# Function to attach the password hasher to the application
+def init_passwords(app):
+   app.extensions['password_hasher'] = PasswordHasher(
+      rounds=app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS),
+      max_workers=app.config.get('PASSWORD_HASH_WORKERS'),
+      max_queue=app.config.get('PASSWORD_HASH_MAX_QUEUE'),
+   )
@@ -0,0 +1,95 @@
+# Python file to load the logged-in user together with their roles, and to cache the role names per user
+
+# Import the required modules
+from flask import current_app, has_app_context
+from sqlalchemy import and_, event, inspect, select
+from sqlalchemy.orm import Session, object_session
+
+from models import db, User, Role, UserRole
+
+
+# Function to get the key the role names of a user are cached under
+def roles_key(user_id):
+   return f"roles:{user_id}"
+
+
+# Function to get the application's cache (shared with the catalogue), None when caching is disabled
+def get_cache():
+   return current_app.extensions.get('catalogue_cache')
+
+
+# Function to load a user and the names of their active roles. When the role names are cached only the
+# user row is read, otherwise the user and roles are read with a single joined query. Either way the
+# authorisation checks (is_admin(), is_admin_or_manager(), ...) don't need any further queries
+def load_user_with_roles(user_id):
+   role_names = cached_role_names(user_id)
+   if role_names is not None:
+      user = db.session.get(User, user_id)
+      if user is not None:
+         user.set_role_names(role_names)
+      return user
+   return user_from_role_rows(user_id, db.session.execute(user_roles_statement(user_id)).all())
+
+
+# Function to get the cached role names of a user (None when they aren't cached)
+def cached_role_names(user_id):
+   cache = get_cache()
+   return cache.get(roles_key(user_id)) if cache is not None else None
+
+
+# Function to build the query reading a user together with the names of their active roles (one row per role)
+def user_roles_statement(user_id):
+   return (select(User, Role.name)
+           .outerjoin(UserRole, and_(UserRole.user_id == User.id, UserRole.is_active.is_(True)))
+           .outerjoin(Role, Role.id == UserRole.role_id)
+           .where(User.id == user_id))
+
+
+# Function to get the user from the rows of user_roles_statement(), with their role names set (and cached)
+def user_from_role_rows(user_id, rows):
+   if not rows:
+      return None
+   user = rows[0][0]
+   role_names = sorted({name for _, name in rows if name is not None})
+   user.set_role_names(role_names)
+   cache = get_cache()
+   if cache is not None:
+      cache.set(roles_key(user_id), role_names)
+   return user
+
+
+# Function to forget the cached role names of the given users
+def invalidate_roles(user_ids):
+   cache = get_cache()
+   if cache is None:
+      return
+   for user_id in user_ids:
+      cache.delete(roles_key(user_id))
+
+
+# Record the users whose roles are changed in a flush. The cache is only cleared once the change is
+# committed, so a concurrent request can't re-cache the old roles in between
+@event.listens_for(UserRole, 'after_insert')
+@event.listens_for(UserRole, 'after_update')
+@event.listens_for(UserRole, 'after_delete')
+def record_role_change(mapper, connection, target):
+   session = object_session(target)
+   if session is None:
+      return
+   changed = session.info.setdefault('changed_role_users', set())
+   changed.add(target.user_id)
+   changed.update(inspect(target).attrs.user_id.history.deleted or ())
+
+
+# Clear the cached roles of the changed users after the transaction is committed
+@event.listens_for(Session, 'after_commit')
+def invalidate_changed_roles(session):
+   user_ids = session.info.pop('changed_role_users', None)
+   if user_ids and has_app_context():
+      invalidate_roles(user_ids)
+
+
+# Forget the changed users when the transaction is rolled back (nothing was changed)
+@event.listens_for(Session, 'after_rollback')
+def discard_changed_roles(session):
+   session.info.pop('changed_role_users', None)
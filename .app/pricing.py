@@ -0,0 +1,133 @@
+# Python file for bulk price adjustments: a percentage or an amount added to the price of every product matching
+# a filter (a list of IDs, a name match and/or a price range). An adjustment is set-based: one INSERT ... SELECT
+# writes the price history of the matching products and one UPDATE changes their prices, in a single transaction,
+# so no product is loaded into the session however many are changed. New prices are rounded to 2 decimal places
+# and never go below zero. The change must be a finite number, and a percentage can't take 100% or more off
+
+# Import the required modules
+from collections import namedtuple
+from datetime import datetime, timezone
+import math
+import re
+import time
+import uuid
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select, insert, update, func, case, cast, literal, Numeric, Float, DateTime, Integer, String
+
+from models import db, Product, ProductPriceHistory
+from catalogue import filter_products, invalidate_catalogue
+
+# The ways a price can be adjusted
+ADJUSTMENT_MODES = ('percent', 'amount')
+# Number of matching products listed by a preview
+PREVIEW_LIMIT = 50
+
+# The outcome of a preview (the number of products that would change and the first of them) and of an adjustment
+PricePreview = namedtuple('PricePreview', ['matched', 'rows'])
+PriceAdjustment = namedtuple('PriceAdjustment', ['changed', 'batch_id', 'elapsed'])
+
+
+# Function to get the SQL expression of the new price of a product. Raises ValueError for a change that would
+# leave the prices infinite, NaN or (for a percentage) at zero or below
+def new_price_expression(mode, value):
+   if not isinstance(value, (int, float)) or isinstance(value, bool) or not math.isfinite(value):
+      raise ValueError(f"Invalid price adjustment: {value!r}")
+   if mode == 'percent' and value <= -100:
+      raise ValueError("A percentage can't take 100% or more off the prices")
+   if mode == 'percent':
+      price = Product.price * (1 + value / 100)
+   elif mode == 'amount':
+      price = Product.price + value
+   else:
+      raise ValueError(f"Unknown price adjustment: {mode}")
+   # Rounded as a decimal (round() of a float isn't available on every database)
+   price = cast(func.round(cast(price, Numeric), 2), Float)
+   return case((price < 0, 0.0), else_=price)
+
+
+# Function to split a list of product IDs (separated by commas, spaces or new lines)
+def parse_product_ids(text):
+   return [product_id for product_id in re.split(r'[\s,]+', text or '') if product_id]
+
+
+# Function to restrict a statement (select, insert ... select or update) to the products an adjustment changes.
+# Products whose price stays the same are left out, so they get no history row. Adjusting every product must be
+# asked for with all_products, so that an empty filter can't change the whole catalogue by mistake
+def filter_adjusted(statement, new_price, product_ids=None, q=None, min_price=None, max_price=None,
+                    all_products=False):
+   if not (product_ids or q or min_price is not None or max_price is not None or all_products):
+      raise ValueError("Choose the products to adjust (IDs, a name or a price range) or all products")
+   statement = filter_products(statement, q, min_price, max_price)
+   if product_ids:
+      statement = statement.filter(Product.id.in_(product_ids))
+   return statement.filter(new_price != Product.price)
+
+
+# Function to preview an adjustment: the number of products it would change and the first PREVIEW_LIMIT of them
+# (id, name, price and new_price rows read with Core, no ORM objects are created)
+def preview_price_adjustment(mode, value, product_ids=None, q=None, min_price=None, max_price=None,
+                             all_products=False, limit=PREVIEW_LIMIT):
+   new_price = new_price_expression(mode, value)
+   matched = db.session.scalar(filter_adjusted(select(func.count()).select_from(Product), new_price,
+                                               product_ids, q, min_price, max_price, all_products))
+   statement = filter_adjusted(select(Product.id, Product.name, Product.price, new_price.label('new_price')),
+                               new_price, product_ids, q, min_price, max_price, all_products)
+   rows = db.session.execute(statement.order_by(Product.name, Product.id).limit(limit)).all()
+   return PricePreview(matched, rows)
+
+
+# Function to adjust the prices of the matching products. The history rows are written first (reading the old
+# prices, with the rows locked on databases that support it), then the prices are changed by one UPDATE
+def adjust_prices(mode, value, product_ids=None, q=None, min_price=None, max_price=None, all_products=False,
+                  changed_by=None):
+   start = time.perf_counter()
+   new_price = new_price_expression(mode, value)
+   batch_id = uuid.uuid4().hex
+   history = filter_adjusted(
+      select(Product.id, Product.price, new_price, literal(datetime.now(timezone.utc), DateTime),
+             literal(changed_by, Integer), literal(batch_id, String)),
+      new_price, product_ids, q, min_price, max_price, all_products).with_for_update()
+   prices = filter_adjusted(update(Product), new_price, product_ids, q, min_price, max_price, all_products)
+   try:
+      db.session.execute(insert(ProductPriceHistory).from_select(
+         ['product_id', 'old_price', 'new_price', 'changed_at', 'changed_by', 'batch_id'], history))
+      result = db.session.execute(prices.values(price=new_price).execution_options(synchronize_session=False))
+      db.session.commit()
+   except Exception:
+      db.session.rollback()
+      raise
+   if result.rowcount:
+      invalidate_catalogue()
+   return PriceAdjustment(result.rowcount, batch_id, time.perf_counter() - start)
+
+
+# Flask CLI command to adjust prices, e.g. 'flask --app index adjust-prices --percent 10 --name coffee --preview'
+@click.command('adjust-prices')
+@click.option('--percent', type=float, default=None, help='Percentage to add (negative for a discount).')
+@click.option('--amount', type=float, default=None, help='Amount to add (negative to reduce the prices).')
+@click.option('--ids', default=None, help='Product IDs, separated by commas.')
+@click.option('--name', 'q', default=None, help='Only products whose name contains this text.')
+@click.option('--min-price', type=float, default=None, help='Only products costing at least this much.')
+@click.option('--max-price', type=float, default=None, help='Only products costing at most this much.')
+@click.option('--all', 'all_products', is_flag=True, help='Adjust every product.')
+@click.option('--preview', is_flag=True, help='Only show the products that would change.')
+@with_appcontext
+def adjust_prices_command(percent, amount, ids, q, min_price, max_price, all_products, preview):
+   if (percent is None) == (amount is None):
+      raise click.UsageError('Give either --percent or --amount')
+   mode, value = ('percent', percent) if percent is not None else ('amount', amount)
+   options = dict(product_ids=parse_product_ids(ids), q=q, min_price=min_price, max_price=max_price,
+                  all_products=all_products)
+   try:
+      if preview:
+         result = preview_price_adjustment(mode, value, **options)
+         for row in result.rows:
+            click.echo(f"{row.id}  {row.name}: {row.price:.2f} -> {row.new_price:.2f}")
+         click.echo(f"{result.matched} products would change")
+         return
+      result = adjust_prices(mode, value, **options)
+   except ValueError as error:
+      raise click.UsageError(str(error))
+   click.echo(f"Changed the price of {result.changed} products in {result.elapsed:.2f}s (batch {result.batch_id})")
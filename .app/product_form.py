@@ -1,11 +1,36 @@
 # Python script for the product form
 
 # Import the required modules
+import math
+
 from flask_wtf import FlaskForm
-from wtforms import StringField, FloatField
-from wtforms.validators import DataRequired
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import StringField, FloatField, SelectField, TextAreaField, BooleanField
+from wtforms.validators import DataRequired, InputRequired, Optional, ValidationError
+
+# Validator rejecting the numbers a FloatField accepts that aren't prices (inf, -inf and nan)
+def finite(form, field):
+   if field.data is not None and not math.isfinite(field.data):
+      raise ValidationError('Please enter a number')
 
 # Create the Product form
 class ProductForm(FlaskForm):
    name = StringField('Name', validators=[DataRequired()])
-   price = FloatField('Price', validators=[DataRequired()])
\ No newline at end of file
+   price = FloatField('Price', validators=[DataRequired(), finite])
+
+# Create the bulk product import form (CSV or NDJSON supplier price lists)
+class ProductImportForm(FlaskForm):
+   file = FileField('Price List', validators=[
+      FileRequired(message='Please select a price list to import'),
+      FileAllowed(['csv', 'ndjson', 'jsonl'], message='Only CSV or NDJSON files can be imported'),
+   ])
+
+# Create the bulk price adjustment form (a percentage or amount added to the prices of the matching products)
+class PriceAdjustmentForm(FlaskForm):
+   mode = SelectField('Change', choices=[('percent', 'Percentage (%)'), ('amount', 'Amount (Kes.)')])
+   value = FloatField('By', validators=[InputRequired(message='Please enter the change, e.g. 10 or -5'), finite])
+   ids = TextAreaField('Product IDs', validators=[Optional()])
+   name = StringField('Name contains', validators=[Optional()])
+   min_price = FloatField('Minimum price', validators=[Optional(), finite])
+   max_price = FloatField('Maximum price', validators=[Optional(), finite])
+   all_products = BooleanField('All products')
@@ -0,0 +1,239 @@
+# Python file to bulk import (upsert) products from a CSV or NDJSON supplier price list
+
+# Import the required modules
+import csv
+import io
+import json
+import math
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Product
+from catalogue import invalidate_catalogue
+from ids import generate_product_id
+
+# Number of rows sent to the database in a single executemany call
+DEFAULT_BATCH_SIZE = 1000
+# Number of batches written before the transaction is committed
+DEFAULT_COMMIT_EVERY = 10
+# Maximum number of row errors kept in the report (the total is still counted)
+MAX_REPORTED_ERRORS = 1000
+
+
+# Class to hold the outcome of an import
+class ImportReport:
+   def __init__(self):
+      self.processed = 0
+      self.imported = 0
+      self.failed = 0
+      self.errors = []
+      self.elapsed = 0.0
+
+   # Method to record a failed row together with its line number in the source file
+   def add_error(self, line, message):
+      self.failed += 1
+      if len(self.errors) < MAX_REPORTED_ERRORS:
+         self.errors.append((line, message))
+
+   # Property to get the import throughput
+   @property
+   def rows_per_second(self):
+      return self.processed / self.elapsed if self.elapsed else 0.0
+
+   # Method to return the report as a dictionary (used by the JSON responses)
+   def as_dict(self):
+      return {
+         'processed': self.processed,
+         'imported': self.imported,
+         'failed': self.failed,
+         'errors': [{'line': line, 'error': message} for line, message in self.errors],
+         'elapsed_seconds': round(self.elapsed, 3),
+         'rows_per_second': round(self.rows_per_second, 1),
+      }
+
+
+# Generator that parses a CSV price list one row at a time, yielding (line number, row) pairs
+def iter_csv_rows(text_stream):
+   reader = csv.DictReader(text_stream)
+   for row in reader:
+      yield reader.line_num, row
+
+
+# Generator that parses an NDJSON price list one line at a time, yielding (line number, row) pairs
+def iter_ndjson_rows(text_stream):
+   for line_number, line in enumerate(text_stream, start=1):
+      line = line.strip()
+      if not line:
+         continue
+      try:
+         yield line_number, json.loads(line)
+      except ValueError as e:
+         yield line_number, ValueError(f"Invalid JSON: {e}")
+
+
+# Function to validate a parsed row and convert it into the values of a product row
+def clean_row(row):
+   if isinstance(row, Exception):
+      raise row
+   if not isinstance(row, dict):
+      raise ValueError("Row must be an object")
+   # Rows without an id are new products and get a freshly generated one
+   product_id = str(row.get('id') or '').strip() or generate_product_id()
+   name = str(row.get('name') or '').strip()
+   if len(product_id) > 120:
+      raise ValueError("Product id must be 120 characters or less")
+   if not name:
+      raise ValueError("Missing product name")
+   # Booleans, NaN and infinity are rejected here, the database would fail the whole batch on them
+   try:
+      if isinstance(row.get('price'), bool):
+         raise TypeError
+      price = float(row.get('price'))
+   except (TypeError, ValueError):
+      raise ValueError(f"Invalid price: {row.get('price')!r}")
+   if not math.isfinite(price):
+      raise ValueError(f"Invalid price: {row.get('price')!r}")
+   if price < 0:
+      raise ValueError("Price cannot be negative")
+   return {'id': product_id, 'name': name, 'price': price}
+
+
+# Function to build the dialect specific 'insert ... on conflict do update' statement for products
+def product_upsert_statement():
+   dialect = db.engine.dialect.name
+   if dialect == 'sqlite':
+      from sqlalchemy.dialects.sqlite import insert
+   elif dialect == 'postgresql':
+      from sqlalchemy.dialects.postgresql import insert
+   else:
+      return None
+   statement = insert(Product.__table__)
+   return statement.on_conflict_do_update(
+      index_elements=[Product.__table__.c.id],
+      set_={'name': statement.excluded.name, 'price': statement.excluded.price},
+   )
+
+
+# Function to write a batch of product rows with a single executemany call
+def upsert_products(rows):
+   if not rows:
+      return
+   statement = product_upsert_statement()
+   if statement is None:
+      # Databases without 'on conflict' support fall back to the (slower) ORM merge
+      for row in rows:
+         db.session.merge(Product(**row))
+      return
+   db.session.execute(statement, rows)
+
+
+# Function to import the products read from the given row iterator
+def import_rows(rows, batch_size=DEFAULT_BATCH_SIZE, commit_every=DEFAULT_COMMIT_EVERY):
+   report = ImportReport()
+   started = time.perf_counter()
+   batch, batch_lines = {}, []
+   pending_lines, pending_batches = [], 0
+
+   # Function to commit the batches written so far. If the transaction fails every row in it is
+   # reported as failed, so the report always matches what is in the database
+   def commit_pending():
+      nonlocal pending_lines, pending_batches
+      try:
+         db.session.commit()
+         report.imported += len(pending_lines)
+      except SQLAlchemyError as e:
+         db.session.rollback()
+         for line in pending_lines:
+            report.add_error(line, f"Database error: {e.__class__.__name__}")
+      pending_lines, pending_batches = [], 0
+
+   # Function to send the current batch to the database
+   def flush_batch():
+      nonlocal batch, batch_lines, pending_batches
+      try:
+         upsert_products(list(batch.values()))
+         pending_lines.extend(batch_lines)
+         pending_batches += 1
+      except SQLAlchemyError as e:
+         db.session.rollback()
+         for line in pending_lines + batch_lines:
+            report.add_error(line, f"Database error: {e.__class__.__name__}")
+         pending_lines.clear()
+         pending_batches = 0
+      batch, batch_lines = {}, []
+      if pending_batches >= commit_every:
+         commit_pending()
+
+   line = 0
+   try:
+      for line, row in rows:
+         report.processed += 1
+         try:
+            values = clean_row(row)
+         except ValueError as e:
+            report.add_error(line, str(e))
+            continue
+         # A later row for the same id in the same batch replaces the earlier one
+         batch[values['id']] = values
+         batch_lines.append(line)
+         if len(batch) >= batch_size:
+            flush_batch()
+   except (UnicodeDecodeError, csv.Error) as e:
+      # The rest of the file can't be read (e.g. it isn't UTF-8 or a quote is never closed). The rows read so
+      # far are still imported, the failure is reported after the last of them
+      report.add_error(line + 1, f"Unreadable file: {e}")
+
+   if batch:
+      flush_batch()
+   if pending_lines:
+      commit_pending()
+   if report.imported:
+      invalidate_catalogue()
+
+   report.elapsed = time.perf_counter() - started
+   return report
+
+
+# Function to import products from an open file. Binary streams (e.g. uploaded files) are decoded
+# on the fly, so the file is never read into memory in one go
+def import_products(stream, file_format='csv', batch_size=DEFAULT_BATCH_SIZE,
+                    commit_every=DEFAULT_COMMIT_EVERY):
+   if not isinstance(stream, io.TextIOBase):
+      stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+   if file_format == 'csv':
+      rows = iter_csv_rows(stream)
+   elif file_format in ('ndjson', 'jsonl', 'json'):
+      rows = iter_ndjson_rows(stream)
+   else:
+      raise ValueError(f"Unsupported import format: {file_format}")
+   return import_rows(rows, batch_size=batch_size, commit_every=commit_every)
+
+
+# Function to work out the import format from a file name
+def format_from_filename(filename):
+   extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+   return 'csv' if extension == 'csv' else 'ndjson'
+
+
+# Flask CLI command to import a price list, e.g. 'flask --app index import-products prices.csv'
+@click.command('import-products')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']), default=None,
+              help='File format (defaults to the file extension).')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+              help='Rows per executemany batch.')
+@click.option('--commit-every', default=DEFAULT_COMMIT_EVERY, show_default=True,
+              help='Batches per transaction.')
+@with_appcontext
+def import_products_command(path, file_format, batch_size, commit_every):
+   file_format = file_format or format_from_filename(path)
+   with open(path, encoding='utf-8-sig', newline='') as stream:
+      report = import_products(stream, file_format, batch_size=batch_size, commit_every=commit_every)
+
+   for line, message in report.errors:
+      click.echo(f"Line {line}: {message}", err=True)
+   click.echo(f"Processed {report.processed} rows: {report.imported} imported, {report.failed} failed "
+              f"in {report.elapsed:.2f}s ({report.rows_per_second:,.0f} rows/s)")
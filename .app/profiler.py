@@ -0,0 +1,191 @@
+# Python file with an opt-in SQL profiler for development (SQL_PROFILER_ENABLED=1). It records every SQL
+# statement of a request with its time and the line of the application that made it, flags statements of the
+# same shape run again and again in one request (N+1 suspects, e.g. lazy loading UserRole.user/role in a loop)
+# and logs slow statements with their query plan. Each response gets an X-SQL-Profile summary header, and the
+# full reports of the latest requests are shown at /_profiler
+
+# Import the required modules
+from collections import Counter, deque
+import itertools
+import os
+import re
+import sys
+import threading
+import time
+
+from flask import Blueprint, abort, current_app, g, has_request_context, render_template, request, url_for
+from sqlalchemy import event
+
+from models import db
+
+# Create the blueprint holding the profiler's pages. It is only registered when the profiler is enabled
+profiler = Blueprint('profiler', __name__, url_prefix='/_profiler')
+
+# Folder holding the application (only its own files are reported as call sites)
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Patterns used to turn statements into shapes: IN lists of any length and runs of whitespace
+IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)|\(\s*%\(\w+\)s(?:\s*,\s*%\(\w+\)s)*\s*\)')
+WHITESPACE = re.compile(r'\s+')
+
+
+# Class holding the profile of one request
+class RequestProfile:
+   _ids = itertools.count(1)
+
+   def __init__(self, method, path, endpoint):
+      self.id = next(self._ids)
+      self.method = method
+      self.path = path
+      self.endpoint = endpoint
+      self.started = time.time()
+      self.status = None
+      self.duration = 0.0
+      self.queries = []
+      self.n_plus_one = []
+      self.slow = []
+
+   # Property to get the total time spent in SQL
+   @property
+   def sql_time(self):
+      return sum(query['duration'] for query in self.queries)
+
+   # Method to get the one line summary sent in the X-SQL-Profile header
+   def summary(self):
+      return (f"queries={len(self.queries)}; sql_ms={self.sql_time * 1000:.1f}; "
+              f"n_plus_one={len(self.n_plus_one)}; slow={len(self.slow)}; "
+              f"report={url_for('profiler.report', profile_id=self.id)}")
+
+
+# Function to turn a statement into its shape (the same shape means the same query with other values)
+def statement_shape(statement):
+   return IN_LIST.sub('(?...)', WHITESPACE.sub(' ', statement).strip())
+
+
+# Function to find the line of the application that made the current query (the innermost frame in one of
+# the application's own files, other than this one)
+def call_site():
+   frame = sys._getframe(2)
+   while frame is not None:
+      filename = frame.f_code.co_filename
+      if filename.startswith(APP_DIR) and filename != __file__ and 'site-packages' not in filename:
+         return f"{os.path.relpath(filename, APP_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}"
+      frame = frame.f_back
+   return None
+
+
+# Function to find the N+1 suspects of a request: SELECT shapes run at least threshold times
+def find_n_plus_one(queries, threshold):
+   counts = Counter(query['shape'] for query in queries if query['shape'].upper().startswith('SELECT'))
+   suspects = []
+   for shape, count in counts.most_common():
+      if count < threshold:
+         break
+      matching = [query for query in queries if query['shape'] == shape]
+      suspects.append({'shape': shape, 'count': count, 'duration': sum(query['duration'] for query in matching),
+                       'call_sites': sorted({query['call_site'] or 'unknown' for query in matching})})
+   return suspects
+
+
+# Function to get the query plan of a statement (EXPLAIN QUERY PLAN on SQLite, EXPLAIN elsewhere). Called once
+# the request's profile is finished, so these statements aren't recorded themselves
+def explain(statement, parameters):
+   prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+   try:
+      with db.engine.connect() as connection:
+         rows = connection.exec_driver_sql(prefix + statement, parameters).all()
+   except Exception as e:
+      return [f"(no plan: {e.__class__.__name__}: {e})"]
+   return [' | '.join(str(value) for value in row) for row in rows]
+
+
+# Function to get the profiles of the latest requests
+def get_profiles():
+   return current_app.extensions['sql_profiler']
+
+
+# Route to the list of the latest profiled requests
+@profiler.route('/')
+def reports():
+   profiles, lock = get_profiles()
+   with lock:
+      latest = list(reversed(profiles))
+   return render_template('sql-profiler.html', profiles=latest, profile=None)
+
+
+# Route to the full report of a profiled request
+@profiler.route('/<int:profile_id>')
+def report(profile_id):
+   profiles, lock = get_profiles()
+   with lock:
+      profile = next((profile for profile in profiles if profile.id == profile_id), None)
+   if profile is None:
+      abort(404)
+   return render_template('sql-profiler.html', profiles=None, profile=profile)
+
+
+# Function to attach the profiler to the application (only when SQL_PROFILER_ENABLED is set)
+def init_profiler(app):
+   if not app.config.get('SQL_PROFILER_ENABLED'):
+      return
+   slow_seconds = app.config.get('SQL_PROFILER_SLOW_MS', 100) / 1000
+   threshold = app.config.get('SQL_PROFILER_N_PLUS_ONE', 3)
+   app.extensions['sql_profiler'] = (deque(maxlen=app.config.get('SQL_PROFILER_HISTORY', 50)), threading.Lock())
+
+   # Start a profile for every request except the profiler's own pages
+   @app.before_request
+   def start_profile():
+      if request.blueprint != 'profiler':
+         g.sql_profile = RequestProfile(request.method, request.full_path.rstrip('?'), request.endpoint)
+
+   # Finish the profile: find the N+1 suspects, explain the slow queries and add the summary header
+   @app.after_request
+   def finish_profile(response):
+      profile = g.pop('sql_profile', None)
+      if profile is None:
+         return response
+      profile.status = response.status_code
+      profile.duration = time.time() - profile.started
+      profile.n_plus_one = find_n_plus_one(profile.queries, threshold)
+      for suspect in profile.n_plus_one:
+         app.logger.warning("Possible N+1 in %s %s: %d x %s (from %s)", profile.method, profile.path,
+                            suspect['count'], suspect['shape'], ', '.join(suspect['call_sites']))
+      for query in profile.queries:
+         if query['duration'] >= slow_seconds and not query['executemany']:
+            query['plan'] = explain(query['statement'], query['parameters'])
+            profile.slow.append(query)
+            app.logger.warning("Slow query (%.1f ms) in %s %s from %s: %s\n  plan: %s", query['duration'] * 1000,
+                               profile.method, profile.path, query['call_site'], query['shape'],
+                               '\n        '.join(query['plan']))
+      profiles, lock = get_profiles()
+      with lock:
+         profiles.append(profile)
+      response.headers['X-SQL-Profile'] = profile.summary()
+      return response
+
+   # Record every statement made while handling a request
+   with app.app_context():
+      engine = db.engine
+
+   @event.listens_for(engine, 'before_cursor_execute')
+   def start_statement(conn, cursor, statement, parameters, context, executemany):
+      if has_request_context() and 'sql_profile' in g:
+         conn.info.setdefault('profiler_started', []).append((time.perf_counter(), call_site()))
+
+   @event.listens_for(engine, 'after_cursor_execute')
+   def record_statement(conn, cursor, statement, parameters, context, executemany):
+      timers = conn.info.get('profiler_started')
+      if not timers or not has_request_context() or 'sql_profile' not in g:
+         return
+      started, site = timers.pop()
+      g.sql_profile.queries.append({
+         'statement': statement, 'shape': statement_shape(statement), 'executemany': executemany,
+         'parameters': parameters, 'duration': time.perf_counter() - started, 'call_site': site, 'plan': None,
+      })
+
+   @event.listens_for(engine, 'handle_error')
+   def discard_statement(context):
+      timers = context.connection.info.get('profiler_started') if context.connection is not None else None
+      if timers:
+         timers.pop()
+
@@ -0,0 +1,166 @@
+# Python file for the full-text product search, backed by an SQLite FTS5 index over the product names.
+# The index is an external-content FTS5 table (it stores no copy of the names) kept in sync by triggers on
+# the product table, so every write path (forms, bulk import, raw SQL) updates it incrementally
+
+# Import the required modules
+from contextlib import contextmanager
+import re
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from models import db
+from catalogue import filter_products, product_to_dict, clamp_page_size
+
+# Statements creating the FTS5 index and the triggers that keep it in sync with the product table.
+# prefix='2 3' adds prefix indexes so that 'cof*' style queries don't scan the whole term list
+SEARCH_SCHEMA = [
+   """CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+         name, content='product', content_rowid='rowid',
+         tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+   """CREATE TRIGGER IF NOT EXISTS product_fts_insert AFTER INSERT ON product BEGIN
+         INSERT INTO product_fts(rowid, name) VALUES (new.rowid, new.name);
+      END""",
+   """CREATE TRIGGER IF NOT EXISTS product_fts_delete AFTER DELETE ON product BEGIN
+         INSERT INTO product_fts(product_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+      END""",
+   """CREATE TRIGGER IF NOT EXISTS product_fts_update AFTER UPDATE OF name ON product BEGIN
+         INSERT INTO product_fts(product_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+         INSERT INTO product_fts(rowid, name) VALUES (new.rowid, new.name);
+      END""",
+]
+
+
+# Cache of whether each database (by URL) supports FTS5, so the check is only run once per process
+_fts5_support = {}
+# Databases (by URL) whose search index is known to exist
+_index_ready = set()
+
+
+# Function to check whether the database supports the FTS5 search index
+def search_index_supported():
+   if db.engine.dialect.name != 'sqlite':
+      return False
+   key = str(db.engine.url)
+   if key not in _fts5_support:
+      _fts5_support[key] = bool(db.session.execute(
+         text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar())
+   return _fts5_support[key]
+
+
+# Function to check whether the search index has been created
+def search_index_exists():
+   return db.session.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_fts'")
+                             ).first() is not None
+
+
+# Function to check whether searches can use the index. Only a positive answer is remembered, so an index
+# created while the application is running is picked up
+def search_index_ready():
+   key = str(db.engine.url)
+   if key in _index_ready:
+      return True
+   if search_index_supported() and search_index_exists():
+      _index_ready.add(key)
+      return True
+   return False
+
+
+# Function to create the search index and its triggers (called when the tables are created). An index
+# created for an existing catalogue is filled straight away
+def create_search_index():
+   if not search_index_supported():
+      return False
+   existed = search_index_exists()
+   for statement in SEARCH_SCHEMA:
+      db.session.execute(text(statement))
+   if not existed:
+      rebuild_search_index()
+   db.session.commit()
+   return True
+
+
+# Function to rebuild the whole search index from the product table. Needed after a VACUUM, which can
+# renumber the rowids of the product table (its primary key is a string)
+def rebuild_search_index():
+   db.session.execute(text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+
+
+# Context manager for loading many products at once (e.g. synthetic datasets): the insert trigger is dropped
+# while the products are added and the new products are indexed with one statement at the end, which is about
+# twice as fast as indexing them row by row. Products added by other connections in the meantime aren't indexed
+# until the next 'flask rebuild-search', so only use it for offline loads
+@contextmanager
+def search_index_deferred():
+   if not search_index_ready():
+      yield
+      return
+   last_rowid = db.session.execute(text("SELECT coalesce(max(rowid), 0) FROM product")).scalar()
+   db.session.execute(text("DROP TRIGGER IF EXISTS product_fts_insert"))
+   db.session.commit()
+   try:
+      yield
+   finally:
+      db.session.rollback()
+      db.session.execute(text("INSERT INTO product_fts(rowid, name) SELECT rowid, name FROM product "
+                              "WHERE rowid > :last_rowid"), {'last_rowid': last_rowid})
+      db.session.execute(text(SEARCH_SCHEMA[1]))
+      db.session.commit()
+
+
+# Function to turn the user's search terms into an FTS5 query: every word must match, and the words are
+# matched as prefixes ('choc dar' finds 'Chocolate - Dark'). Quoting each word keeps FTS5 operators and
+# punctuation typed by the user from being interpreted as query syntax
+def build_match_query(terms):
+   words = re.findall(r'\w+', terms or '')
+   return ' '.join(f'"{word}"*' for word in words)
+
+
+# Function to search the products. Returns (results, has_more), the results being dictionaries ordered by
+# relevance (best first). Without search terms the products in the price range are listed by name
+def search_products(terms, min_price=None, max_price=None, page=1, per_page=25):
+   per_page = clamp_page_size(per_page)
+   page = max(1, page)
+   match = build_match_query(terms)
+   if not match and min_price is None and max_price is None:
+      return [], False
+
+   if not match or not search_index_ready():
+      # Price-only searches use the catalogue filter, as do databases without FTS5 (or without the index yet),
+      # which fall back to a (slower) substring search
+      query = filter_products(q=terms if match else None, min_price=min_price, max_price=max_price)
+      products = query.order_by('name', 'id').offset((page - 1) * per_page).limit(per_page + 1).all()
+      return [product_to_dict(product) for product in products[:per_page]], len(products) > per_page
+
+   # Every match (within the price range) is ranked with bm25, so the best products are found however many
+   # products match. The rowid breaks ties, keeping the pages stable
+   filters = ""
+   params = {'match': match, 'limit': per_page + 1, 'offset': (page - 1) * per_page}
+   if min_price is not None:
+      filters += " AND p.price >= :min_price"
+      params['min_price'] = min_price
+   if max_price is not None:
+      filters += " AND p.price <= :max_price"
+      params['max_price'] = max_price
+   sql = ("SELECT p.id, p.name, p.price FROM product_fts JOIN product AS p ON p.rowid = product_fts.rowid "
+          f"WHERE product_fts MATCH :match{filters} "
+          "ORDER BY product_fts.rank, p.rowid LIMIT :limit OFFSET :offset")
+
+   rows = db.session.execute(text(sql), params).mappings().all()
+   return [dict(row) for row in rows[:per_page]], len(rows) > per_page
+
+
+# Flask CLI command to rebuild the search index, e.g. 'flask --app index rebuild-search'
+@click.command('rebuild-search')
+@with_appcontext
+def rebuild_search_command():
+   if not search_index_supported():
+      click.echo("The database doesn't support FTS5, product search uses substring matching")
+      return
+   if not search_index_exists():
+      create_search_index()
+   else:
+      rebuild_search_index()
+      db.session.commit()
+   click.echo("Product search index rebuilt")
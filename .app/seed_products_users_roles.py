@@ -3,11 +3,20 @@
 
 # import the required modules
 from datetime import datetime
-from models import db,User,Role,UserRole, Product
-import bcrypt
+import time
+from models import db,User,Role,UserRole, Product, Task, create_tables
+from tasks import tasks
+from product_import import upsert_products
+from passwords import hash_password
+from search import create_search_index
+from sqlalchemy import insert, or_, select
+from flask import current_app
+from flask.cli import with_appcontext
+import click
 import pytz
 
-# Function to create/seed the application's initial roles in the database
+# Function to create/seed the application's initial roles in the database.
+# The existing roles are read with one query and the missing ones added with a single batched insert
 def seed_initial_roles(now = None):
    roles = [
       {"name":"Admin","description":"System administrator with full access","is_system_admin":True},
@@ -17,56 +26,51 @@ def seed_initial_roles(now = None):
       {"name": "Customer", "description": "Regular customer", "is_system_admin": False},
    ]
 
-   for role_data in roles:
-      role = Role.query.filter_by(name=role_data["name"]).first()
-      if role:
-         continue
-      role = Role(
-         name = role_data["name"],
-         description = role_data["description"],
-         is_system_admin = role_data["is_system_admin"],
-      )
+   existing = set(db.session.scalars(select(Role.name).where(Role.name.in_([r["name"] for r in roles]))))
+   missing = [role_data for role_data in roles if role_data["name"] not in existing]
+   if now is not None:
+      missing = [dict(role_data, created_at=now, updated_at=now) for role_data in missing]
 
-      if now is None:
-         role.created_at = now
-         role.updated_at = now
+   if missing:
+      db.session.execute(insert(Role), missing)
+   return len(missing)
 
-      db.session.add(role)
+# Function to create/seed the products in the database (only when the product table is empty)
+def seed_products():
+   if db.session.scalar(select(Product.id).limit(1)) is not None:
+      return 0
+
+   # Variable to hold the records to be inserted/added to the product table
+   sample_records = [
+      ('01H73QEWMF1KG6QADD', 'Ground beef parties - 25% Fat', 980.0),
+      ('01H73QEWMFMWNQPSM', 'Coffee - Hazelnut Cream', 815.0),
+      ('01H73QEWMGFSMTWR3X', 'Coffee - Flavoured', 905.0),
+      ('01H73QEWMGHCW3PXFR', 'Tequila Rose Cream Liquor', 675.0),
+      ('01H73QEWMG9MD4CTB9', 'Split Peas - Yellow, Dry', 820.0),
+      ('01H73QEWMGTRXVQYY', 'Wine - Vineland Estate Semi - Dry', 855.0),
+      ('01H73QEWMH3GCAA4P', 'Mushroom - Chanterelle, Dry', 585.0),
+      ('01H73QEWMHM6WXBGM', 'Butter - KCC Salted', 760.0),
+      ('01H73QEWMHPX9KZ2YV', 'Olives - Black, Pitted', 450.0),
+      ('01H73QEWMHQ7T5R6WX', 'Pasta - Fettuccine, Egg', 320.0),
+      ('01H73QEWMHR4F8S9D2', 'Cheese - Cheddar, Medium', 690.0),
+      ('01H73QEWMHS1G3H5J7', 'Chicken - Whole Roasting', 1250.0),
+      ('01H73QEWMHT9K8L2P4', 'Tomatoes - Cherry, Yellow', 380.0),
+      ('01H73QEWMHV7M6N1Q3', 'Bread - Italian Roll With Herbs', 420.0),
+      ('01H73QEWMHW5T9R7Y2', 'Salmon - Fillets', 1980.0),
+      ('01H73QEWMHX3V8B6N5', 'Chocolate - Dark, 70% Cocoa', 550.0)
+   ]
 
-   db.session.commit() # Save/persist the changes in the roles table
+   # Insert the above sample data into the Product table with a single batched insert
+   upsert_products([{'id': record[0], 'name': record[1], 'price': record[2]}
+                    for record in sample_records])
+   return len(sample_records)
 
-# Function to create/seed the products in the database
-def seed_products():
-   if Product.query.count() != 0:
-      return
-
-      # Variable to hold the records to be inserted/added to the product table
-      sample_records = [
-         ('01H73QEWMF1KG6QADD', 'Ground beef parties - 25% Fat', 980.0),
-         ('01H73QEWMFMWNQPSM', 'Coffee - Hazelnut Cream', 815.0),
-         ('01H73QEWMGFSMTWR3X', 'Coffee - Flavoured', 905.0),
-         ('01H73QEWMGHCW3PXFR', 'Tequila Rose Cream Liquor', 675.0),
-         ('01H73QEWMG9MD4CTB9', 'Split Peas - Yellow, Dry', 820.0),
-         ('01H73QEWMGTRXVQYY', 'Wine - Vineland Estate Semi - Dry', 855.0),
-         ('01H73QEWMH3GCAA4P', 'Mushroom - Chanterelle, Dry', 585.0),
-         ('01H73QEWMHM6WXBGM', 'Butter - KCC Salted', 760.0),
-         ('01H73QEWMHPX9KZ2YV', 'Olives - Black, Pitted', 450.0),
-         ('01H73QEWMHQ7T5R6WX', 'Pasta - Fettuccine, Egg', 320.0),
-         ('01H73QEWMHR4F8S9D2', 'Cheese - Cheddar, Medium', 690.0),
-         ('01H73QEWMHS1G3H5J7', 'Chicken - Whole Roasting', 1250.0),
-         ('01H73QEWMHT9K8L2P4', 'Tomatoes - Cherry, Yellow', 380.0),
-         ('01H73QEWMHV7M6N1Q3', 'Bread - Italian Roll With Herbs', 420.0),
-         ('01H73QEWMHW5T9R7Y2', 'Salmon - Fillets', 1980.0),
-         ('01H73QEWMHX3V8B6N5', 'Chocolate - Dark, 70% Cocoa', 550.0)
-      ]
-
-      # Insert the above sample data into the Product table using a for loop
-      for record in sample_records:
-         product = Product(id=record[0], name=record[1], price=record[2])
-         db.session.add(product)
-
-      # Commit the changes to the database after inserting the sample data
-      db.session.commit()
+# Function to create/seed the public tasks (shown to guests) when there are none
+def seed_tasks():
+   if db.session.scalar(select(Task.id).where(Task.user_id.is_(None)).limit(1)) is not None:
+      return 0
+   db.session.execute(insert(Task), [{'title': task['title'], 'done': task['done']} for task in tasks])
+   return len(tasks)
 
 # function to create/seed the app's initial users in the database
 def seed_initial_users(now = None):
@@ -151,83 +155,92 @@ def seed_initial_users(now = None):
       ],
    }
 
-   print(" Seeding users ")
-
-   for role_name, users in seed_data.items():
-      role = Role.query.filter_by(name=role_name).first()
-      if not role:
-         print(f"⚠ Role {role_name} does not exist - Skipping users")
+   users = [dict(data, role=role_name) for role_name, users in seed_data.items() for data in users]
+   emails = [data["email"] for data in users]
+   phones = [data["phone"] for data in users]
+
+   # ---------------------------------------------------
+   # Create the users that don't exist yet (by email or phone)
+   # ---------------------------------------------------
+   taken = db.session.execute(
+      select(User.email, User.phone).where(or_(User.email.in_(emails), User.phone.in_(phones)))
+   ).all()
+   taken_emails = {email for email, _ in taken}
+   taken_phones = {phone for _, phone in taken}
+   new_users = [
+      data for data in users if data["email"] not in taken_emails and data["phone"] not in taken_phones
+   ]
+   if new_users:
+      # Hash the default password once and share it between all the new users (the same password would
+      # otherwise be hashed with bcrypt once per user)
+      password_hash = hash_password(DEFAULT_PASSWORD)
+      db.session.execute(insert(User), [
+         {
+            "email": data["email"],
+            "full_name": data["full_name"],
+            "birth_date": data["birth_date"],
+            "gender": data["gender"],
+            "phone": data["phone"],
+            "is_active": True,
+            "created_at": now,
+            "updated_at": now,
+            "last_login": now,
+            "multi_factor_enabled": False,
+            "password_hash": password_hash,
+            "password_updated_at": now,
+         }
+         for data in new_users
+      ])
+
+   # ---------------------------------------------------
+   # Assign the roles that are missing
+   # ---------------------------------------------------
+   user_ids = dict(db.session.execute(select(User.email, User.id).where(User.email.in_(emails))).all())
+   role_ids = dict(db.session.execute(select(Role.name, Role.id).where(Role.name.in_(seed_data))).all())
+   assigned = set(db.session.execute(
+      select(UserRole.user_id, UserRole.role_id)
+      .where(UserRole.user_id.in_(user_ids.values()), UserRole.is_active.is_(True))
+   ).all())
+
+   new_user_roles = []
+   for data in users:
+      user_id, role_id = user_ids.get(data["email"]), role_ids.get(data["role"])
+      if role_id is None:
+         print(f"⚠ Role {data['role']} does not exist - Skipping {data['email']}")
          continue
+      if user_id is None or (user_id, role_id) in assigned:
+         continue
+      new_user_roles.append({"user_id": user_id, "role_id": role_id, "assigned_at": now,
+                             "assigned_by": None, "is_active": True})
+   if new_user_roles:
+      db.session.execute(insert(UserRole), new_user_roles)
+   return len(new_users), len(new_user_roles)
 
-      for data in users:
-         user = User.query.filter_by(email=data["email"]).first()
-
-         # ---------------------------------------------------
-         # Create the user if the user doesn't exist
-         # ---------------------------------------------------
-         if not user:
-            user = User(
-               email=data["email"],
-               full_name=data["full_name"],
-               birth_date=data["birth_date"],
-               gender=data["gender"],
-               phone=data["phone"],
-               is_active=True,
-               created_at=now,
-               updated_at=now,
-               last_login=now,
-               multi_factor_enabled=False,
-            )
-            user.password_hash = bcrypt.hashpw(
-               DEFAULT_PASSWORD.encode("utf-8"),
-               bcrypt.gensalt()
-            ).decode("utf-8")
-            user.password_updated_at = now
-
-            # Add to the database (users table) and commit
-            db.session.add(user)
-            db.session.flush() # Get the user's id
-            print(f"✅ Created user: {user.full_name}")
-         else:
-            # print(f"🔁 User: {user.full_name}, already exists")
-            pass # User already exists, no message needed
-
-         # ---------------------------------------------------
-         # Assign role if missing
-         # ---------------------------------------------------
-         role_exists = UserRole.query.filter_by(
-            user_id=user.id,
-            role_id=role.id,
-            is_active=True
-         ).first()
-
-         if not role_exists:
-            db.session.add(
-               UserRole(
-                  user_id=user.id,
-                  role_id=role.id,
-                  assigned_at=now,
-                  assigned_by = None,
-                  is_active=True,
-               )
-            )
-            print(f" ➕ Assigned Role: {role_name}")
-         else:
-            # print(f" ✔ Role already assigned: {role_name}")
-            pass # Role already assigned, no message needed
-
-      db.session.commit()
-      print("🎉 User seeding complete!")
-
-# Function to add data to all the tables
+# Function to add data to all the tables in a single transaction
 def seed_all(app):
    with app.app_context():
       EAT = pytz.timezone("Africa/Nairobi")
       now = datetime.now(EAT)
 
       # call above functions
-      seed_initial_roles(now = now)
-      seed_products()
-      seed_initial_users(now=now)
-
-
+      roles = seed_initial_roles(now = now)
+      products = seed_products()
+      tasks_added = seed_tasks()
+      users, user_roles = seed_initial_users(now=now)
+      db.session.commit()
+      return {"roles": roles, "products": products, "tasks": tasks_added, "users": users,
+              "user_roles": user_roles}
+
+
+# Flask CLI command to create the tables and seed them, e.g. 'flask --app index seed'.
+# Safe to run repeatedly: only the missing rows are added
+@click.command('seed')
+@with_appcontext
+def seed_command():
+   started = time.perf_counter()
+   create_tables()
+   create_search_index()
+   counts = seed_all(current_app)
+   print(f"🎉 Seeding complete in {time.perf_counter() - started:.2f}s: {counts['roles']} roles, "
+         f"{counts['products']} products, {counts['tasks']} tasks, {counts['users']} users and "
+         f"{counts['user_roles']} role assignments added")
@@ -0,0 +1,247 @@
+# Python file to generate large synthetic datasets (millions of products, hundreds of thousands of users) for
+# scale and load testing, e.g. 'flask --app index seed-synthetic --products 1000000 --users 200000'.
+# The data comes from fixed random seeds, so the same options on an empty database always give the same rows.
+# Rows are written with batched Core inserts, and the users share a small pool of password hashes so that
+# bcrypt (a fraction of a second per hash) doesn't dominate the run
+
+# Import the required modules
+from bisect import bisect
+from datetime import date, datetime, timezone
+import itertools
+import math
+import random
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, insert, select
+
+from models import db, User, Role, UserRole, Product, create_tables
+from ids import encode
+from passwords import hash_password
+from search import create_search_index, search_index_deferred
+from catalogue import invalidate_catalogue
+from seed_products_users_roles import seed_initial_roles
+
+# Default random seed (the same seed generates the same data)
+DEFAULT_SEED = 2505
+# Rows written per insert statement/transaction
+DEFAULT_BATCH_SIZE = 10000
+# Default share of the new users given each role
+DEFAULT_ROLE_MIX = {'Customer': 90, 'Staff': 7, 'Manager': 2, 'Admin': 1}
+
+# Words the product names are made of
+PRODUCT_BRANDS = ['KCC', 'Brookside', 'Dormans', 'Kericho Gold', 'Ketepa', 'Jogoo', 'Pembe', 'Mumias', 'Kabras',
+                  'Fresh Fri', 'Elianto', 'Tuskys', 'Daima', 'Highlands', 'Del Monte', 'Kenylon']
+PRODUCT_ITEMS = ['Coffee', 'Tea', 'Milk', 'Butter', 'Cheese', 'Yoghurt', 'Bread', 'Flour', 'Maize Meal', 'Rice',
+                 'Sugar', 'Salt', 'Cooking Oil', 'Beans', 'Lentils', 'Pasta', 'Juice', 'Honey', 'Chocolate',
+                 'Biscuits', 'Soap', 'Detergent', 'Tomatoes', 'Onions', 'Chicken', 'Beef', 'Fish', 'Eggs']
+PRODUCT_VARIANTS = ['Original', 'Low Fat', 'Organic', 'Family Pack', 'Dry', 'Salted', 'Unsalted', 'Flavoured',
+                    'Premium', 'Value Pack', 'Whole', 'Sliced', 'Fresh', 'Frozen', 'Spiced', 'Plain']
+PRODUCT_SIZES = ['100g', '250g', '500g', '1kg', '2kg', '5kg', '250ml', '500ml', '1l', '2l', '6 pack', '12 pack']
+
+# Names the users are made of
+FIRST_NAMES = {
+   'female': ['Abigail', 'Mary', 'Zainab', 'Emily', 'Felicia', 'Grace', 'Wanjiru', 'Achieng', 'Amina', 'Faith',
+              'Mercy', 'Njeri', 'Akinyi', 'Halima', 'Esther', 'Joy'],
+   'male': ['James', 'John', 'David', 'Kevin', 'Rahim', 'Brian', 'Otieno', 'Kamau', 'Hassan', 'Peter', 'Samuel',
+            'Kipchoge', 'Mutua', 'Juma', 'Daniel', 'Collins'],
+}
+LAST_NAMES = ['Maina', 'Kimani', 'Mwendwa', 'Mwangi', 'Wanjiku', 'Kiprono', 'Hassan', 'Omondi', 'Ndinda', 'Juma',
+              'Odhiambo', 'Mutua', 'Njoroge', 'Chebet', 'Wambui', 'Kariuki', 'Ochieng', 'Mohamed', 'Kiptoo']
+
+# First millisecond of the generated product ids (2024-01-01), one millisecond apart
+PRODUCT_EPOCH_MS = 1704067200000
+
+
+# Function to read a role mix such as 'Customer=90,Staff=7,Manager=2,Admin=1' (shares don't need to add to 100)
+def parse_role_mix(text):
+   mix = {}
+   for part in text.split(','):
+      name, _, share = part.partition('=')
+      if not name.strip() or not share:
+         raise ValueError(f"Invalid role share: {part!r} (expected Role=share)")
+      mix[name.strip()] = float(share)
+   if not mix or sum(mix.values()) <= 0:
+      raise ValueError("The role mix needs at least one role with a positive share")
+   return mix
+
+
+# Function to create a function that picks words either uniformly or following Zipf's law (a few words are
+# very common, as in real catalogues)
+def word_picker(rng, words, distribution):
+   if distribution == 'uniform':
+      return lambda: words[int(rng.random() * len(words))]
+   if distribution != 'zipf':
+      raise ValueError(f"Unknown name distribution: {distribution}")
+   return weighted_picker(rng, words, [1 / rank for rank in range(1, len(words) + 1)])
+
+
+# Function to create a function that picks one of the values with the given (relative) weights. The same as
+# random.choices(), without its per call overhead (it is called several times for every generated row)
+def weighted_picker(rng, values, weights):
+   cum_weights = list(itertools.accumulate(weights))
+   total = cum_weights[-1]
+   return lambda: values[bisect(cum_weights, rng.random() * total)]
+
+
+# Function to create a function that draws prices from the given distribution, limited to [low, high]
+def price_picker(rng, distribution, low, high):
+   if distribution == 'uniform':
+      draw = lambda: rng.uniform(low, high)
+   elif distribution == 'normal':
+      draw = lambda: rng.gauss((low + high) / 2, (high - low) / 6)
+   elif distribution == 'lognormal':
+      # Most prices are low with a long tail of expensive products, the median is the geometric mean
+      mu = (math.log(low) + math.log(high)) / 2
+      draw = lambda: rng.lognormvariate(mu, (math.log(high) - math.log(low)) / 6)
+   else:
+      raise ValueError(f"Unknown price distribution: {distribution}")
+   return lambda: round(min(max(draw(), low), high), 2)
+
+
+# Generator of synthetic product rows. The ids are ULIDs made from a fixed epoch and the random seed, so they
+# are reproducible and still sort in insertion order
+def generate_products(count, seed=DEFAULT_SEED, start=0, name_distribution='zipf', price_distribution='lognormal',
+                      price_min=20.0, price_max=5000.0):
+   rng = random.Random(f"products-{seed}-{start}")
+   brand = word_picker(rng, PRODUCT_BRANDS, name_distribution)
+   item = word_picker(rng, PRODUCT_ITEMS, name_distribution)
+   variant = word_picker(rng, PRODUCT_VARIANTS, name_distribution)
+   size = word_picker(rng, PRODUCT_SIZES, 'uniform')
+   price = price_picker(rng, price_distribution, price_min, price_max)
+   for number in range(start, start + count):
+      yield {'id': encode(PRODUCT_EPOCH_MS + number, rng.getrandbits(80)),
+             'name': f"{item()} - {brand()} {variant()}, {size()}",
+             'price': price()}
+
+
+# Generator of synthetic users as (user row, role name) pairs. The number of each user makes its email and
+# phone number unique; the password hashes are taken in turn from the given list
+def generate_users(count, password_hashes, seed=DEFAULT_SEED, start=1, role_mix=None, now=None):
+   rng = random.Random(f"users-{seed}-{start}")
+   mix = role_mix or DEFAULT_ROLE_MIX
+   role = weighted_picker(rng, list(mix), list(mix.values()))
+   first_day, last_day = date(1950, 1, 1).toordinal(), date(2006, 12, 31).toordinal()
+   now = now or datetime.now(timezone.utc)
+   for number in range(start, start + count):
+      gender = 'female' if rng.random() < 0.5 else 'male'
+      first, last = rng.choice(FIRST_NAMES[gender]), rng.choice(LAST_NAMES)
+      user = {
+         'email': f"{first.lower()}.{last.lower()}.{number}@synthetic.ds2505.test",
+         'full_name': f"{first} {last}",
+         'birth_date': date.fromordinal(rng.randint(first_day, last_day)),
+         'gender': gender,
+         # Synthetic numbers start with 01 (the seeded users' numbers start with 07)
+         'phone': f"01{number:08d}",
+         'is_active': True,
+         'created_at': now,
+         'updated_at': now,
+         'last_login': None,
+         'multi_factor_enabled': False,
+         'password_hash': password_hashes[number % len(password_hashes)],
+         'password_updated_at': now,
+      }
+      yield user, role()
+
+
+# Function to hash the passwords shared by the synthetic users ('Synthetic1!', 'Synthetic2!', ...). Only a few
+# distinct hashes are needed for realistic login tests, so this is a handful of bcrypt calls for any user count
+def synthetic_password_hashes(count=1):
+   return [hash_password(f"Synthetic{number}!") for number in range(1, count + 1)]
+
+
+# Function to insert synthetic products in batches (one transaction per batch). Returns the number added
+def seed_synthetic_products(count, seed=DEFAULT_SEED, batch_size=DEFAULT_BATCH_SIZE, **distributions):
+   start = db.session.scalar(select(func.count()).select_from(Product))
+   rows = generate_products(count, seed=seed, start=start, **distributions)
+   added = 0
+   with search_index_deferred():
+      while batch := list(itertools.islice(rows, batch_size)):
+         db.session.execute(insert(Product.__table__), batch)
+         db.session.commit()
+         added += len(batch)
+   if added:
+      invalidate_catalogue()
+   return added
+
+
+# Function to get the ids of the roles in a role mix (adding the standard roles if they are missing). Raises
+# ValueError for roles that don't exist
+def role_mix_ids(role_mix=None):
+   seed_initial_roles(now=datetime.now(timezone.utc))
+   db.session.commit()
+   role_ids = dict(db.session.execute(select(Role.name, Role.id)).all())
+   unknown = set(role_mix or DEFAULT_ROLE_MIX) - set(role_ids)
+   if unknown:
+      raise ValueError(f"Unknown roles: {', '.join(sorted(unknown))}")
+   return role_ids
+
+
+# Function to insert synthetic users and their roles in batches. Returns (users added, roles assigned)
+def seed_synthetic_users(count, seed=DEFAULT_SEED, batch_size=DEFAULT_BATCH_SIZE, role_mix=None, passwords=1):
+   role_ids = role_mix_ids(role_mix)
+
+   now = datetime.now(timezone.utc)
+   start = (db.session.scalar(select(func.max(User.id))) or 0) + 1
+   rows = generate_users(count, synthetic_password_hashes(passwords), seed=seed, start=start, role_mix=role_mix,
+                         now=now)
+   # Each batch of users is read back by email to get their ids, so it must fit in one IN (...) list
+   batch_size = min(batch_size, 5000)
+   users_added = roles_added = 0
+   while batch := list(itertools.islice(rows, batch_size)):
+      db.session.execute(insert(User.__table__), [user for user, _ in batch])
+      user_ids = dict(db.session.execute(
+         select(User.email, User.id).where(User.email.in_([user['email'] for user, _ in batch]))).all())
+      db.session.execute(insert(UserRole.__table__), [
+         {'user_id': user_ids[user['email']], 'role_id': role_ids[role], 'assigned_at': now, 'assigned_by': None,
+          'is_active': True}
+         for user, role in batch
+      ])
+      db.session.commit()
+      users_added += len(batch)
+      roles_added += len(batch)
+   return users_added, roles_added
+
+
+# Flask CLI command to add a synthetic dataset to the database, e.g.
+# 'flask --app index seed-synthetic --products 1000000 --users 200000 --role-mix Customer=95,Staff=5'
+@click.command('seed-synthetic')
+@click.option('--products', default=0, show_default=True, help='Number of products to add.')
+@click.option('--users', default=0, show_default=True, help='Number of users (with a role each) to add.')
+@click.option('--seed', default=DEFAULT_SEED, show_default=True, help='Random seed.')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help='Rows per transaction.')
+@click.option('--name-distribution', type=click.Choice(['zipf', 'uniform']), default='zipf', show_default=True,
+              help='How often each word appears in the product names.')
+@click.option('--price-distribution', type=click.Choice(['lognormal', 'uniform', 'normal']), default='lognormal',
+              show_default=True, help='Distribution of the product prices.')
+@click.option('--price-min', default=20.0, show_default=True, help='Lowest product price.')
+@click.option('--price-max', default=5000.0, show_default=True, help='Highest product price.')
+@click.option('--role-mix', default='Customer=90,Staff=7,Manager=2,Admin=1', show_default=True,
+              help='Share of the users given each role.')
+@click.option('--passwords', default=1, show_default=True,
+              help="Distinct passwords shared by the users ('Synthetic1!', 'Synthetic2!', ...).")
+@with_appcontext
+def seed_synthetic_command(products, users, seed, batch_size, name_distribution, price_distribution, price_min,
+                           price_max, role_mix, passwords):
+   create_tables()
+   create_search_index()
+   try:
+      role_mix = parse_role_mix(role_mix)
+      role_mix_ids(role_mix)
+   except ValueError as e:
+      raise click.BadParameter(str(e), param_hint='--role-mix')
+
+   started = time.perf_counter()
+   added = seed_synthetic_products(products, seed=seed, batch_size=batch_size, name_distribution=name_distribution,
+                                   price_distribution=price_distribution, price_min=price_min,
+                                   price_max=price_max)
+   elapsed = time.perf_counter() - started
+   click.echo(f"Added {added:,} products in {elapsed:.1f}s ({added / elapsed if elapsed else 0:,.0f} rows/s)")
+
+   started = time.perf_counter()
+   users_added, roles_added = seed_synthetic_users(users, seed=seed, batch_size=batch_size, role_mix=role_mix,
+                                                   passwords=passwords)
+   elapsed = time.perf_counter() - started
+   click.echo(f"Added {users_added:,} users and {roles_added:,} role assignments in {elapsed:.1f}s "
+              f"({users_added / elapsed if elapsed else 0:,.0f} users/s)")
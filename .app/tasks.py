@@ -1,4 +1,18 @@
-# Python file with a list of task to do in a given day in JSON format
+# Python file with the to-do tasks API: the default (public) tasks and the queries behind /get_tasks
+
+# Import the required modules
+from datetime import datetime, timedelta, timezone
+import re
+
+from flask import has_app_context
+from sqlalchemy import event, or_, tuple_
+from sqlalchemy.orm import Session, object_session
+
+from models import Task
+from catalogue import clamp_page_size, encode_key, decode_key
+from versions import bump_version
+
+# List of tasks to do in a given day, seeded as the public tasks shown to guests
 tasks = [
    {'id': 1, 'title': 'Wake-up', 'done': True},
    {'id': 2, 'title': 'Pray', 'done': True},
@@ -14,3 +28,173 @@ tasks = [
    {'id': 12, 'title': "Submitting Last week's report", 'done': False},
    {'id': 13, 'title': "Go to bed", 'done': False},
 ]
+
+# Default number of tasks returned per request
+DEFAULT_TASK_PAGE_SIZE = 50
+# Seconds taken off the server_time given to the clients. A task's updated_at is set when the change is flushed,
+# not when it is committed, so a change committed just after a client's read can carry an earlier time than the
+# read. The client's next since= reaches back far enough to get it (recent changes may be sent twice)
+DEFAULT_SYNC_MARGIN = 30
+
+
+# Function to convert a task into a dictionary for the JSON responses
+def task_to_dict(task, include_sync_fields=False):
+   data = {'id': task.id, 'title': task.title, 'done': task.done}
+   if include_sync_fields:
+      data['updated_at'] = format_timestamp(task.updated_at)
+      data['deleted'] = task.deleted_at is not None
+   return data
+
+
+# Function to write a (UTC) timestamp as ISO 8601 text, ending with Z rather than +00:00 (a '+' put in a query
+# string without being URL-encoded reaches the server as a space)
+def format_timestamp(value):
+   return value.replace(tzinfo=None).isoformat() + 'Z' if value is not None else None
+
+
+# Function to read an ISO 8601 timestamp sent by a client. Times without a timezone are taken as UTC, and a space
+# before the offset is read as the '+' it was before the query string was decoded. The database stores UTC times
+# without a timezone, so the result is naive as well
+def parse_timestamp(value):
+   if not isinstance(value, str):
+      raise ValueError(f"Invalid timestamp: {value!r}")
+   value = re.sub(r'(T.*) (\d{2}(:?\d{2})?)$', r'\1+\2', value.strip())
+   parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+   if parsed.tzinfo is not None:
+      parsed = parsed.astimezone(timezone.utc)
+   return parsed.replace(tzinfo=None)
+
+
+# Function to get the time the clients pass back as since= to get the changes made after a response
+def sync_time(margin=DEFAULT_SYNC_MARGIN):
+   return datetime.now(timezone.utc) - timedelta(seconds=margin)
+
+
+# Function to read a cursor made by this API, whose values have the given types. Raises ValueError for a cursor
+# that wasn't (e.g. one that was edited or made for another page)
+def decode_task_cursor(cursor, types):
+   if not cursor:
+      return None
+   key = decode_key(cursor, len(types))
+   if key is None or not all(isinstance(value, kind) and not isinstance(value, bool)
+                             for value, kind in zip(key, types)):
+      raise ValueError("Invalid cursor")
+   return key
+
+
+# Function to read the done= filter ('true'/'false', '1'/'0', 'yes'/'no'). Returns None when not filtering
+def parse_done(value):
+   if value in (None, ''):
+      return None
+   value = value.lower()
+   if value in ('true', '1', 'yes'):
+      return True
+   if value in ('false', '0', 'no'):
+      return False
+   raise ValueError("done must be true or false")
+
+
+# Function to read the filters and paging options of a /get_tasks request. Raises ValueError for bad values
+def parse_task_args(args):
+   since = args.get('since')
+   return {
+      'done': parse_done(args.get('done')),
+      'since': parse_timestamp(since) if since else None,
+      'after': args.get('after'),
+      'per_page': args.get('per_page', DEFAULT_TASK_PAGE_SIZE),
+   }
+
+
+# Function to build the /get_tasks response from a page of tasks
+def tasks_payload(rows, next_cursor, since, server_time):
+   return {
+      'data': [task_to_dict(task, include_sync_fields=since is not None) for task in rows],
+      'next_cursor': next_cursor,
+      # Pass this back as since= to get the changes made after this response
+      'server_time': format_timestamp(server_time),
+   }
+
+
+# Function to filter tasks down to the ones a user sees: the public tasks, and their own ones when logged in
+# (user_id None for guests)
+def visible_tasks(user_id):
+   if user_id is None:
+      return Task.user_id.is_(None)
+   return or_(Task.user_id.is_(None), Task.user_id == user_id)
+
+
+# Function to get a page of the tasks the user sees (see visible_tasks()), ordered by id
+def get_tasks_page(user_id, done=None, after=None, per_page=DEFAULT_TASK_PAGE_SIZE):
+   query, finish = plan_tasks_page(user_id, Task.query, done=done, after=after, per_page=per_page)
+   return finish(query.all())
+
+
+# Function to get the tasks the user sees changed after the given time (including deleted ones), oldest
+# change first. Paged with an (updated_at, id) cursor so that changes made in the same instant aren't lost
+def get_task_changes(user_id, since, done=None, after=None, per_page=DEFAULT_TASK_PAGE_SIZE):
+   query, finish = plan_task_changes(user_id, since, Task.query, done=done, after=after, per_page=per_page)
+   return finish(query.all())
+
+
+# Function to prepare the query of a page of tasks. Returns the query (a Query or a select(), so the async
+# views can run it with the async engine) and a function turning its rows into (tasks, next_cursor)
+def plan_tasks_page(user_id, query, done=None, after=None, per_page=DEFAULT_TASK_PAGE_SIZE):
+   per_page = clamp_page_size(per_page, default=DEFAULT_TASK_PAGE_SIZE)
+   query = query.filter(visible_tasks(user_id), Task.deleted_at.is_(None))
+   if done is not None:
+      query = query.filter(Task.done.is_(done))
+   key = decode_task_cursor(after, (int,))
+   if key is not None:
+      query = query.filter(Task.id > key[0])
+
+   def finish(rows):
+      rows = list(rows)
+      next_cursor = encode_key([rows[per_page - 1].id]) if len(rows) > per_page else None
+      return rows[:per_page], next_cursor
+
+   return query.order_by(Task.id).limit(per_page + 1), finish
+
+
+# Function to prepare the query of a page of task changes (see get_task_changes()), like plan_tasks_page()
+def plan_task_changes(user_id, since, query, done=None, after=None, per_page=DEFAULT_TASK_PAGE_SIZE):
+   per_page = clamp_page_size(per_page, default=DEFAULT_TASK_PAGE_SIZE)
+   query = query.filter(visible_tasks(user_id), Task.updated_at > since)
+   if done is not None:
+      query = query.filter(or_(Task.done.is_(done), Task.deleted_at.isnot(None)))
+   key = decode_task_cursor(after, (str, int))
+   if key is not None:
+      query = query.filter(tuple_(Task.updated_at, Task.id) > tuple_(parse_timestamp(key[0]), key[1]))
+
+   def finish(rows):
+      rows = list(rows)
+      next_cursor = None
+      if len(rows) > per_page:
+         last = rows[per_page - 1]
+         next_cursor = encode_key([format_timestamp(last.updated_at), last.id])
+      return rows[:per_page], next_cursor
+
+   return query.order_by(Task.updated_at, Task.id).limit(per_page + 1), finish
+
+
+# Record that tasks were changed in a flush, and bump the 'tasks' version (used for the ETags of
+# /get_tasks) once the change is committed
+@event.listens_for(Task, 'after_insert')
+@event.listens_for(Task, 'after_update')
+@event.listens_for(Task, 'after_delete')
+def record_task_change(mapper, connection, target):
+   session = object_session(target)
+   if session is not None:
+      session.info['tasks_changed'] = True
+
+
+# Bump the 'tasks' version after a commit that changed tasks
+@event.listens_for(Session, 'after_commit')
+def bump_tasks_version(session):
+   if session.info.pop('tasks_changed', False) and has_app_context():
+      bump_version('tasks')
+
+
+# Forget the changes when the transaction is rolled back
+@event.listens_for(Session, 'after_rollback')
+def discard_task_changes(session):
+   session.info.pop('tasks_changed', None)
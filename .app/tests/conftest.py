@@ -0,0 +1,56 @@
+# Python file with the fixtures shared by the tests: a new application for every test, with its own in-memory
+# database holding the seeded roles, users, products and tasks.
+# Usage (from the application folder): python -m pytest tests
+
+# Import the required modules
+import os
+import sys
+
+import pytest
+
+# Folder holding the application (the parent of this tests folder)
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+# Keep the application created when index is imported away from the development database
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from config import TestingConfig  # noqa: E402
+from index import create_app, create_tables, create_search_index, seed_all  # noqa: E402
+
+# Login of one of the seeded admins
+ADMIN_EMAIL = 'admin1@ds2505.ac.ke'
+ADMIN_PASSWORD = 'ChangeM3@123'
+
+
+# Configuration of the test applications: nothing runs in the background or is written outside the database
+class TestConfig(TestingConfig):
+   WRITE_BEHIND_ENABLED = False
+   TEMPLATE_BYTECODE_CACHE = False
+   COMPRESSION_ENABLED = False
+   METRICS_ENABLED = True
+
+
+# Fixture creating a seeded application
+@pytest.fixture
+def app():
+   app = create_app(TestConfig)
+   with app.app_context():
+      create_tables()
+      create_search_index()
+   seed_all(app)
+   with app.app_context():
+      yield app
+
+
+# Fixture creating a test client for the application
+@pytest.fixture
+def client(app):
+   return app.test_client()
+
+
+# Fixture logging the test client in as an admin
+@pytest.fixture
+def admin_client(client):
+   response = client.post('/login', data={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD})
+   assert response.status_code == 302
+   return client
@@ -0,0 +1,30 @@
+# Python file with the tests of the versioned JSON product API
+
+# Import the required modules
+from catalogue import filter_products
+from product_import import upsert_products
+from models import db
+
+
+def test_invalid_price_filters_are_rejected(client):
+   for value in ('abc', 'nan', 'inf', '-Infinity'):
+      response = client.get(f'/api/v1/products?min_price={value}')
+      assert response.status_code == 400
+      assert response.get_json() == {'error': 'min_price must be a number'}
+      assert client.get(f'/api/v1/products/export?max_price={value}').status_code == 400
+
+
+def test_price_filters_narrow_the_page(client):
+   data = client.get('/api/v1/products?min_price=1000&max_price=1500').get_json()['data']
+   assert [product['name'] for product in data] == ['Chicken - Whole Roasting']
+
+
+def test_name_filter_matches_wildcards_literally(app):
+   upsert_products([{'id': 'P1', 'name': '100% Juice', 'price': 10.0},
+                    {'id': 'P2', 'name': '100 Juice', 'price': 10.0},
+                    {'id': 'P3', 'name': 'Snack_Bar', 'price': 10.0},
+                    {'id': 'P4', 'name': 'SnackXBar', 'price': 10.0}])
+   db.session.commit()
+   assert [p.id for p in filter_products(q='100%').all()] == ['P1']
+   assert [p.id for p in filter_products(q='k_B').all()] == ['P3']
+   assert all('%' in p.name for p in filter_products(q='%').all())
@@ -0,0 +1,179 @@
+# Python file with the tests of the ASGI application: the lifespan messages, the async views (their queries run
+# on the async engine), the event stream and the Flask application in the thread pool. The requests are sent by a
+# small ASGI client on an event loop of their own, and the application is shut down after each test
+
+# Import the required modules
+import asyncio
+import threading
+
+import pytest
+from flask import request
+from sqlalchemy import event
+
+import asgi
+from asgi import AsgiApplication
+from conftest import TestConfig
+from index import create_app, create_tables, create_search_index, seed_all
+from models import db
+
+
+# Fixture creating an ASGI application on a seeded SQLite file (the async views need the async engine, which
+# isn't used for an in-memory database)
+@pytest.fixture
+def asgi_app(tmp_path):
+   class FileConfig(TestConfig):
+      SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'asgi.db'}"
+
+   app = create_app(FileConfig)
+   with app.app_context():
+      create_tables()
+      create_search_index()
+   seed_all(app)
+   return AsgiApplication(app)
+
+
+# Function to send the start-up and shut-down messages to an application. Returns the types of its answers
+async def lifespan(application):
+   messages = asyncio.Queue()
+   messages.put_nowait({'type': 'lifespan.startup'})
+   messages.put_nowait({'type': 'lifespan.shutdown'})
+   sent = []
+
+   async def send(message):
+      sent.append(message['type'])
+
+   await application({'type': 'lifespan'}, messages.get, send)
+   return sent
+
+
+# Function to send a request to an application. The messages it sends are added to sent, and the client stays
+# connected until disconnect is set
+async def call(application, path, sent, method='GET', query_string=b'', disconnect=None):
+   scope = {'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http', 'path': path,
+            'root_path': '', 'query_string': query_string, 'headers': [(b'host', b'localhost')],
+            'server': ('localhost', 80), 'client': ('127.0.0.1', 50000)}
+   received = iter([{'type': 'http.request', 'body': b'', 'more_body': False}])
+   disconnect = disconnect or asyncio.Event()
+
+   async def receive():
+      message = next(received, None)
+      if message is None:
+         await disconnect.wait()
+         message = {'type': 'http.disconnect'}
+      return message
+
+   async def send(message):
+      sent.append(message)
+
+   await application(scope, receive, send)
+
+
+# Function to get a request's status and body, serving it with the application and shutting the application down
+def get(application, path, query_string=b''):
+   sent = []
+
+   async def main():
+      try:
+         await call(application, path, sent, query_string=query_string)
+      finally:
+         await lifespan(application)
+
+   asyncio.run(main())
+   return sent[0]['status'], b''.join(message.get('body', b'') for message in sent[1:])
+
+
+# Function to wait (on the event loop) until a condition holds
+async def wait_until(condition, timeout=5):
+   loop = asyncio.get_running_loop()
+   deadline = loop.time() + timeout
+   while not condition():
+      assert loop.time() < deadline, 'timed out'
+      await asyncio.sleep(0.01)
+
+
+def test_lifespan_completes_and_stops_the_thread_pool(asgi_app):
+   assert asyncio.run(lifespan(asgi_app)) == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+   with pytest.raises(RuntimeError):
+      asgi_app.wsgi.executor.submit(print)
+
+
+def test_async_view_queries_the_async_engine(asgi_app, monkeypatch):
+   threads = []
+   statements = []
+   render = asgi.render_template
+
+   def render_template(*args, **kwargs):
+      threads.append(threading.current_thread())
+      return render(*args, **kwargs)
+
+   def record_statement(conn, cursor, statement, parameters, context, executemany):
+      statements.append(statement)
+
+   monkeypatch.setattr(asgi, 'render_template', render_template)
+   with asgi_app.app.app_context():
+      event.listen(db.engine, 'before_cursor_execute', record_statement)
+   assert asgi_app.app.view_functions['main.products'] is asgi.products
+   status, body = get(asgi_app, '/products')
+   assert status == 200 and b'Chicken - Whole Roasting' in body
+   # The page is read through the async engine, and rendered outside of the event loop
+   assert not any('FROM product' in statement for statement in statements)
+   assert len(threads) == 1 and threads[0] is not threading.main_thread()
+
+
+def test_async_tasks_view_reads_the_database(asgi_app):
+   status, body = get(asgi_app, '/get_tasks', b'per_page=5')
+   assert status == 200 and body.startswith(b'{')
+
+
+def test_async_tasks_view_refuses_bad_arguments(asgi_app):
+   status, body = get(asgi_app, '/get_tasks', b'done=maybe')
+   assert status == 400 and b'error' in body
+
+
+def test_other_pages_run_in_the_thread_pool(asgi_app):
+   threads = []
+
+   @asgi_app.app.before_request
+   def record_thread():
+      threads.append((request.path, threading.current_thread().name))
+
+   status, body = get(asgi_app, '/api/v1/products')
+   assert status == 200 and b'Salmon - Fillets' in body
+   assert len(threads) == 1 and threads[0][1].startswith('WSGI')
+
+
+def test_in_memory_database_keeps_the_normal_views(app, monkeypatch):
+   application = AsgiApplication(app)
+   assert application.engine is None
+   assert app.view_functions['main.products'] is not asgi.products
+   monkeypatch.setattr(asgi, 'render_template', lambda *args, **kwargs: pytest.fail('async view used'))
+   status, body = get(application, '/products')
+   assert status == 200 and b'Chicken - Whole Roasting' in body
+
+
+def test_event_stream_sends_published_events_until_the_client_disconnects(asgi_app):
+   bus = asgi_app.app.extensions['catalogue_events']
+   sent = []
+
+   def body():
+      return b''.join(message.get('body', b'') for message in sent[1:])
+
+   async def main():
+      disconnect = asyncio.Event()
+      stream = asyncio.get_running_loop().create_task(call(asgi_app, '/products/events', sent,
+                                                           disconnect=disconnect))
+      try:
+         await wait_until(lambda: b'retry:' in body())
+         await asyncio.to_thread(bus.publish, [('product_updated', {'id': 'P1'})])
+         await wait_until(lambda: b'event: product_updated' in body())
+         disconnect.set()
+         await asyncio.wait_for(stream, 5)
+      finally:
+         stream.cancel()
+         await lifespan(asgi_app)
+
+   asyncio.run(main())
+   assert sent[0]['status'] == 200
+   assert dict(sent[0]['headers'])[b'content-type'].startswith(b'text/event-stream')
+   assert all(message['more_body'] for message in sent[1:])
+   assert b'data: {"id":"P1"}' in body()
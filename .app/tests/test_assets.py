@@ -0,0 +1,49 @@
+# Python file with the tests of the static asset pipeline
+
+# Import the required modules
+import os
+
+from assets import AssetBuilder
+
+
+# Function to write a file of the static folder
+def write(folder, name, text):
+   path = folder / name
+   path.parent.mkdir(parents=True, exist_ok=True)
+   path.write_text(text)
+
+
+# Function to check whether a built file exists
+def built(folder, name):
+   return os.path.isfile(os.path.join(folder, 'build', *name.split('/')))
+
+
+def test_stylesheet_references_point_to_hashed_files(tmp_path):
+   write(tmp_path, 'css/main.css', 'body { background: url("../img/bg.png"); }')
+   write(tmp_path, 'img/bg.png', 'png')
+   manifest = AssetBuilder(str(tmp_path)).build_all()
+   css = (tmp_path / 'build' / manifest['css/main.css']).read_text()
+   assert os.path.basename(manifest['img/bg.png']) in css
+
+
+def test_files_of_the_previous_builds_are_kept(tmp_path):
+   manifests = []
+   for version in range(4):
+      write(tmp_path, 'js/app.js', f'console.log({version});' * 100)
+      manifests.append(AssetBuilder(str(tmp_path)).build_all(keep=3))
+   names = [manifest['js/app.js'] for manifest in manifests]
+   assert len(set(names)) == 4
+   assert not built(tmp_path, names[0]) and not built(tmp_path, names[0] + '.gz')
+   assert all(built(tmp_path, name) and built(tmp_path, name + '.gz') for name in names[1:])
+
+
+def test_built_assets_are_served_for_a_year(app, client, tmp_path):
+   write(tmp_path, 'css/site.css', 'p { color: red; }')
+   app.static_folder = str(tmp_path)
+   app.extensions['asset_manifest'] = AssetBuilder(str(tmp_path)).build_all()
+   with app.test_request_context():
+      url = app.jinja_env.globals['asset_url']('css/site.css')
+   response = client.get(url)
+   assert response.status_code == 200
+   assert 'immutable' in response.headers['Cache-Control']
+   assert client.get('/assets/builds.json').status_code == 404
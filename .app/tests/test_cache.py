@@ -0,0 +1,94 @@
+# Python file with the tests of the catalogue cache backends and of the cached catalogue reads
+
+# Import the required modules
+import io
+
+from sqlalchemy import select
+
+import cache
+from cache import MemoryCache, SQLiteCache
+from catalogue import get_cache, get_cached_product, get_cached_product_page, invalidate_catalogue, product_key
+from models import db, Product
+from product_import import import_products
+from versions import get_version
+
+
+def test_memory_cache_evicts_the_least_recently_used_entry():
+   memory = MemoryCache(max_entries=2)
+   memory.set('a', 1)
+   memory.set('b', 2)
+   memory.get('a')
+   memory.set('c', 3)
+   assert (memory.get('a'), memory.get('b'), memory.get('c')) == (1, None, 3)
+
+
+def test_sqlite_cache_reads_do_not_write(tmp_path):
+   shared = SQLiteCache(str(tmp_path / 'cache.db'))
+   shared.set('key', {'value': 1})
+   connection = shared._connect()
+   writes = connection.total_changes
+   for _ in range(10):
+      assert shared.get('key') == {'value': 1}
+   assert connection.total_changes == writes
+
+
+def test_sqlite_cache_evicts_the_least_recently_used_entry(tmp_path, monkeypatch):
+   monkeypatch.setattr(cache, 'ACCESS_RESOLUTION', 0)
+   shared = SQLiteCache(str(tmp_path / 'cache.db'), max_entries=2)
+   shared.set('a', 1)
+   shared.set('b', 2)
+   shared.get('a')
+   shared.set('c', 3)
+   assert (shared.get('a'), shared.get('b'), shared.get('c')) == (1, None, 3)
+
+
+def test_cached_product_is_refreshed_by_a_bulk_import(app):
+   assert get_cached_product('01H73QEWMHW5T9R7Y2')['price'] == 1980.0
+   import_products(io.StringIO('id,name,price\n01H73QEWMHW5T9R7Y2,Salmon - Fillets,2100\n'), 'csv')
+   assert get_cached_product('01H73QEWMHW5T9R7Y2')['price'] == 2100.0
+
+
+def test_product_change_only_evicts_that_product(app):
+   cache = get_cache()
+   salmon = '01H73QEWMHW5T9R7Y2'
+   chicken = db.session.scalar(select(Product.id).filter_by(name='Chicken - Whole Roasting'))
+   get_cached_product(salmon)
+   get_cached_product(chicken)
+   catalogue = get_version('catalogue')
+   invalidate_catalogue(salmon)
+   assert cache.get(product_key(salmon)) is None
+   assert cache.get(product_key(chicken)) is not None
+   assert get_version('catalogue') != catalogue
+
+
+def test_unlisted_change_keeps_the_pages(app):
+   get_cached_product_page()
+   catalogue = get_version('catalogue')
+   invalidate_catalogue('01H73QEWMHW5T9R7Y2', listed=False)
+   assert get_version('catalogue') == catalogue
+
+
+def test_unchanged_edit_keeps_the_catalogue_version(admin_client):
+   catalogue = get_version('catalogue')
+   response = admin_client.post('/edit_product/01H73QEWMHW5T9R7Y2', data={'name': 'Salmon - Fillets',
+                                                                          'price': '1980'})
+   assert response.status_code == 302 and get_version('catalogue') == catalogue
+   admin_client.post('/edit_product/01H73QEWMHW5T9R7Y2', data={'name': 'Salmon - Fillets', 'price': '1990'})
+   assert get_version('catalogue') != catalogue
+   assert get_cached_product('01H73QEWMHW5T9R7Y2')['price'] == 1990.0
+
+
+def test_full_cache_does_not_evict_the_versions(app):
+   catalogue = get_version('catalogue')
+   for i in range(app.config['CATALOGUE_CACHE_MAX_ENTRIES'] + 10):
+      get_cache().set(f'filler:{i}', i)
+   assert get_version('catalogue') == catalogue
+
+
+def test_sqlite_caches_sharing_a_file_are_apart(tmp_path):
+   path = str(tmp_path / 'cache.db')
+   entries, versions = SQLiteCache(path, max_entries=1), SQLiteCache(path, ttl=0, table='version')
+   versions.set('version:catalogue', {'id': 'v1'})
+   entries.set('a', 1)
+   entries.set('b', 2)
+   assert versions.get('version:catalogue') == {'id': 'v1'} and entries.get('version:catalogue') is None
@@ -0,0 +1,47 @@
+# Python file with the tests of the keyset (cursor) pagination of the product catalogue
+
+# Import the required modules
+from catalogue import get_product_page, encode_key
+from models import Product
+
+
+# Function to read every page of the catalogue by following the next cursors
+def walk_pages(sort, direction, per_page):
+   pages, after = [], None
+   while True:
+      page = get_product_page(sort=sort, direction=direction, after=after, per_page=per_page)
+      pages.append(page)
+      if page.next_cursor is None:
+         return pages
+      after = page.next_cursor
+
+
+def test_pages_cover_the_catalogue_once_in_order(app):
+   for sort, key in (('name', lambda p: (p.name, p.id)), ('price', lambda p: (p.price, p.id)),
+                     ('id', lambda p: p.id)):
+      for direction in ('asc', 'desc'):
+         rows = [product for page in walk_pages(sort, direction, 5) for product in page.items]
+         expected = sorted(Product.query.all(), key=key, reverse=direction == 'desc')
+         assert [p.id for p in rows] == [p.id for p in expected]
+
+
+def test_prev_cursor_returns_the_previous_page(app):
+   first = get_product_page(sort='price', per_page=5)
+   second = get_product_page(sort='price', after=first.next_cursor, per_page=5)
+   back = get_product_page(sort='price', before=second.prev_cursor, per_page=5)
+   assert [p.id for p in back.items] == [p.id for p in first.items]
+   assert back.next_cursor is not None
+
+
+def test_tampered_cursor_falls_back_to_the_first_page(app):
+   first = get_product_page(per_page=5)
+   for cursor in ('not-a-cursor', encode_key(['only one value']), encode_key({'a': 1})):
+      page = get_product_page(after=cursor, per_page=5)
+      assert [p.id for p in page.items] == [p.id for p in first.items]
+      assert page.prev_cursor is None
+
+
+def test_products_page_follows_the_cursor(client):
+   response = client.get('/products?sort=price&per_page=5')
+   assert response.status_code == 200
+   assert b'Salmon - Fillets' not in response.data  # the most expensive product is on the last page
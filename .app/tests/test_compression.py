@@ -0,0 +1,119 @@
+# Python file with the tests of the compression middleware: the encoding negotiation, the size threshold, the
+# streamed bodies, and the responses that are passed through (compressed already, or an event stream)
+
+# Import the required modules
+import gzip
+import zlib
+
+import pytest
+from werkzeug.test import Client
+
+import compression
+from compression import CompressionMiddleware
+from conftest import TestConfig
+from index import create_app, create_tables, create_search_index, seed_all
+
+# A body larger than the default threshold
+PAGE = b'<p>' + b'All the products of the catalogue. ' * 40 + b'</p>'
+
+
+# Function to create a WSGI application sending a fixed response (body is a list of chunks)
+def wsgi_app(body, content_type='text/html; charset=utf-8', length=True, **headers):
+   def application(environ, start_response):
+      response_headers = [('Content-Type', content_type), *headers.items()]
+      if length:
+         response_headers.append(('Content-Length', str(sum(len(chunk) for chunk in body))))
+      start_response('200 OK', [(name.replace('_', '-'), value) for name, value in response_headers])
+      return iter(body)
+   return application
+
+
+# Function to get a response of the middleware around an application
+def fetch(app, accept_encoding='gzip', method='GET', **options):
+   client = Client(CompressionMiddleware(app, **options))
+   return client.open('/', method=method, headers={'Accept-Encoding': accept_encoding})
+
+
+def test_pages_are_gzipped_when_the_browser_accepts_it():
+   response = fetch(wsgi_app([PAGE]), 'gzip, deflate')
+   assert response.headers['Content-Encoding'] == 'gzip'
+   assert response.headers['Vary'] == 'Accept-Encoding'
+   assert int(response.headers['Content-Length']) == len(response.data) < len(PAGE)
+   assert gzip.decompress(response.data) == PAGE
+
+
+def test_brotli_is_preferred_when_installed():
+   brotli = pytest.importorskip('brotli')
+   response = fetch(wsgi_app([PAGE]), 'gzip, br')
+   assert response.headers['Content-Encoding'] == 'br'
+   assert brotli.decompress(response.data) == PAGE
+
+
+def test_gzip_is_used_without_the_brotli_package(monkeypatch):
+   monkeypatch.setattr(compression, 'brotli', None)
+   assert fetch(wsgi_app([PAGE]), 'br, gzip').headers['Content-Encoding'] == 'gzip'
+   response = fetch(wsgi_app([PAGE]), 'br')
+   assert 'Content-Encoding' not in response.headers and response.data == PAGE
+
+
+def test_uncompressed_responses_still_vary_on_accept_encoding():
+   # Too small to be worth compressing, not accepted by the browser, or a HEAD request
+   for response in (fetch(wsgi_app([b'<p>Hi</p>'])), fetch(wsgi_app([PAGE]), 'identity'),
+                    fetch(wsgi_app([PAGE]), method='HEAD')):
+      assert 'Content-Encoding' not in response.headers
+      assert response.headers['Vary'] == 'Accept-Encoding'
+   response = fetch(wsgi_app([PAGE], Vary='Cookie'), 'identity')
+   assert response.headers['Vary'] == 'Cookie, Accept-Encoding'
+
+
+def test_size_threshold_is_configurable():
+   response = fetch(wsgi_app([PAGE]), min_size=len(PAGE) + 1)
+   assert 'Content-Encoding' not in response.headers and response.data == PAGE
+   response = fetch(wsgi_app([b'<p>Hi</p>']), min_size=0)
+   assert gzip.decompress(response.data) == b'<p>Hi</p>'
+
+
+def test_streamed_bodies_are_compressed_chunk_by_chunk(monkeypatch):
+   monkeypatch.setattr(compression, 'STREAM_FLUSH_SIZE', 100)
+   lines = [b'{"id": %d, "name": "Product %d"}\n' % (i, i) for i in range(200)]
+   app = CompressionMiddleware(wsgi_app(lines, 'application/x-ndjson', length=False))
+   response = Client(app).open('/', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+   assert response.headers['Content-Encoding'] == 'gzip' and 'Content-Length' not in response.headers
+   # The body is flushed as it goes, so every part can be decompressed before the end of the stream
+   chunks = list(response.response)
+   assert len(chunks) > 2
+   decompressor = zlib.decompressobj(31)
+   before_the_end = decompressor.decompress(b''.join(chunks[:-1]))
+   assert before_the_end and b''.join(lines).startswith(before_the_end)
+   decompressor.decompress(chunks[-1])
+   assert decompressor.eof
+   assert gzip.decompress(b''.join(chunks)) == b''.join(lines)
+
+
+def test_encoded_responses_are_passed_through():
+   encoded = gzip.compress(PAGE)
+   response = fetch(wsgi_app([encoded], 'text/css', Content_Encoding='gzip'))
+   assert response.headers['Content-Encoding'] == 'gzip' and response.data == encoded
+   response = fetch(wsgi_app([PAGE], Cache_Control='no-transform'))
+   assert 'Content-Encoding' not in response.headers and response.data == PAGE
+
+
+def test_event_streams_are_not_compressed():
+   response = fetch(wsgi_app([b'data: x\n\n' * 200], 'text/event-stream', length=False))
+   assert 'Content-Encoding' not in response.headers and 'Vary' not in response.headers
+   assert response.data == b'data: x\n\n' * 200
+
+
+def test_application_pages_are_compressed_with_a_weak_etag():
+   class CompressedConfig(TestConfig):
+      COMPRESSION_ENABLED = True
+
+   app = create_app(CompressedConfig)
+   with app.app_context():
+      create_tables()
+      create_search_index()
+   seed_all(app)
+   response = app.test_client().get('/products', headers={'Accept-Encoding': 'gzip'})
+   assert response.headers['Content-Encoding'] == 'gzip'
+   assert b'Chicken - Whole Roasting' in gzip.decompress(response.data)
+   assert response.headers['ETag'].startswith('W/')
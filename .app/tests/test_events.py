@@ -0,0 +1,121 @@
+# Python file with the tests of the catalogue change events: the diffs published for the product changes, the
+# event stores (memory and sqlite) and the stream a client resumes with Last-Event-ID
+
+# Import the required modules
+import pytest
+
+from catalogue import invalidate_catalogue
+from events import EventBus, MemoryEventStore, SQLiteEventStore, next_events
+from models import db, Product
+
+
+# Fixture creating each kind of event store, keeping 5 events
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+   if request.param == 'memory':
+      return MemoryEventStore(history=5)
+   return SQLiteEventStore(str(tmp_path / 'events.db'), history=5)
+
+
+# Function to get the events published on the application's bus after an id, as (type, data) pairs
+def published(app, after):
+   return [(event['type'], event['data']) for event in app.extensions['catalogue_events'].store.after(after)]
+
+
+# Function to read the first chunks of an event stream, then close it
+def read_stream(response, count):
+   chunks = iter(response.response)
+   try:
+      return ''.join(next(chunks).decode('utf-8') for _ in range(count))
+   finally:
+      response.close()
+
+
+def test_product_changes_are_published_as_diffs(app):
+   start = app.extensions['catalogue_events'].latest_id()
+   product = Product(id='P1', name='Tea', price=250)
+   db.session.add(product)
+   db.session.commit()
+   product.price = 300
+   db.session.commit()
+   product.name = 'Green tea'
+   db.session.commit()
+   db.session.delete(product)
+   db.session.commit()
+   assert published(app, start) == [
+      ('created', {'id': 'P1', 'name': 'Tea', 'price': 250}),
+      ('updated', {'id': 'P1', 'price': 300}),
+      ('updated', {'id': 'P1', 'name': 'Green tea'}),
+      ('deleted', {'id': 'P1'}),
+   ]
+
+
+def test_rolled_back_changes_are_not_published(app):
+   start = app.extensions['catalogue_events'].latest_id()
+   db.session.add(Product(id='P1', name='Tea', price=250))
+   db.session.flush()
+   db.session.rollback()
+   assert published(app, start) == []
+
+
+def test_bulk_changes_publish_a_reset(app):
+   start = app.extensions['catalogue_events'].latest_id()
+   invalidate_catalogue()
+   assert published(app, start) == [('reset', {})]
+
+
+def test_store_returns_the_events_after_an_id(store):
+   assert store.latest_id() == 0 and store.after(0) == []
+   last = store.append([('created', {'id': 'P1'}), ('updated', {'id': 'P1', 'price': 2}), ('deleted', {'id': 'P1'})])
+   assert last == store.latest_id() == 3
+   assert [(event['id'], event['type']) for event in store.after(1)] == [(2, 'updated'), (3, 'deleted')]
+   assert store.after(1, limit=1)[0]['data'] == {'id': 'P1', 'price': 2}
+   assert store.after(3) == []
+
+
+def test_store_refuses_ids_it_cannot_resume_from(store):
+   store.append([('updated', {'id': f'P{i}'}) for i in range(8)])
+   # Only the last 5 events are kept: a client that missed the ones dropped must reload
+   assert store.after(2) is None
+   assert [event['id'] for event in store.after(3)] == [4, 5, 6, 7, 8]
+   # An id the store never gave out (e.g. from before a restart of the memory store)
+   assert store.after(20) is None
+
+
+def test_stream_resumes_after_the_last_event_id(store):
+   bus = EventBus(store)
+   store.append([('created', {'id': 'P1'}), ('created', {'id': 'P2'}), ('deleted', {'id': 'P1'})])
+   text, last_id, more = next_events(bus, 1)
+   assert last_id == 3 and not more
+   assert text == ('id: 2\nevent: created\ndata: {"id":"P2"}\n\n'
+                   'id: 3\nevent: deleted\ndata: {"id":"P1"}\n\n')
+   assert next_events(bus, 3) == ('', 3, False)
+
+
+def test_stream_sends_a_reset_when_events_are_missing(store):
+   bus = EventBus(store)
+   store.append([('updated', {'id': f'P{i}'}) for i in range(8)])
+   assert next_events(bus, 1) == ('id: 8\nevent: reset\ndata: {}\n\n', 8, False)
+
+
+def test_sqlite_store_is_shared_by_the_processes(tmp_path):
+   path = str(tmp_path / 'events.db')
+   bus = EventBus(SQLiteEventStore(path), poll_interval=0)
+   # Another worker process publishing on its own store
+   SQLiteEventStore(path).append([('created', {'id': 'P1'})])
+   assert bus.wait(0, timeout=1)
+   assert next_events(bus, 0)[0] == 'id: 1\nevent: created\ndata: {"id":"P1"}\n\n'
+
+
+def test_event_stream_page_resumes_from_the_last_event_id(app, client):
+   start = app.extensions['catalogue_events'].latest_id()
+   db.session.add(Product(id='P1', name='Tea', price=250))
+   db.session.commit()
+   db.session.add(Product(id='P2', name='Coffee', price=300))
+   db.session.commit()
+   response = client.get('/products/events', headers={'Last-Event-ID': str(start + 1)}, buffered=False)
+   assert response.mimetype == 'text/event-stream'
+   text = read_stream(response, 2)
+   assert text.startswith('retry: ')
+   assert '"id":"P1"' not in text
+   assert f'id: {start + 2}\nevent: created\ndata: {{"id":"P2","name":"Coffee","price":300' in text
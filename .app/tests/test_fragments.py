@@ -0,0 +1,85 @@
+# Python file with the tests of the template fragment cache: the navigation bar kept once per role, and the
+# fragments depending on a version rendered again when it changes
+
+# Import the required modules
+from types import SimpleNamespace
+
+from catalogue import invalidate_catalogue
+from conftest import ADMIN_PASSWORD
+from fragments import auth_state, fragment_key
+
+# Logins of seeded users with other roles (every seeded user has the same password)
+MANAGER_EMAIL = 'manager.msa@ds2505.ac.ke'
+CUSTOMER_EMAIL = 'customer.emily@gmail.com'
+
+
+# Function to get the navigation bar of a page
+def nav(client, path='/products'):
+   html = client.get(path).get_data(as_text=True)
+   return html[html.index('<nav id="main-nav">'):html.index('</nav>')]
+
+
+# Function to log the client in as a user
+def login(client, email):
+   response = client.post('/login', data={'email': email, 'password': ADMIN_PASSWORD})
+   assert response.status_code == 302
+
+
+# Function to get the keys of the cached fragments
+def fragment_keys(app):
+   return {key for key in app.extensions['catalogue_cache']._entries if key.startswith('fragment:')}
+
+
+def test_fragments_are_keyed_by_role():
+   guest = SimpleNamespace(is_authenticated=False)
+   admin = SimpleNamespace(is_authenticated=True, role_names={'Manager', 'Admin'})
+   customer = SimpleNamespace(is_authenticated=True, role_names={'Customer'})
+   assert [auth_state(user) for user in (None, guest, admin, customer)] == ['guest', 'guest', 'Admin,Manager',
+                                                                           'Customer']
+   keys = {fragment_key('base.html', ['nav'], [], user) for user in (guest, admin, customer)}
+   assert len(keys) == 3
+
+
+def test_nav_links_of_one_role_never_reach_another(app, client):
+   guest_nav = nav(client)
+   login(client, 'admin1@ds2505.ac.ke')
+   admin_nav = nav(client)
+   client.get('/logout')
+   login(client, CUSTOMER_EMAIL)
+   customer_nav = nav(client)
+   client.get('/logout')
+   login(client, MANAGER_EMAIL)
+   manager_nav = nav(client)
+   client.get('/logout')
+   assert 'Login' in guest_nav and 'Logout' not in guest_nav
+   assert 'Add User' in admin_nav and 'Add Product' in admin_nav
+   assert 'Logout' in customer_nav and 'Add Product' not in customer_nav and 'Add User' not in customer_nav
+   assert 'Add Product' in manager_nav and 'Add User' not in manager_nav
+   # The guest's copy was cached first, and isn't the one served again after the others
+   assert nav(client) == guest_nav
+
+
+def test_nav_is_rendered_once_per_role(app, client):
+   nav(client, '/tasks')
+   cached = fragment_keys(app)
+   nav(client, '/tasks?page=2')
+   assert fragment_keys(app) == cached
+   login(client, CUSTOMER_EMAIL)
+   nav(client, '/tasks')
+   assert len(fragment_keys(app)) == len(cached) + 1
+
+
+def test_fragment_is_rendered_again_when_its_version_changes(app, client):
+   client.get('/products')
+   keys = fragment_keys(app)
+   client.get('/products')
+   assert fragment_keys(app) == keys
+   invalidate_catalogue()
+   client.get('/products')
+   assert not fragment_keys(app) <= keys
+
+
+def test_fragment_cache_can_be_turned_off(app, client):
+   app.config['TEMPLATE_FRAGMENT_CACHE'] = False
+   client.get('/products')
+   assert fragment_keys(app) == set()
@@ -0,0 +1,92 @@
+# Python file with the tests of the ULID generator of the product ids
+
+# Import the required modules
+import os
+import signal
+
+import pytest
+
+import ids
+from ids import ALPHABET, MAX_RANDOM, ULIDGenerator, encode, generate_product_id
+
+# A fixed time for the tests (2023-08-08 12:00:00 UTC, in nanoseconds)
+FROZEN_NS = 1_691_496_000_000_000_000
+
+
+# Function to read the time and random parts back from a ULID
+def decode(ulid):
+   value = 0
+   for char in ulid:
+      value = (value << 5) | ALPHABET.index(char)
+   return value >> 80, value & MAX_RANDOM
+
+
+# Fixture stopping the clock of the generator
+@pytest.fixture
+def frozen_clock(monkeypatch):
+   monkeypatch.setattr(ids.time, 'time_ns', lambda: FROZEN_NS)
+
+
+def test_ids_are_26_crockford_characters():
+   assert encode(0, 0) == '0' * 26
+   assert encode((1 << 48) - 1, MAX_RANDOM) == '7' + 'Z' * 25
+   assert encode(1, 31) == '0000000001' + '0' * 15 + 'Z'
+   ulid = generate_product_id()
+   assert len(ulid) == 26 and set(ulid) <= set(ALPHABET)
+   assert not set(ulid) & set('ILOU')
+   assert decode(encode(1_691_496_000_000, 12345)) == (1_691_496_000_000, 12345)
+
+
+def test_ids_increase_within_the_same_millisecond(frozen_clock):
+   generator = ULIDGenerator()
+   generated = [generator.new() for _ in range(1000)]
+   assert generated == sorted(generated) and len(set(generated)) == 1000
+   times_and_randoms = [decode(ulid) for ulid in generated]
+   assert {timestamp for timestamp, _ in times_and_randoms} == {FROZEN_NS // 1_000_000}
+   assert [random for _, random in times_and_randoms] == list(range(times_and_randoms[0][1],
+                                                                    times_and_randoms[0][1] + 1000))
+
+
+def test_overflow_of_the_random_part_moves_to_the_next_millisecond(frozen_clock):
+   generator = ULIDGenerator()
+   first = generator.new()
+   generator._last_random = MAX_RANDOM
+   second = generator.new()
+   assert second > first
+   assert decode(second)[0] == FROZEN_NS // 1_000_000 + 1
+
+
+def test_ids_keep_increasing_when_the_clock_goes_back(monkeypatch):
+   clock = iter([FROZEN_NS, FROZEN_NS - 5_000_000])
+   monkeypatch.setattr(ids.time, 'time_ns', lambda: next(clock))
+   generator = ULIDGenerator()
+   first = generator.new()
+   assert generator.new() > first
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_child_process_starts_afresh_after_a_fork(frozen_clock):
+   parent_id = generate_product_id()
+   read_end, write_end = os.pipe()
+   # The lock is held during the fork: the child must not inherit it locked
+   with ids._generator._lock:
+      pid = os.fork()
+   if pid == 0:
+      try:
+         os.close(read_end)
+         signal.alarm(5)  # a child stuck on the lock is killed instead of hanging the tests
+         os.write(write_end, generate_product_id().encode('ascii'))
+      finally:
+         os._exit(0)
+   os.close(write_end)
+   try:
+      with os.fdopen(read_end, 'rb') as pipe:
+         child_id = pipe.read().decode('ascii')
+   finally:
+      os.waitpid(pid, 0)
+   # The child drew a new random part instead of continuing from the parent's
+   assert len(child_id) == 26
+   timestamp, random = decode(parent_id)
+   assert decode(child_id)[1] != random + 1
+   # while the parent carries on from its own
+   assert generate_product_id() == encode(timestamp, random + 1)
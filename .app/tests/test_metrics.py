@@ -0,0 +1,61 @@
+# Python file with the tests of the metrics registry and of the /metrics page
+
+# Import the required modules
+import threading
+
+from conftest import TestConfig
+from index import create_app
+from metrics import MetricsRegistry
+
+
+# Function to record a value from a new thread, waiting for the thread to end
+def inc_from_thread(registry, name):
+   thread = threading.Thread(target=registry.inc, args=(name, ()))
+   thread.start()
+   thread.join()
+
+
+def test_values_of_ended_threads_are_folded_in_without_a_scrape():
+   registry = MetricsRegistry()
+   registry.counter('jobs_total', 'Jobs.')
+   for _ in range(50):
+      inc_from_thread(registry, 'jobs_total')
+   # Only the thread that recorded last is still kept apart
+   assert len(registry._shards) == 1
+   registry.inc('jobs_total', (), 2)
+   assert registry.collect() == {('jobs_total', ()): [52]}
+
+
+def test_histograms_are_written_in_the_prometheus_format():
+   registry = MetricsRegistry()
+   registry.histogram('wait_seconds', 'Waits.', (0.1, 1.0))
+   for value in (0.05, 0.5, 5):
+      registry.observe('wait_seconds', (('queue', 'a"b'),), value)
+   text = registry.render()
+   assert 'wait_seconds_bucket{queue="a\\"b",le="0.1"} 1' in text
+   assert 'wait_seconds_bucket{queue="a\\"b",le="1.0"} 2' in text
+   assert 'wait_seconds_bucket{queue="a\\"b",le="+Inf"} 3' in text
+   assert 'wait_seconds_count{queue="a\\"b"} 3' in text
+
+
+def test_requests_and_queries_are_recorded(client):
+   client.get('/get_tasks')
+   text = client.get('/metrics').get_data(as_text=True)
+   assert 'http_requests_total{endpoint="main.get_tasks",method="GET",status="200"} 1' in text
+   assert 'http_request_queries_count{endpoint="main.get_tasks"} 1' in text
+
+
+def test_metrics_page_is_missing_when_disabled():
+   class NoMetricsConfig(TestConfig):
+      METRICS_ENABLED = False
+
+   app = create_app(NoMetricsConfig)
+   assert 'metrics' not in app.extensions
+   assert app.test_client().get('/metrics').status_code == 404
+
+
+def test_token_is_required_when_set(app, client):
+   app.config['METRICS_TOKEN'] = 'secret'
+   assert client.get('/metrics').status_code == 401
+   assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+   assert client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
@@ -0,0 +1,93 @@
+# Python file with the tests of the password hashing pool: the load shedding when its queue is full, and the
+# stored hashes upgraded to the configured cost on login
+
+# Import the required modules
+import threading
+
+import pytest
+from sqlalchemy import select
+
+from conftest import ADMIN_EMAIL, ADMIN_PASSWORD
+from models import db, User
+from passwords import PasswordHasher, PasswordHasherBusy, _hash, hash_rounds
+
+
+# Fixture creating a hasher with one worker and room for one job
+@pytest.fixture
+def hasher():
+   hasher = PasswordHasher(rounds=4, max_workers=1, max_queue=1)
+   yield hasher
+   hasher.shutdown()
+
+
+# Function to occupy the only slot of a hasher until the returned event is set
+def occupy(hasher):
+   started, release = threading.Event(), threading.Event()
+
+   def blocked():
+      started.set()
+      release.wait(5)
+
+   thread = threading.Thread(target=hasher._run, args=(blocked,))
+   thread.start()
+   assert started.wait(5)
+   return release, thread
+
+
+# Function to get the seeded admin
+def admin():
+   db.session.expire_all()
+   return db.session.scalar(select(User).filter_by(email=ADMIN_EMAIL))
+
+
+def test_full_queue_is_refused_straight_away(hasher):
+   release, thread = occupy(hasher)
+   with pytest.raises(PasswordHasherBusy):
+      hasher.hash('secret')
+   release.set()
+   thread.join()
+   # The slot is given back once the job is done
+   assert hasher.verify('secret', hasher.hash('secret'))
+
+
+def test_observers_get_the_time_bcrypt_took(hasher):
+   timings = []
+   hasher.observers.append(lambda operation, seconds: timings.append((operation, seconds >= 0)))
+   hasher.verify('secret', hasher.hash('secret'))
+   assert timings == [('hash', True), ('verify', True)]
+
+
+def test_saturated_pool_answers_the_login_with_a_503(app, client, hasher):
+   app.extensions['password_hasher'] = hasher
+   release, thread = occupy(hasher)
+   try:
+      response = client.post('/login', data={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD})
+   finally:
+      release.set()
+      thread.join()
+   assert response.status_code == 503
+   assert response.headers['Retry-After'] == '1'
+   # Once the pool has room again, the login goes through
+   response = client.post('/login', data={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD})
+   assert response.status_code == 302
+
+
+def test_password_hashed_with_an_old_cost_is_upgraded_on_login(app, client):
+   rounds = app.config['BCRYPT_LOG_ROUNDS']
+   user = admin()
+   user.password_hash = _hash(ADMIN_PASSWORD, rounds + 1)
+   db.session.commit()
+   response = client.post('/login', data={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD})
+   assert response.status_code == 302
+   user = admin()
+   assert hash_rounds(user.password_hash) == rounds
+   assert user.check_password(ADMIN_PASSWORD)
+
+
+def test_failed_login_leaves_the_old_hash(app, client):
+   old_hash = _hash(ADMIN_PASSWORD, app.config['BCRYPT_LOG_ROUNDS'] + 1)
+   admin().password_hash = old_hash
+   db.session.commit()
+   response = client.post('/login', data={'email': ADMIN_EMAIL, 'password': 'wrong password'})
+   assert response.status_code == 200
+   assert admin().password_hash == old_hash
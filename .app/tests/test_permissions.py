@@ -0,0 +1,94 @@
+# Python file with the tests of the user loading: the roles read with the user and cached, and the cache
+# cleared once a role change is committed
+
+# Import the required modules
+import pytest
+from sqlalchemy import event, select
+
+from conftest import ADMIN_EMAIL
+from models import db, Role, User, UserRole
+from permissions import load_user_with_roles, roles_key
+
+
+# Fixture recording the SQL statements run on the application's database
+@pytest.fixture
+def statements(app):
+   statements = []
+
+   def record_statement(conn, cursor, statement, parameters, context, executemany):
+      statements.append(statement)
+
+   event.listen(db.engine, 'before_cursor_execute', record_statement)
+   yield statements
+   event.remove(db.engine, 'before_cursor_execute', record_statement)
+
+
+# Function to get the id of the seeded admin
+def admin_id():
+   return db.session.scalar(select(User.id).filter_by(email=ADMIN_EMAIL))
+
+
+# Function to load a user the way each request does (with nothing left in the session by the previous one)
+def load(user_id):
+   db.session.expunge_all()
+   return load_user_with_roles(user_id)
+
+
+# Function to give a user a role
+def add_role(user_id, name):
+   role = db.session.scalar(select(Role).filter_by(name=name))
+   db.session.add(UserRole(user_id=user_id, role_id=role.id, assigned_by=None, is_active=True))
+
+
+def test_user_and_roles_are_read_with_one_query(app, statements):
+   user_id = admin_id()
+   del statements[:]
+   user = load(user_id)
+   assert len(statements) == 1
+   assert user.role_names == {'Admin'}
+   assert app.extensions['catalogue_cache'].get(roles_key(user_id)) == ['Admin']
+
+
+def test_permission_checks_run_no_queries_once_cached(statements):
+   user_id = admin_id()
+   load(user_id)
+   del statements[:]
+   user = load(user_id)
+   # Only the user row is read, the roles come from the cache
+   assert len(statements) == 1 and 'user_role' not in statements[0].lower()
+   del statements[:]
+   assert user.is_admin() and user.is_admin_or_manager() and not user.has_role('Customer')
+   assert statements == []
+
+
+def test_cached_roles_are_cleared_once_a_role_change_is_committed(app):
+   cache = app.extensions['catalogue_cache']
+   user_id = admin_id()
+   load(user_id)
+   add_role(user_id, 'Manager')
+   db.session.flush()
+   # Not before the commit, or another request could cache the old roles again in between
+   assert cache.get(roles_key(user_id)) == ['Admin']
+   db.session.commit()
+   assert cache.get(roles_key(user_id)) is None
+   assert load(user_id).role_names == {'Admin', 'Manager'}
+
+
+def test_rolled_back_role_change_keeps_the_cached_roles(app):
+   cache = app.extensions['catalogue_cache']
+   user_id = admin_id()
+   load(user_id)
+   add_role(user_id, 'Manager')
+   db.session.flush()
+   db.session.rollback()
+   assert cache.get(roles_key(user_id)) == ['Admin']
+
+
+def test_deactivated_role_is_dropped_after_the_commit(app):
+   user_id = admin_id()
+   assert load(user_id).is_admin()
+   user_role = db.session.scalar(select(UserRole).filter_by(user_id=user_id))
+   user_role.is_active = False
+   db.session.commit()
+   user = load(user_id)
+   assert user.role_names == set() and not user.is_admin()
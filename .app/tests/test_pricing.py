@@ -0,0 +1,105 @@
+# Python file with the tests of the bulk price adjustments and of their price history
+
+# Import the required modules
+import math
+
+import pytest
+from sqlalchemy import select
+
+from catalogue import get_cached_product
+from models import db, Product, ProductPriceHistory, User
+from pricing import adjust_prices, preview_price_adjustment
+from conftest import ADMIN_EMAIL
+
+# ID of one of the seeded products (Salmon - Fillets, costing 1980)
+SALMON_ID = '01H73QEWMHW5T9R7Y2'
+
+
+# Function to get the history rows of an adjustment
+def history_rows(batch_id):
+   return db.session.scalars(select(ProductPriceHistory).filter_by(batch_id=batch_id)).all()
+
+
+# Function to get the id of the seeded admin
+def admin_id():
+   return db.session.scalar(select(User.id).filter_by(email=ADMIN_EMAIL))
+
+
+def test_percentage_adjustment_writes_a_history_row(app):
+   result = adjust_prices('percent', 10, product_ids=[SALMON_ID], changed_by=admin_id())
+   assert result.changed == 1
+   assert db.session.get(Product, SALMON_ID).price == 2178.0
+   [row] = history_rows(result.batch_id)
+   assert (row.product_id, row.old_price, row.new_price, row.changed_by) == (SALMON_ID, 1980.0, 2178.0, admin_id())
+
+
+def test_prices_are_rounded_and_never_negative(app):
+   db.session.add_all([Product(id='P1', name='Tea', price=9.99), Product(id='P2', name='Coffee', price=3)])
+   db.session.commit()
+   rounded = adjust_prices('percent', 33.333, product_ids=['P1'])
+   clamped = adjust_prices('amount', -5, product_ids=['P2'])
+   assert db.session.get(Product, 'P1').price == 13.32
+   assert db.session.get(Product, 'P2').price == 0.0
+   assert [row.new_price for row in history_rows(rounded.batch_id) + history_rows(clamped.batch_id)] == [13.32, 0.0]
+
+
+def test_unchanged_prices_get_no_history_row(app):
+   db.session.add(Product(id='P1', name='Free sample', price=0))
+   db.session.commit()
+   result = adjust_prices('amount', -1, product_ids=['P1'])
+   assert result.changed == 0 and history_rows(result.batch_id) == []
+
+
+def test_preview_changes_nothing(app):
+   preview = preview_price_adjustment('amount', 20, min_price=1900)
+   assert preview.matched == len(preview.rows) > 0
+   assert all(row.new_price == row.price + 20 for row in preview.rows)
+   assert db.session.get(Product, SALMON_ID).price == 1980.0
+   assert db.session.scalar(select(ProductPriceHistory).limit(1)) is None
+
+
+def test_empty_filter_is_refused(app):
+   with pytest.raises(ValueError):
+      adjust_prices('percent', 10)
+   with pytest.raises(ValueError):
+      adjust_prices('double', 10, all_products=True)
+
+
+def test_adjustment_refreshes_the_cached_product(app):
+   assert get_cached_product(SALMON_ID)['price'] == 1980.0
+   adjust_prices('amount', 20, product_ids=[SALMON_ID])
+   assert get_cached_product(SALMON_ID)['price'] == 2000.0
+
+
+def test_adjust_prices_page_applies_the_adjustment(admin_client):
+   response = admin_client.post('/adjust_prices', data={'mode': 'amount', 'value': '20', 'ids': SALMON_ID,
+                                                        'action': 'apply'})
+   assert response.status_code == 302
+   assert db.session.get(Product, SALMON_ID).price == 2000.0
+   [row] = db.session.scalars(select(ProductPriceHistory)).all()
+   assert (row.old_price, row.new_price, row.changed_by) == (1980.0, 2000.0, admin_id())
+
+
+def test_non_finite_changes_are_refused(admin_client):
+   for value in (math.inf, -math.inf, math.nan):
+      with pytest.raises(ValueError):
+         adjust_prices('amount', value, all_products=True)
+   for value in ('inf', '-inf', 'nan'):
+      response = admin_client.post('/adjust_prices', data={'mode': 'percent', 'value': value, 'all_products': 'y',
+                                                           'action': 'apply'})
+      assert response.status_code == 200 and b'Please enter a number' in response.data
+   assert db.session.get(Product, SALMON_ID).price == 1980.0
+
+
+def test_percentage_drops_of_100_or_more_are_refused(admin_client):
+   for value in (-100, -150):
+      with pytest.raises(ValueError):
+         adjust_prices('percent', value, product_ids=[SALMON_ID])
+      with pytest.raises(ValueError):
+         preview_price_adjustment('percent', value, product_ids=[SALMON_ID])
+   response = admin_client.post('/adjust_prices', data={'mode': 'percent', 'value': '-100', 'ids': SALMON_ID,
+                                                        'action': 'apply'})
+   assert response.status_code == 200 and b'100% or more' in response.data
+   assert db.session.get(Product, SALMON_ID).price == 1980.0
+   assert adjust_prices('percent', -99.5, product_ids=[SALMON_ID]).changed == 1
+   assert db.session.get(Product, SALMON_ID).price == 9.9
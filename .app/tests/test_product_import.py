@@ -0,0 +1,47 @@
+# Python file with the tests of the bulk product import
+
+# Import the required modules
+import io
+import json
+
+from models import db, Product
+from product_import import import_products
+
+
+# Function to import an NDJSON price list made of the given rows
+def import_ndjson(rows, **options):
+   text = '\n'.join(json.dumps(row) for row in rows)
+   return import_products(io.StringIO(text), 'ndjson', **options)
+
+
+def test_csv_rows_are_upserted(app):
+   report = import_products(io.StringIO('id,name,price\nP1,Tea,10\n01H73QEWMHW5T9R7Y2,Salmon,2000\n'), 'csv')
+   assert (report.processed, report.imported, report.failed) == (2, 2, 0)
+   assert db.session.get(Product, 'P1').price == 10.0
+   assert db.session.get(Product, '01H73QEWMHW5T9R7Y2').name == 'Salmon'
+
+
+def test_bad_prices_only_fail_their_own_row(app):
+   rows = [{'id': f'P{i}', 'name': f'Product {i}', 'price': i} for i in range(10)]
+   rows[3]['price'] = 'nan'
+   rows[5]['price'] = 'inf'
+   rows[7]['price'] = True
+   report = import_ndjson(rows, batch_size=2, commit_every=2)
+   assert report.imported == 7
+   assert [line for line, _ in report.errors] == [4, 6, 8]
+   assert all(message.startswith('Invalid price') for _, message in report.errors)
+   assert db.session.query(Product).filter(Product.id.like('P%')).count() == 7
+
+
+def test_unreadable_file_is_a_failed_import(app):
+   data = 'id,name,price\nP1,Tea,10\nP2,Café,12\n'.encode('cp1252')
+   report = import_products(io.BytesIO(data), 'csv')
+   assert report.failed == 1
+   assert report.errors[0][1].startswith('Unreadable file')
+
+
+def test_unreadable_upload_is_reported(admin_client):
+   data = {'file': (io.BytesIO('id,name,price\nP1,Café,12\n'.encode('cp1252')), 'prices.csv')}
+   response = admin_client.post('/import_products', data=data, content_type='multipart/form-data')
+   assert response.status_code == 200
+   assert b'Unreadable file' in response.data
@@ -0,0 +1,39 @@
+# Python file with the tests of the full-text product search
+
+# Import the required modules
+from models import db
+from product_import import upsert_products
+from search import search_products
+
+
+def test_best_match_is_found_among_many_newer_matches(app):
+   upsert_products([{'id': 'BEST', 'name': 'Espresso', 'price': 100.0}])
+   upsert_products([{'id': f'N{i:05}', 'name': f'Espresso cup holder, large brown model {i}', 'price': 100.0}
+                    for i in range(1500)])
+   db.session.commit()
+   results, has_more = search_products('espresso', per_page=5)
+   assert results[0]['id'] == 'BEST'
+   assert has_more
+
+
+def test_pages_do_not_overlap(app):
+   upsert_products([{'id': f'N{i:05}', 'name': f'Tea bags {i}', 'price': 10.0} for i in range(30)])
+   db.session.commit()
+   first, _ = search_products('tea', page=1, per_page=20)
+   second, has_more = search_products('tea', page=2, per_page=20)
+   assert len(first) + len(second) == 30 and not has_more
+   assert not {p['id'] for p in first} & {p['id'] for p in second}
+
+
+def test_words_are_matched_as_prefixes_within_the_price_range(app):
+   results, _ = search_products('choc dar', max_price=1000)
+   assert [p['name'] for p in results] == ['Chocolate - Dark, 70% Cocoa']
+   assert search_products('choc dar', min_price=1000) == ([], False)
+
+
+def test_price_only_search_lists_the_catalogue_range(client):
+   results, has_more = search_products('', min_price=1000)
+   assert [p['name'] for p in results] == ['Chicken - Whole Roasting', 'Salmon - Fillets'] and not has_more
+   assert search_products('') == ([], False)
+   response = client.get('/products/search?min_price=1000')
+   assert b'Salmon - Fillets' in response.data
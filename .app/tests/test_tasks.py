@@ -0,0 +1,69 @@
+# Python file with the tests of the /get_tasks endpoint: paging and delta sync
+
+# Import the required modules
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+from catalogue import encode_key
+from conftest import ADMIN_EMAIL
+from models import db, Task, User
+from tasks import tasks
+
+
+def test_pages_follow_the_cursor(client):
+   first = client.get('/get_tasks?per_page=5').get_json()
+   second = client.get(f"/get_tasks?per_page=5&after={first['next_cursor']}").get_json()
+   ids = [task['id'] for task in first['data'] + second['data']]
+   assert ids == sorted(set(ids)) and len(ids) == 10
+
+
+def test_delta_sync_returns_changes_and_deletions(client):
+   sync = client.get('/get_tasks').get_json()
+   task = db.session.get(Task, 3)
+   task.done = True
+   db.session.get(Task, 4).deleted_at = datetime.now(timezone.utc)
+   db.session.commit()
+   changes = client.get('/get_tasks', query_string={'since': sync['server_time']}).get_json()['data']
+   assert {(change['id'], change['done'], change['deleted']) for change in changes} >= {(3, True, False),
+                                                                                        (4, False, True)}
+
+
+def test_change_committed_after_a_read_is_synced_next_time(client):
+   sync = client.get('/get_tasks').get_json()
+   # A transaction that flushed (stamping updated_at) before the read above and only committed after it
+   db.session.add(Task(title='Late commit', done=False,
+                       updated_at=datetime.now(timezone.utc) - timedelta(seconds=2)))
+   db.session.commit()
+   changes = client.get('/get_tasks', query_string={'since': sync['server_time']}).get_json()['data']
+   assert 'Late commit' in [change['title'] for change in changes]
+
+
+def test_invalid_cursors_are_rejected(client):
+   for cursor in ('garbage', encode_key(['1']), encode_key([True]), encode_key([1, 2])):
+      assert client.get(f'/get_tasks?after={cursor}').status_code == 400
+   since = '2020-01-01T00:00:00Z'
+   for cursor in (encode_key([5, 1]), encode_key(['not a time', 1]), encode_key(['2020-01-01T00:00:00', 'x'])):
+      assert client.get(f'/get_tasks?since={since}&after={cursor}').status_code == 400
+   assert client.get('/get_tasks?since=yesterday').status_code == 400
+
+
+def test_logged_in_users_get_the_public_tasks_and_their_own(admin_client):
+   public = len(admin_client.get('/get_tasks?per_page=100').get_json()['data'])
+   admin = db.session.scalar(select(User).filter_by(email=ADMIN_EMAIL))
+   db.session.add_all([Task(title='Admin task', done=False, user_id=admin.id),
+                       Task(title='Someone else', done=False, user_id=admin.id + 1)])
+   db.session.commit()
+   titles = [task['title'] for task in admin_client.get('/get_tasks?per_page=100').get_json()['data']]
+   assert public == len(tasks) and len(titles) == public + 1
+   assert 'Admin task' in titles and 'Someone else' not in titles
+   sync = admin_client.get('/get_tasks', query_string={'since': '2020-01-01T00:00:00Z'}).get_json()
+   assert 'Admin task' in [change['title'] for change in sync['data']]
+
+
+def test_unencoded_server_time_round_trips(client):
+   server_time = client.get('/get_tasks').get_json()['server_time']
+   assert server_time.endswith('Z')
+   assert client.get(f'/get_tasks?since={server_time}').status_code == 200
+   # An offset whose '+' wasn't URL-encoded arrives as a space
+   assert client.get(f"/get_tasks?since={server_time.replace('Z', '+00:00')}").status_code == 200
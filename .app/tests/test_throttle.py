@@ -0,0 +1,86 @@
+# Python file with the tests of the login throttling
+
+# Import the required modules
+import time
+
+import pytest
+
+from conftest import ADMIN_EMAIL, ADMIN_PASSWORD, TestConfig
+from index import create_app, create_tables, seed_all
+from throttle import LoginThrottle, MemoryThrottleStore, SQLiteThrottleStore
+
+
+# Fixture creating a throttle on each store, allowing 3 attempts per email and 5 per IP address
+@pytest.fixture(params=['memory', 'sqlite'])
+def throttle(request, tmp_path):
+   store = MemoryThrottleStore() if request.param == 'memory' else SQLiteThrottleStore(str(tmp_path / 'throttle.db'))
+   return LoginThrottle(store, email_limit=3, ip_limit=5, window=60)
+
+
+def test_email_is_locked_out_and_reset(throttle):
+   outcomes = []
+   throttle.observers.append(outcomes.append)
+   assert [throttle.check('User@Example.com', '10.0.0.1') for _ in range(3)] == [0, 0, 0]
+   wait = throttle.check('user@example.com ', '10.0.0.2')
+   assert 0 < wait <= 60
+   throttle.reset('user@example.com')
+   assert throttle.check('user@example.com', '10.0.0.3') == 0
+   assert outcomes == ['allowed'] * 3 + ['blocked_email', 'allowed']
+
+
+def test_ip_address_is_locked_out(throttle):
+   assert all(throttle.check(f'user{i}@example.com', '10.0.0.1') == 0 for i in range(5))
+   assert throttle.check('other@example.com', '10.0.0.1') > 0
+   assert throttle.check('other@example.com', '10.0.0.2') == 0
+
+
+def test_successful_logins_do_not_use_up_the_ip_budget(throttle):
+   for i in range(10):
+      assert throttle.check(f'user{i}@example.com', '10.0.0.1') == 0
+      throttle.reset(f'user{i}@example.com', '10.0.0.1')
+   # Failed attempts still count
+   assert all(throttle.check(f'other{i}@example.com', '10.0.0.1') == 0 for i in range(5))
+   assert throttle.check('last@example.com', '10.0.0.1') > 0
+
+
+def test_sqlite_store_sweeps_keys_that_are_not_tried_again(tmp_path):
+   store = SQLiteThrottleStore(str(tmp_path / 'throttle.db'))
+   connection = store._connect()
+   connection.executemany('INSERT INTO login_attempt (key, at) VALUES (?, ?)',
+                          [(f'email:old{i}@example.com', time.time() - 120) for i in range(100)])
+   store.hit('email:new@example.com', 5, 60)
+   assert connection.execute('SELECT key FROM login_attempt').fetchall() == [('email:new@example.com',)]
+
+
+# Function to try a wrong password from the given client address
+def bad_login(client, forwarded_for):
+   return client.post('/login', data={'email': ADMIN_EMAIL, 'password': 'WrongPassw0rd!'},
+                      headers={'X-Forwarded-For': forwarded_for})
+
+
+def test_clients_behind_a_trusted_proxy_get_their_own_limit(app):
+   class ProxiedConfig(TestConfig):
+      TRUSTED_PROXIES = 1
+      LOGIN_THROTTLE_IP_LIMIT = 2
+   proxied = create_app(ProxiedConfig)
+   proxied.extensions['login_throttle'].email_limit = 100
+   client = proxied.test_client()
+   with proxied.app_context():
+      create_tables()
+   seed_all(proxied)
+   assert [bad_login(client, '203.0.113.1').status_code for _ in range(3)] == [200, 200, 429]
+   assert bad_login(client, '203.0.113.2').status_code == 200
+
+
+def test_successful_logins_from_a_shared_address_are_not_throttled(app, client):
+   app.extensions['login_throttle'].ip_limit = 2
+   for _ in range(3):
+      response = client.post('/login', data={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD})
+      assert response.status_code == 302
+      client.get('/logout')
+   assert [bad_login(client, '127.0.0.1').status_code for _ in range(3)] == [200, 200, 429]
+
+
+def test_login_outcomes_are_in_the_metrics(client):
+   client.post('/login', data={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD})
+   assert 'login_attempts_total{outcome="allowed"} 1' in client.get('/metrics').get_data(as_text=True)
@@ -0,0 +1,64 @@
+# Python file with the tests of the bulk user provisioning
+
+# Import the required modules
+from datetime import date
+import io
+
+from models import db, User
+from user_import import import_users
+
+# Header and a valid row of a user CSV file
+HEADER = 'email,full_name,birth_date,gender,phone,password,role\n'
+ROW = '{email},Jane Doe,1990-01-31,female,{phone},Passw0rd!,Staff\n'
+
+
+def test_users_are_created_with_normalised_emails(app, monkeypatch):
+   # Uploads must not start a pool of processes
+   monkeypatch.setattr('user_import.ProcessPoolExecutor', None)
+   data = HEADER + ROW.format(email=' Jane.Doe@Example.COM', phone='0712345678')
+   report = import_users(io.StringIO(data), 'csv')
+   assert (report.imported, report.failed) == (1, 0)
+   user = User.query.filter_by(email='jane.doe@example.com').one()
+   assert user.check_password('Passw0rd!')
+
+
+def test_invalid_rows_do_not_start_processes(app, monkeypatch):
+   started = []
+   monkeypatch.setattr('user_import.ProcessPoolExecutor', lambda **options: started.append(options))
+   report = import_users(io.StringIO(HEADER + 'bad-email,x,,,,,\n'), 'csv', processes=2)
+   assert report.failed == 1 and started == []
+
+
+def test_emails_differing_in_case_are_duplicates(admin_client):
+   response = admin_client.post('/add-user', data={
+      'email': 'ADMIN1@DS2505.AC.KE', 'full_name': 'Someone Else', 'birth_date': '1990-01-31',
+      'gender': 'Male', 'phone': '0799999999', 'password': 'Passw0rd!', 'confirm_password': 'Passw0rd!',
+      'role': 'Staff'})
+   assert b'Email already exists' in response.data
+   assert User.query.filter_by(phone='0799999999').first() is None
+   data = HEADER + ROW.format(email='Admin1@ds2505.ac.ke', phone='0788888888')
+   report = import_users(io.StringIO(data), 'csv')
+   assert report.results[0]['message'] == 'Email already exists'
+
+
+def test_emails_stored_in_mixed_case_still_match(client):
+   user = User(email='Mixed.Case@Example.com', full_name='Old Account', birth_date=date(1990, 1, 31),
+               gender='female', phone='0711111111')
+   user.set_password('Passw0rd!')
+   db.session.add(user)
+   db.session.commit()
+   assert User.find_by_email(' mixed.case@example.COM') == user
+   response = client.post('/login', data={'email': 'mixed.case@example.com', 'password': 'Passw0rd!'})
+   assert response.status_code == 302
+   data = HEADER + ROW.format(email='MIXED.case@example.com', phone='0788888888')
+   report = import_users(io.StringIO(data), 'csv')
+   assert report.results[0]['message'] == 'Email already exists'
+
+
+def test_non_utf8_upload_is_reported(admin_client):
+   data = (HEADER + ROW.format(email='jose@example.com', phone='0712345670').replace('Jane', 'José'))
+   response = admin_client.post('/add-users?format=json', content_type='multipart/form-data', data={
+      'file': (io.BytesIO(data.encode('cp1252')), 'users.csv'), 'default_role': 'Customer'})
+   assert response.status_code == 200
+   assert response.get_json()['results'][0]['message'].startswith('Invalid file')
+   assert db.session.query(User).filter_by(email='jose@example.com').first() is None
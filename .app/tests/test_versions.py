@@ -0,0 +1,42 @@
+# Python file with the tests of the conditional (ETag / Last-Modified) responses
+
+# Import the required modules
+from sqlalchemy import event
+
+from catalogue import invalidate_catalogue
+from models import db
+
+
+def test_unchanged_catalogue_is_not_modified(client):
+   response = client.get('/products')
+   etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+   statements = []
+   event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+   assert client.get('/products', headers={'If-None-Match': etag}).status_code == 304
+   assert client.get('/products', headers={'If-Modified-Since': last_modified}).status_code == 304
+   assert statements == []
+
+
+def test_catalogue_change_gives_a_new_etag(client):
+   etag = client.get('/api/v1/products').headers['ETag']
+   assert client.get('/api/v1/products', headers={'If-None-Match': etag}).status_code == 304
+   invalidate_catalogue('01H73QEWMHW5T9R7Y2')
+   response = client.get('/api/v1/products', headers={'If-None-Match': etag})
+   assert response.status_code == 200
+   assert response.headers['ETag'] != etag
+
+
+# Function to drop the messages waiting to be shown (pages are sent without validators while there are any)
+def drop_flashes(client):
+   with client.session_transaction() as session:
+      session.pop('_flashes', None)
+
+
+def test_etag_depends_on_the_logged_in_user(admin_client):
+   drop_flashes(admin_client)
+   etag = admin_client.get('/products').headers['ETag']
+   admin_client.get('/logout')
+   drop_flashes(admin_client)
+   response = admin_client.get('/products', headers={'If-None-Match': etag})
+   assert response.status_code == 200
+   assert response.headers['ETag'] != etag
@@ -0,0 +1,108 @@
+# Python file with the tests of the write-behind buffer
+
+# Import the required modules
+from datetime import datetime
+import time
+
+import pytest
+from sqlalchemy import select
+
+import write_behind
+from conftest import ADMIN_EMAIL
+from models import db, User
+from write_behind import WriteBehindBuffer
+
+# Login times written by the tests
+EARLIER = datetime(2026, 1, 1, 8, 0)
+LATER = datetime(2026, 1, 1, 9, 30)
+
+
+# Fixture creating a buffer that only flushes when told to (or when full), closed after the test
+@pytest.fixture
+def buffer(app):
+   buffer = WriteBehindBuffer(app, interval=60, max_pending=100)
+   yield buffer
+   buffer.close()
+
+
+# Function to get the id of the seeded admin
+def admin_id():
+   return db.session.scalar(select(User.id).filter_by(email=ADMIN_EMAIL))
+
+
+# Function to read a user's last login from the database
+def last_login(user_id):
+   db.session.expire_all()
+   return db.session.scalar(select(User.last_login).filter_by(id=user_id))
+
+
+# Function to wait until the background thread has written a user's last login
+def wait_for_last_login(user_id, value, timeout=5):
+   deadline = time.monotonic() + timeout
+   while last_login(user_id) != value:
+      assert time.monotonic() < deadline, 'timed out'
+      time.sleep(0.01)
+
+
+def test_updates_of_a_row_are_coalesced(buffer):
+   user_id = admin_id()
+   buffer.update(User, user_id, last_login=EARLIER)
+   buffer.update(User, user_id, last_login=LATER)
+   assert buffer.pending() == 1
+   assert buffer.flush() == 1
+   assert last_login(user_id) == LATER
+
+
+def test_full_buffer_is_flushed_straight_away(app):
+   buffer = WriteBehindBuffer(app, interval=60, max_pending=2)
+   try:
+      user_ids = db.session.scalars(select(User.id).limit(2)).all()
+      for user_id in user_ids:
+         buffer.update(User, user_id, last_login=LATER)
+      for user_id in user_ids:
+         wait_for_last_login(user_id, LATER)
+   finally:
+      buffer.close()
+
+
+def test_buffer_is_flushed_every_interval(app):
+   buffer = WriteBehindBuffer(app, interval=0.05)
+   try:
+      buffer.update(User, admin_id(), last_login=LATER)
+      wait_for_last_login(admin_id(), LATER)
+   finally:
+      buffer.close()
+
+
+def test_close_writes_what_is_waiting(buffer):
+   user_id = admin_id()
+   buffer.update(User, user_id, last_login=EARLIER)
+   buffer.close()
+   assert buffer.pending() == 0 and last_login(user_id) == EARLIER
+   # Once closed, updates are written straight away
+   buffer.update(User, user_id, last_login=LATER)
+   assert buffer.pending() == 0 and last_login(user_id) == LATER
+
+
+def test_missing_rows_do_not_hold_up_the_others(buffer):
+   user_id = admin_id()
+   buffer.update(User, user_id, last_login=LATER)
+   buffer.update(User, 9999, last_login=LATER)
+   assert buffer.flush() == 2
+   assert buffer.pending() == 0 and last_login(user_id) == LATER
+
+
+def test_failed_flushes_are_retried_then_dropped(buffer, monkeypatch):
+   def failing_statement(model, names):
+      raise RuntimeError('database unavailable')
+
+   monkeypatch.setattr(write_behind, 'update_statement', failing_statement)
+   buffer.update(User, admin_id(), last_login=EARLIER)
+   assert buffer.flush() == 0 and buffer.pending() == 1
+   # The values are kept across failed flushes, and dropped after the third one
+   buffer.update(User, admin_id(), last_login=LATER)
+   assert buffer.flush() == 0 and buffer.pending() == 1
+   assert buffer.flush() == 0 and buffer.pending() == 0
+   monkeypatch.undo()
+   buffer.update(User, admin_id(), last_login=LATER)
+   assert buffer.flush() == 1 and last_login(admin_id()) == LATER
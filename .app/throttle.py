@@ -0,0 +1,185 @@
+# Python file to throttle login attempts per email address and per client IP address.
+# Every login attempt costs a full bcrypt check, so attempts over the limit are rejected before the
+# user is looked up or any password is hashed
+
+# Import the required modules
+from collections import defaultdict, deque
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+
+# Default limits: attempts allowed per email and per IP address within the sliding window (in seconds)
+DEFAULT_EMAIL_LIMIT = 5
+DEFAULT_IP_LIMIT = 20
+DEFAULT_WINDOW = 300
+
+
+# In-process store: a sliding window log (the times of the recent attempts) per key
+class MemoryThrottleStore:
+   # Number of attempts between two sweeps of the keys that have no recent attempts
+   SWEEP_EVERY = 1024
+
+   def __init__(self):
+      self._attempts = defaultdict(deque)
+      self._lock = threading.Lock()
+      self._hits = 0
+
+   # Method to drop the keys whose attempts have all left the window (keeps memory bounded)
+   def _sweep(self, now, window):
+      stale = [key for key, attempts in self._attempts.items() if not attempts or attempts[-1] <= now - window]
+      for key in stale:
+         del self._attempts[key]
+
+   # Method to record an attempt if the key is under its limit. Returns the number of seconds to wait
+   # before the next attempt is allowed (0 when this attempt was allowed)
+   def hit(self, key, limit, window):
+      now = time.monotonic()
+      with self._lock:
+         self._hits += 1
+         if self._hits % self.SWEEP_EVERY == 0:
+            self._sweep(now, window)
+         attempts = self._attempts[key]
+         while attempts and attempts[0] <= now - window:
+            attempts.popleft()
+         if len(attempts) >= limit:
+            return attempts[0] + window - now
+         attempts.append(now)
+         return 0
+
+   # Method to forget the attempts of a key (e.g. after a successful login)
+   def reset(self, key):
+      with self._lock:
+         self._attempts.pop(key, None)
+
+   # Method to take back the latest attempt of a key (e.g. a successful login, which shouldn't count)
+   def undo(self, key):
+      with self._lock:
+         attempts = self._attempts.get(key)
+         if attempts:
+            attempts.pop()
+
+
+# Local shared store: the sliding window logs kept in a SQLite file so that every worker process on the
+# host applies the same limits
+class SQLiteThrottleStore:
+   def __init__(self, path):
+      self.path = path
+      self._local = threading.local()
+      self._swept = 0.0
+      self._connect().execute('CREATE TABLE IF NOT EXISTS login_attempt (key TEXT NOT NULL, at REAL NOT NULL)')
+      self._connect().execute('CREATE INDEX IF NOT EXISTS ix_login_attempt_key_at ON login_attempt (key, at)')
+      self._connect().execute('CREATE INDEX IF NOT EXISTS ix_login_attempt_at ON login_attempt (at)')
+
+   # Method to get the connection of the current thread
+   def _connect(self):
+      connection = getattr(self._local, 'connection', None)
+      if connection is None:
+         directory = os.path.dirname(self.path)
+         if directory:
+            os.makedirs(directory, exist_ok=True)
+         connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+         connection.execute('PRAGMA journal_mode=WAL')
+         connection.execute('PRAGMA synchronous=NORMAL')
+         self._local.connection = connection
+      return connection
+
+   # Method to record an attempt if the key is under its limit (see MemoryThrottleStore.hit)
+   def hit(self, key, limit, window):
+      now = time.time()
+      connection = self._connect()
+      # BEGIN IMMEDIATE takes the write lock first, so the count and the insert are atomic across processes
+      connection.execute('BEGIN IMMEDIATE')
+      try:
+         # Once per window the attempts of every key that left it are dropped (e.g. emails tried only once),
+         # otherwise only those of the key being checked
+         if now - self._swept >= window:
+            self._swept = now
+            connection.execute('DELETE FROM login_attempt WHERE at <= ?', (now - window,))
+         else:
+            connection.execute('DELETE FROM login_attempt WHERE key = ? AND at <= ?', (key, now - window))
+         count, oldest = connection.execute('SELECT COUNT(*), MIN(at) FROM login_attempt WHERE key = ?',
+                                            (key,)).fetchone()
+         if count >= limit:
+            wait = oldest + window - now
+         else:
+            connection.execute('INSERT INTO login_attempt (key, at) VALUES (?, ?)', (key, now))
+            wait = 0
+         connection.execute('COMMIT')
+      except BaseException:
+         connection.execute('ROLLBACK')
+         raise
+      return wait
+
+   # Method to forget the attempts of a key
+   def reset(self, key):
+      self._connect().execute('DELETE FROM login_attempt WHERE key = ?', (key,))
+
+   # Method to take back the latest attempt of a key
+   def undo(self, key):
+      self._connect().execute('DELETE FROM login_attempt WHERE rowid = (SELECT rowid FROM login_attempt '
+                              'WHERE key = ? ORDER BY at DESC LIMIT 1)', (key,))
+
+
+# Class to apply the per-email and per-IP limits and to report the outcome of every attempt
+class LoginThrottle:
+   def __init__(self, store, email_limit=DEFAULT_EMAIL_LIMIT, ip_limit=DEFAULT_IP_LIMIT,
+                window=DEFAULT_WINDOW):
+      self.store = store
+      self.email_limit = email_limit
+      self.ip_limit = ip_limit
+      self.window = window
+      # Functions called with the outcome of every attempt ('allowed', 'blocked_ip' or 'blocked_email'), e.g. metrics
+      self.observers = []
+
+   # Method to tell the observers the outcome of an attempt
+   def _count(self, outcome):
+      for observer in self.observers:
+         observer(outcome)
+
+   # Method to record a login attempt. Returns the number of seconds the client must wait when the
+   # attempt is throttled, or 0 when it may go ahead
+   def check(self, email, ip_address):
+      wait = self.store.hit(f"ip:{ip_address}", self.ip_limit, self.window)
+      if wait:
+         self._count('blocked_ip')
+         return wait
+      wait = self.store.hit(f"email:{email.strip().lower()}", self.email_limit, self.window)
+      if wait:
+         self._count('blocked_email')
+         return wait
+      self._count('allowed')
+      return 0
+
+   # Method to clear the attempts of an email address after a successful login. The successful attempt is also
+   # taken back from the IP address's count, so the users sharing an address (e.g. an office behind one NAT)
+   # only use up its budget with failed attempts
+   def reset(self, email, ip_address=None):
+      self.store.reset(f"email:{email.strip().lower()}")
+      if ip_address is not None:
+         self.store.undo(f"ip:{ip_address}")
+
+
+# Function to get the login throttle of the current application
+def get_login_throttle():
+   return current_app.extensions['login_throttle']
+
+
+# Function to attach the login throttle selected in the configuration to the application
+def init_throttle(app):
+   backend = app.config.get('LOGIN_THROTTLE_BACKEND', 'memory')
+   if backend == 'memory':
+      store = MemoryThrottleStore()
+   elif backend == 'sqlite':
+      store = SQLiteThrottleStore(app.config.get('LOGIN_THROTTLE_PATH')
+                                  or os.path.join(app.instance_path, 'login_throttle.db'))
+   else:
+      raise ValueError(f"Unknown login throttle backend: {backend}")
+   app.extensions['login_throttle'] = LoginThrottle(
+      store,
+      email_limit=app.config.get('LOGIN_THROTTLE_EMAIL_LIMIT', DEFAULT_EMAIL_LIMIT),
+      ip_limit=app.config.get('LOGIN_THROTTLE_IP_LIMIT', DEFAULT_IP_LIMIT),
+      window=app.config.get('LOGIN_THROTTLE_WINDOW', DEFAULT_WINDOW),
+   )
@@ -2,6 +2,7 @@
 
 # Import the required modules
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, SubmitField, DateField, RadioField, EmailField
 from wtforms import TelField, PasswordField, SelectField
 from wtforms.validators import DataRequired, Email, EqualTo, Length, Regexp
@@ -66,3 +67,17 @@ class UserForm(FlaskForm):
       ('Staff','Staff'),
       ('Customer','Customer')
    ],validators=[DataRequired(message='Role is required')])
+
+
+# Create the bulk user provisioning form (CSV or JSON files with one user per row)
+class UserImportForm(FlaskForm):
+   file = FileField('Users', validators=[
+      FileRequired(message='Please select a file of users to create'),
+      FileAllowed(['csv', 'json', 'ndjson', 'jsonl'], message='Only CSV or JSON files can be imported'),
+   ])
+   default_role = SelectField('Default Role', choices=[
+      ('Customer','Customer'),
+      ('Staff','Staff'),
+      ('Manager','Manager'),
+      ('Admin','Admin')
+   ],validators=[DataRequired(message='Role is required')])
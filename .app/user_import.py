@@ -0,0 +1,256 @@
+# Python file to provision (create) many users at once from a CSV or JSON file. Only used by admins.
+# Duplicates are checked with one query per key for a whole batch, the passwords are hashed on the application's
+# bcrypt worker threads (or, by the CLI command, on a pool of processes using every core) and the users and their
+# roles are inserted in batches
+
+# Import the required modules
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import csv
+import io
+import json
+import os
+import re
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, User, Role, UserRole, normalize_email
+from passwords import DEFAULT_ROUNDS, _hash, get_hasher
+from product_import import ImportReport
+
+# Number of users created per transaction
+DEFAULT_BATCH_SIZE = 500
+
+# Validation rules (the same as the add user form)
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+PHONE_PATTERN = re.compile(r'^\d{10,11}$')
+PASSWORD_PATTERN = re.compile(r'^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,18}$')
+
+
+# Class to hold the outcome of a provisioning run, with a result for every row
+class UserImportReport(ImportReport):
+   def __init__(self):
+      super().__init__()
+      self.results = []
+
+   # Method to record the result of a row
+   def add_result(self, line, email, status, message=''):
+      self.results.append({'line': line, 'email': email, 'status': status, 'message': message})
+      if status == 'created':
+         self.imported += 1
+      else:
+         self.add_error(line, message)
+
+   # Method to return the report as a dictionary
+   def as_dict(self):
+      data = super().as_dict()
+      data['results'] = sorted(self.results, key=lambda result: result['line'])
+      return data
+
+
+# Generator that parses the rows of a CSV or JSON (array or one object per line) file, yielding
+# (line number, row) pairs
+def iter_user_rows(text_stream, file_format):
+   if file_format == 'csv':
+      reader = csv.DictReader(text_stream)
+      for row in reader:
+         yield reader.line_num, row
+      return
+   content = text_stream.read()
+   if content.lstrip().startswith('['):
+      for number, row in enumerate(json.loads(content), start=1):
+         yield number, row
+      return
+   for number, line in enumerate(content.splitlines(), start=1):
+      if line.strip():
+         try:
+            yield number, json.loads(line)
+         except ValueError as e:
+            yield number, ValueError(f"Invalid JSON: {e}")
+
+
+# Function to validate a row and convert it into the values of a user. Raises ValueError for invalid rows
+def clean_user_row(row, role_ids, default_role):
+   if isinstance(row, Exception):
+      raise row
+   if not isinstance(row, dict):
+      raise ValueError("Row must be an object")
+   value = lambda name: str(row.get(name) or '').strip()
+
+   email = normalize_email(value('email'))
+   if not EMAIL_PATTERN.match(email) or len(email) > 120:
+      raise ValueError("Invalid email address")
+   full_name = value('full_name')
+   if not 2 <= len(full_name) <= 150:
+      raise ValueError("Full name must be between 2 and 150 characters")
+   try:
+      birth_date = datetime.strptime(value('birth_date'), '%Y-%m-%d').date()
+   except ValueError:
+      raise ValueError("Birth date must be in the format YYYY-MM-DD")
+   gender = value('gender').lower()
+   if gender not in ('male', 'female'):
+      raise ValueError("Gender must be male or female")
+   phone = value('phone')
+   if not PHONE_PATTERN.match(phone):
+      raise ValueError("Phone number must be 10 or 11 digits")
+   password = str(row.get('password') or '')
+   if not PASSWORD_PATTERN.match(password):
+      raise ValueError("Password must be 8 - 18 characters with an uppercase, a lowercase, a digit and a "
+                       "special character")
+   role = value('role') or default_role
+   if role not in role_ids:
+      raise ValueError(f"Unknown role: {role}")
+   return {'email': email, 'full_name': full_name, 'birth_date': birth_date, 'gender': gender,
+           'phone': phone, 'password': password, 'role': role}
+
+
+# Class of a pool of hashing processes that is only started when it is first used, so a file whose rows all
+# fail validation doesn't start any
+class LazyProcessPool:
+   def __init__(self, processes):
+      self.processes = processes
+      self._executor = None
+
+   # Method to run a function over the given arguments on the processes
+   def map(self, function, *iterables, chunksize=1):
+      if self._executor is None:
+         self._executor = ProcessPoolExecutor(max_workers=self.processes)
+      return self._executor.map(function, *iterables, chunksize=chunksize)
+
+   # Method to stop the processes (if they were started)
+   def shutdown(self):
+      if self._executor is not None:
+         self._executor.shutdown()
+
+
+# Function to hash a list of passwords: on the given pool of processes (bcrypt is CPU bound, so this uses every
+# core), else on the application's bcrypt worker threads
+def hash_passwords(passwords, rounds, executor=None):
+   if executor is not None and len(passwords) > 1:
+      return list(executor.map(_hash, passwords, [rounds] * len(passwords), chunksize=4))
+   hasher = get_hasher()
+   if hasher is None:
+      return [_hash(password, rounds) for password in passwords]
+   return hasher.hash_many(passwords)
+
+
+# Function to create the valid users of a batch and record the result of each row
+def provision_batch(batch, role_ids, assigned_by, rounds, executor, report):
+   # One query per key finds the emails and phone numbers already in use by the whole batch. The emails are
+   # compared in lowercase, as accounts created before may have been stored as they were typed
+   emails = [values['email'] for _, values in batch]
+   phones = [values['phone'] for _, values in batch]
+   taken_emails = set(db.session.scalars(select(func.lower(User.email)).where(func.lower(User.email).in_(emails))))
+   taken_phones = set(db.session.scalars(select(User.phone).where(User.phone.in_(phones))))
+
+   accepted = []
+   for line, values in batch:
+      if values['email'] in taken_emails:
+         report.add_result(line, values['email'], 'error', "Email already exists")
+      elif values['phone'] in taken_phones:
+         report.add_result(line, values['email'], 'error', "Phone number already exists")
+      else:
+         # Later rows of the file can't reuse an email/phone number taken by an earlier one
+         taken_emails.add(values['email'])
+         taken_phones.add(values['phone'])
+         accepted.append((line, values))
+   if not accepted:
+      return
+
+   now = datetime.now(timezone.utc)
+   hashes = hash_passwords([values['password'] for _, values in accepted], rounds, executor)
+   try:
+      db.session.execute(insert(User), [
+         {'email': values['email'], 'full_name': values['full_name'], 'birth_date': values['birth_date'],
+          'gender': values['gender'], 'phone': values['phone'], 'is_active': True, 'created_at': now,
+          'updated_at': now, 'password_hash': password_hash, 'password_updated_at': now}
+         for (_, values), password_hash in zip(accepted, hashes)
+      ])
+      user_ids = dict(db.session.execute(
+         select(User.email, User.id).where(User.email.in_([values['email'] for _, values in accepted]))).all())
+      db.session.execute(insert(UserRole), [
+         {'user_id': user_ids[values['email']], 'role_id': role_ids[values['role']], 'assigned_at': now,
+          'assigned_by': assigned_by, 'is_active': True}
+         for _, values in accepted
+      ])
+      db.session.commit()
+   except SQLAlchemyError as e:
+      db.session.rollback()
+      for line, values in accepted:
+         report.add_result(line, values['email'], 'error', f"Database error: {e.__class__.__name__}")
+      return
+   for line, values in accepted:
+      report.add_result(line, values['email'], 'created', values['role'])
+
+
+# Function to provision the users of an open CSV or JSON file. The passwords are hashed on the application's
+# bcrypt worker threads, or on the given number of processes (only used by the CLI command: forking a web
+# server's worker process would copy its threads and connections)
+def import_users(stream, file_format='csv', assigned_by=None, default_role='Customer',
+                 batch_size=DEFAULT_BATCH_SIZE, processes=None):
+   if not isinstance(stream, io.TextIOBase):
+      stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+   report = UserImportReport()
+   started = time.perf_counter()
+   role_ids = dict(db.session.execute(select(Role.name, Role.id)).all())
+   rounds = current_app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS)
+   executor = LazyProcessPool(processes) if processes else None
+
+   try:
+      batch = []
+      try:
+         for line, row in iter_user_rows(stream, file_format):
+            report.processed += 1
+            try:
+               batch.append((line, clean_user_row(row, role_ids, default_role)))
+            except ValueError as e:
+               report.add_result(line, str(row.get('email', '')) if isinstance(row, dict) else '', 'error',
+                                 str(e))
+               continue
+            if len(batch) >= batch_size:
+               provision_batch(batch, role_ids, assigned_by, rounds, executor, report)
+               batch = []
+      except (ValueError, csv.Error) as e:
+         # The file itself couldn't be read (e.g. it isn't UTF-8, or is a JSON array with a syntax error)
+         report.add_result(0, '', 'error', f"Invalid file: {e}")
+      if batch:
+         provision_batch(batch, role_ids, assigned_by, rounds, executor, report)
+   finally:
+      if executor is not None:
+         executor.shutdown()
+
+   report.elapsed = time.perf_counter() - started
+   return report
+
+
+# Function to work out the file format from a file name
+def user_format_from_filename(filename):
+   return 'csv' if filename.lower().endswith('.csv') else 'json'
+
+
+# Flask CLI command to provision users from a file, e.g. 'flask --app index import-users staff.csv'
+@click.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'json']), default=None,
+              help='File format (defaults to the file extension).')
+@click.option('--default-role', default='Customer', show_default=True,
+              help='Role given to rows without a role column.')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help='Users per transaction.')
+@click.option('--processes', type=int, default=None, help='Password hashing processes (defaults to CPUs).')
+@with_appcontext
+def import_users_command(path, file_format, default_role, batch_size, processes):
+   file_format = file_format or user_format_from_filename(path)
+   with open(path, encoding='utf-8-sig', newline='') as stream:
+      report = import_users(stream, file_format, default_role=default_role, batch_size=batch_size,
+                            processes=processes or current_app.config.get('PASSWORD_HASH_PROCESSES')
+                            or os.cpu_count() or 1)
+   for result in report.results:
+      if result['status'] != 'created':
+         click.echo(f"Line {result['line']} ({result['email']}): {result['message']}", err=True)
+   click.echo(f"Processed {report.processed} rows: {report.imported} users created, {report.failed} failed "
+              f"in {report.elapsed:.2f}s ({report.rows_per_second:,.0f} rows/s)")
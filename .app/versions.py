@@ -0,0 +1,109 @@
+# Python file to keep track of the version of the data behind the cached pages (catalogue, tasks, ...)
+# and to answer conditional requests (ETag / Last-Modified) without touching the database or the templates
+
+# Import the required modules
+from datetime import datetime, timezone
+from functools import wraps
+import hashlib
+import math
+import time
+import uuid
+
+from flask import current_app, request, session, make_response
+
+from cache import MemoryCache
+
+# Fallback version store used when the application has no version store configured
+_fallback_store = MemoryCache(ttl=0)
+
+
+# Function to get the store the versions are kept in (see cache.create_version_store()). It uses the backend of
+# the catalogue cache, so the versions are shared between worker processes whenever the cache is shared (e.g.
+# the 'sqlite' backend)
+def _store():
+   return current_app.extensions.get('versions') or _fallback_store
+
+
+# Function to create a new version. The modified time is kept in whole seconds (the resolution of the
+# Last-Modified header) and always moves forward, so two changes in the same second get different times
+def _new_version(previous=None):
+   modified = math.ceil(time.time())
+   if previous is not None:
+      modified = max(modified, previous['modified'] + 1)
+   return {'id': uuid.uuid4().hex, 'modified': modified}
+
+
+# Function to get the current version of the named data set, e.g. get_version('catalogue')
+def get_version(name):
+   store = _store()
+   version = store.get(f"version:{name}")
+   if version is None:
+      version = _new_version()
+      store.set(f"version:{name}", version, ttl=0)
+   return version
+
+
+# Function to record that the named data set has changed
+def bump_version(name):
+   store = _store()
+   version = _new_version(store.get(f"version:{name}"))
+   store.set(f"version:{name}", version, ttl=0)
+   return version
+
+
+# Function to build the strong ETag of the current request for the given version. The pages include the
+# navigation bar of the logged-in user, so the user id (read from the session, not the database) is part of it
+def build_etag(version):
+   raw = f"{version['id']}|{request.full_path}|{session.get('_user_id')}"
+   return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+# Function to check a conditional request against the named data sets. Returns (etag, last_modified,
+# not_modified), or None when the request must get a full response without validators
+def check_conditional(names):
+   # Pending flash messages or a remember-me login that hasn't been restored yet make the page
+   # different from the last one the client saw, so those requests always get a full response
+   if (request.method != 'GET' or session.get('_flashes')
+         or (session.get('_user_id') is None and request.cookies.get('remember_token'))):
+      return None
+
+   versions = [get_version(name) for name in names]
+   etag = build_etag({'id': '|'.join(version['id'] for version in versions)})
+   last_modified = datetime.fromtimestamp(max(version['modified'] for version in versions), tz=timezone.utc)
+
+   not_modified = (request.if_none_match.contains_weak(etag) if request.if_none_match
+                   else request.if_modified_since is not None
+                   and last_modified <= request.if_modified_since)
+   return etag, last_modified, not_modified
+
+
+# Function to add the validators (and the caching headers that go with them) to a response
+def add_validators(response, etag, last_modified):
+   response.set_etag(etag)
+   response.last_modified = last_modified
+   response.cache_control.no_cache = True
+   response.cache_control.private = True
+   response.vary.add('Cookie')
+   return response
+
+
+# Decorator to answer GET requests with '304 Not Modified' while the named data sets haven't changed.
+# A matching request returns before the view runs, so no database query or template rendering happens
+def conditional_view(*names):
+   def decorator(view):
+      @wraps(view)
+      def wrapper(*args, **kwargs):
+         conditional = check_conditional(names)
+         if conditional is None:
+            return view(*args, **kwargs)
+
+         etag, last_modified, not_modified = conditional
+         if not_modified:
+            response = current_app.response_class(status=304)
+         else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+               return response
+         return add_validators(response, etag, last_modified)
+      return wrapper
+   return decorator
@@ -0,0 +1,160 @@
+# Python file with the write-behind buffer for non-critical updates, e.g. the time of a user's last login.
+# Instead of a commit in the request (which takes SQLite's write lock on every login and makes catalogue edits
+# wait), the new values are kept in memory and written by a background thread in one batched transaction every
+# WRITE_BEHIND_INTERVAL_MS, or sooner once WRITE_BEHIND_MAX_PENDING rows are waiting. Updates of the same row
+# are coalesced (the latest value of each column wins), and whatever is waiting is written when the buffer is
+# closed (by the ASGI shut-down, or when the process exits). Only values that can be lost in a crash belong
+# here: everything else is committed as usual
+
+# Import the required modules
+import atexit
+from collections import defaultdict
+import os
+import threading
+
+from flask import current_app
+from sqlalchemy import bindparam, inspect, update
+
+from models import db
+
+# Default settings
+DEFAULT_INTERVAL = 1.0     # seconds between two flushes
+DEFAULT_MAX_PENDING = 500  # rows waiting before a flush is started straight away
+DEFAULT_MAX_RETRIES = 3    # failed flushes of a row before its values are dropped
+
+
+# Class of the buffer: the pending values per (model, primary key), and the thread writing them
+class WriteBehindBuffer:
+   def __init__(self, app, interval=DEFAULT_INTERVAL, max_pending=DEFAULT_MAX_PENDING,
+                max_retries=DEFAULT_MAX_RETRIES):
+      self.app = app
+      self.interval = interval
+      self.max_pending = max_pending
+      self.max_retries = max_retries
+      self._pending = {}
+      self._failures = {}
+      self._lock = threading.Lock()
+      self._wakeup = threading.Event()
+      self._closed = False
+      self._thread = None
+      self._pid = None
+
+   # Method to record new values for a row, e.g. update(User, user.id, last_login=now)
+   def update(self, model, key, **values):
+      with self._lock:
+         self._pending.setdefault((model, key), {}).update(values)
+         pending = len(self._pending)
+         closed = self._closed
+         # The thread is started by the first update (in every worker process, as threads don't survive a fork)
+         if not closed and (self._thread is None or self._pid != os.getpid()):
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+      if closed:
+         self.flush()  # the process is shutting down, nothing would write the values later
+      elif pending >= self.max_pending:
+         self._wakeup.set()
+
+   # Method to get the number of rows waiting to be written
+   def pending(self):
+      with self._lock:
+         return len(self._pending)
+
+   # Method to write the waiting values in one transaction (one Core UPDATE statement per model and set of
+   # columns, run with executemany). Returns the number of rows written. A row that no longer exists (e.g. a
+   # deleted user) is simply not updated, as Core doesn't check the matched row counts like the ORM does. When
+   # the flush fails, the values are kept for the next one, up to max_retries times
+   def flush(self):
+      with self._lock:
+         pending, self._pending = self._pending, {}
+      if not pending:
+         return 0
+      batches = defaultdict(list)
+      for (model, key), values in pending.items():
+         batches[(model, tuple(sorted(values)))].append({'b_key': key, **{f'b_{name}': value
+                                                                        for name, value in values.items()}})
+      try:
+         with self.app.app_context():
+            for (model, names), rows in batches.items():
+               db.session.execute(update_statement(model, names), rows)
+            db.session.commit()
+      except Exception:
+         self.app.logger.exception("Write-behind flush of %d rows failed", len(pending))
+         with self.app.app_context():
+            db.session.rollback()
+         self._keep(pending)
+         return 0
+      with self._lock:
+         for row_key in pending:
+            self._failures.pop(row_key, None)
+      return len(pending)
+
+   # Method to put the values of a failed flush back, without overwriting any newer ones recorded in the
+   # meantime. The values of rows that have failed max_retries times are dropped
+   def _keep(self, pending):
+      dropped = 0
+      with self._lock:
+         for row_key, values in pending.items():
+            failures = self._failures[row_key] = self._failures.get(row_key, 0) + 1
+            if failures >= self.max_retries:
+               del self._failures[row_key]
+               dropped += 1
+               continue
+            self._pending[row_key] = {**values, **self._pending.get(row_key, {})}
+      if dropped:
+         self.app.logger.error("Write-behind dropped the values of %d rows after %d failed flushes", dropped,
+                               self.max_retries)
+
+   # Method run by the background thread: flush every interval, or when woken up by a full buffer
+   def _run(self):
+      while not self._closed:
+         self._wakeup.wait(self.interval)
+         self._wakeup.clear()
+         self.flush()
+
+   # Method to stop the background thread and write what is still waiting. Called by the ASGI shut-down, or
+   # when the process exits; it must be called before the application's database goes away (e.g. in scripts
+   # that dispose the engine or delete a temporary database)
+   def close(self):
+      atexit.unregister(self.close)
+      with self._lock:
+         self._closed = True
+         thread = self._thread if self._pid == os.getpid() else None
+      self._wakeup.set()
+      if thread is not None and thread is not threading.current_thread():
+         thread.join(timeout=max(self.interval, 1) * 5)
+      self.flush()
+
+
+# Function to build the UPDATE statement of a model's rows for executemany: the primary key is bound as b_key
+# and every column as b_<name> (bound parameters can't share the names of the columns they set)
+def update_statement(model, names):
+   mapper = inspect(model)
+   return (update(mapper.local_table).where(mapper.primary_key[0] == bindparam('b_key'))
+           .values({mapper.get_property(name).columns[0]: bindparam(f'b_{name}') for name in names}))
+
+
+# Function to update a row in the background through the application's write-behind buffer. Without a buffer
+# (WRITE_BEHIND_ENABLED off) the row is updated and committed straight away
+def defer_update(model, key, **values):
+   buffer = current_app.extensions.get('write_behind')
+   if buffer is not None:
+      buffer.update(model, key, **values)
+      return
+   primary_key = inspect(model).primary_key[0]
+   db.session.execute(update(model).where(primary_key == key).values(**values))
+   db.session.commit()
+
+
+# Function to attach the write-behind buffer to the application (it is drained when the process exits, unless
+# it was closed before)
+def init_write_behind(app):
+   if not app.config.get('WRITE_BEHIND_ENABLED', True):
+      return
+   interval_ms = app.config.get('WRITE_BEHIND_INTERVAL_MS')
+   buffer = app.extensions['write_behind'] = WriteBehindBuffer(
+      app,
+      interval=interval_ms / 1000 if interval_ms else DEFAULT_INTERVAL,
+      max_pending=app.config.get('WRITE_BEHIND_MAX_PENDING', DEFAULT_MAX_PENDING),
+   )
+   atexit.register(buffer.close)